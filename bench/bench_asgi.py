@@ -0,0 +1,117 @@
+# Benchmark for the async server (meals_asgi.py).
+# It starts a slow local NutritionStub and meals_asgi (with uvicorn) in their own processes, sends many POST /dishes
+# requests at once, and meanwhile measures the latency of GET /dishes/{ID} requests.   The POSTs should complete in
+# about (dishes / NUTRITION_CONCURRENCY) x latency, and the GETs should not slow down much while thousands of POSTs
+# wait on the stub.   The requests are sent with plain asyncio streams (one connection per request), so the client
+# itself can keep thousands of requests in flight.   The lookups are not batched (NUTRITION_BATCH_SIZE=1, see
+# nutrition_batcher.py): each dish is one call to the stub, as the time expected for the POSTs assumes.
+#
+# To run:  python bench/bench_asgi.py [dishes] [latency] [concurrency]
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH, '..')
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def waitForPort(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("nothing listening on port %d" % port)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+# request sends one HTTP request on a new connection and returns the status code and the body
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = b"" if body is None else json.dumps(body).encode()
+    head = "%s %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\nContent-Length: %d\r\n" % (method, path,
+                                                                                               len(data))
+    if body is not None:
+        head = head + "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + data)
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1])
+    return status, response.split(b"\r\n\r\n", 1)[1]
+
+
+async def load(port, dishes):
+    status, body = await request(port, "POST", "/dishes", {"name": "warm up"})
+    assert status == 201, body
+    dishID = int(body)
+    getLatencies = []
+    done = asyncio.Event()
+
+    async def reader():
+        while not done.is_set():
+            start = time.perf_counter()
+            status, body = await request(port, "GET", "/dishes/%d" % dishID)
+            assert status == 200, body
+            getLatencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    readers = [asyncio.ensure_future(reader()) for _ in range(4)]
+    await asyncio.sleep(1.0)
+    idle = list(getLatencies)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(request(port, "POST", "/dishes", {"name": "dish %d" % i})
+                                     for i in range(dishes)))
+    postTime = time.perf_counter() - start
+    busy = getLatencies[len(idle):]
+    done.set()
+    await asyncio.gather(*readers)
+    codes = [status for status, _ in results]
+    assert all(code == 201 for code in codes), [code for code in codes if code != 201][:10]
+    return postTime, idle, busy
+
+
+def main(dishes=2000, latency=0.5, concurrency=256):
+    stubPort, port = freePort(), freePort()
+    env = dict(os.environ, LOG_LEVEL="OFF", PORT=str(port), NUTRITION_CONCURRENCY=str(concurrency),
+               NUTRITION_BATCH_SIZE="1",
+               NUTRITION_API_URL="http://127.0.0.1:%d/v1/nutrition" % stubPort)
+    stub = subprocess.Popen([sys.executable, os.path.join(BENCH, "nutrition_stub.py"), str(stubPort), str(latency)],
+                            stdout=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, "meals_asgi.py"], cwd=ROOT, env=env)
+    try:
+        waitForPort(stubPort)
+        waitForPort(port)
+        postTime, idle, busy = asyncio.run(load(port, dishes))
+    finally:
+        server.terminate()
+        stub.terminate()
+        server.wait()
+        stub.wait()
+    print("dishes=%d upstream latency=%.3fs NUTRITION_CONCURRENCY=%d" % (dishes, latency, concurrency))
+    print("all POST /dishes done in %.2fs (at least %.2fs)" % (postTime, math.ceil(dishes / float(concurrency)) *
+                                                               latency))
+    print("GET /dishes/{ID} p50/p99 before: %.1f / %.1f ms (%d requests)" % (
+        percentile(idle, 50) * 1000, percentile(idle, 99) * 1000, len(idle)))
+    print("GET /dishes/{ID} p50/p99 during: %.1f / %.1f ms (%d requests)" % (
+        percentile(busy, 50) * 1000, percentile(busy, 99) * 1000, len(busy)))
+
+
+if __name__ == '__main__':
+    main(*(float(arg) if "." in arg else int(arg) for arg in sys.argv[1:]))
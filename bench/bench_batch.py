@@ -0,0 +1,46 @@
+# Benchmark for POST /dishes/batch (Courses.addCourses).
+# It adds the same number of dishes once one at a time with addCourse (like separate POST /dishes requests) and once
+# with addCourses, against a local nutrition stub that answers each request after a fixed latency.   The batch wall
+# clock time should be close to (dishes / NUTRITION_WORKERS) x latency instead of dishes x latency.
+#
+# To run:  python bench/bench_batch.py [dishes] [latency]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+from nutrition_client import NutritionClient  # noqa: E402
+from nutrition_stub import NutritionStub  # noqa: E402
+
+
+def main(dishes=500, latency=0.05):
+    stub = NutritionStub(latency=latency).start()
+    meals.nutritionClient = NutritionClient("stub", url=stub.url, pool_size=meals.nutritionExecutor._max_workers)
+    meals.nutritionBatcher.client = meals.nutritionClient
+    meals.A = True
+    try:
+        meals.courses = meals.Courses()
+        meals.nutritionCache.clear()
+        serial = min(dishes, 50)  # serial adds are slow.  time a few and extrapolate
+        start = time.perf_counter()
+        for i in range(serial):
+            meals.courses.addCourse("serial dish " + str(i))
+        serialTime = (time.perf_counter() - start) / serial * dishes
+
+        meals.courses = meals.Courses()
+        meals.nutritionCache.clear()
+        names = ["batch dish " + str(i) for i in range(dishes)]
+        start = time.perf_counter()
+        results = meals.courses.addCourses(names)
+        batchTime = time.perf_counter() - start
+        assert all(key > 0 for key in results), results
+    finally:
+        stub.stop()
+    print("dishes=%d upstream latency=%.3fs workers=%d" % (dishes, latency, meals.nutritionExecutor._max_workers))
+    print("one at a time (extrapolated): %8.2fs" % serialTime)
+    print("addCourses:                   %8.2fs" % batchTime)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500, float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
@@ -0,0 +1,41 @@
+# Benchmark for deleting a dish that is used by meals.
+# For 1k .. 100k meals, each dish is used by the same number of meals (fanout), and the benchmark measures the time
+# taken by Courses.deleteCourse, which also updates the meals using the deleted dish.   Since only the affected meals
+# are visited, the cost of a deletion should not depend on the total number of meals.
+#
+# To run:  python bench/bench_dish_delete.py [fanout]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+
+MEALS = [1000, 10000, 100000]
+DELETES = 200
+
+
+def main(fanout=10):
+    meals.A = True
+    print("%10s %10s %22s" % ("meals", "dishes", "deleteCourse (us)"))
+    for n in MEALS:
+        meals.courses = meals.Courses()
+        meals.menus = meals.Menus()
+        dishes = max(3 * n // fanout, 3)
+        for i in range(dishes):
+            meals.courses.insertCourse({"name": "dish" + str(i), "cal": 100.0, "size": 100.0, "sodium": 100,
+                                        "sugar": 1.0})
+        for i in range(n):
+            # meal i uses three consecutive dishes, so each dish is used by about fanout meals
+            first = (3 * i) % dishes
+            meals.menus.addMenu("meal" + str(i), first + 1, (first + 1) % dishes + 1, (first + 2) % dishes + 1)
+        start = time.perf_counter()
+        for ID in range(1, DELETES + 1):
+            meals.courses.deleteCourse(ID)
+        elapsed = (time.perf_counter() - start) / DELETES * 1e6
+        print("%10d %10d %22.1f" % (n, dishes, elapsed))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,79 @@
+# Benchmark of the memory taken by the records of the store.
+# It measures with tracemalloc the bytes per record of n dishes and n meals kept:
+# (1) as one dictionary per record in a dictionary mapping IDs to records, as MemoryTable kept them before it used
+#     columns (without any index)
+# (2) in a MemoryTable without sorted indexes, i.e. the columns plus the indexes by name and by reference
+# (3) in a MemoryTable with the sorted indexes used by range queries (as used by the server)
+#
+# To run:  python bench/bench_memory.py [n]
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from storage import MemoryTable, COURSE_FIELDS, MENU_FIELDS, MENU_REFS, COURSE_SORTED, MENU_SORTED  # noqa: E402
+
+
+def makeCourse(i, rand):
+    return {"name": "dish" + str(i), "ID": None, "cal": rand.uniform(10, 900), "size": 100.0,
+            "sodium": rand.randint(0, 1500), "sugar": rand.uniform(0, 50)}
+
+
+def makeMenu(i, rand, n):
+    return {"name": "meal" + str(i), "ID": None, "appetizer": rand.randint(1, n), "main": rand.randint(1, n),
+            "dessert": rand.randint(1, n), "cal": rand.uniform(30, 2700), "sodium": rand.randint(0, 4500),
+            "sugar": rand.uniform(0, 150)}
+
+
+# measure returns the bytes per record allocated by fill(n) and kept while its result is alive
+def measure(fill, n):
+    gc.collect()
+    tracemalloc.start()
+    kept = fill(n)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / float(n)
+
+
+def dicts(make):
+    def fill(n):
+        rand = random.Random(0)
+        records = {}
+        for i in range(n):
+            record = make(i, rand, n) if make is makeMenu else make(i, rand)
+            record["ID"] = i + 1
+            records[i + 1] = record
+        return records
+    return fill
+
+
+def table(make, fields, refs, sortedFields):
+    def fill(n):
+        rand = random.Random(0)
+        t = MemoryTable(fields, refs, sortedFields)
+        for i in range(n):
+            t.add(make(i, rand, n) if make is makeMenu else make(i, rand))
+        return t
+    return fill
+
+
+def main(n=200000):
+    print("records=%d, bytes per record:" % n)
+    print("%-36s %10s %10s" % ("", "dishes", "meals"))
+    rows = [
+        ("dictionaries (before)", dicts(makeCourse), dicts(makeMenu)),
+        ("MemoryTable, no sorted indexes", table(makeCourse, COURSE_FIELDS, (), ()),
+         table(makeMenu, MENU_FIELDS, MENU_REFS, ())),
+        ("MemoryTable, with sorted indexes", table(makeCourse, COURSE_FIELDS, (), COURSE_SORTED),
+         table(makeMenu, MENU_FIELDS, MENU_REFS, MENU_SORTED)),
+    ]
+    for label, courses, menus in rows:
+        print("%-36s %10.1f %10.1f" % (label, measure(courses, n), measure(menus, n)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,61 @@
+# Benchmark for the dish/meal name index.
+# It fills Courses and Menus with 1k .. 1M records and measures the latency of adding a new dish (the work done by
+# POST /dishes) and of looking up a dish or meal by name (the work done by GET/DELETE /dishes/{name} and
+# /meals/{name}).   With the name index, the latencies should stay flat as the number of records grows.
+#
+# The nutrition API is not called: findCourseInfo is replaced by a function that returns fixed values, so that only
+# the cost of the store itself is measured.
+#
+# To run:  python bench/bench_name_index.py [sizes...]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+REPEAT = 1000
+
+
+def fakeCourseInfo(name):
+    return 100.0, 100.0, 100, 1.0
+
+
+# fill returns a Courses and a Menus instance holding n dishes and n meals
+def fill(n):
+    courses = meals.Courses()
+    for i in range(n):
+        courses.insertCourse({"name": "dish" + str(i), "ID": i + 1, "cal": 100.0, "size": 100.0,
+                              "sodium": 100, "sugar": 1.0})
+    meals.courses = courses
+    menus = meals.Menus()
+    for i in range(n):
+        menus.table.add({"name": "meal" + str(i), "ID": None, "appetizer": 1, "main": 2, "dessert": 3,
+                         "cal": 300.0, "sodium": 300, "sugar": 3.0})
+    return courses, menus
+
+
+# timeit returns the mean latency in microseconds of calling fn(i) for i in range(REPEAT)
+def timeit(fn):
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        fn(i)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def main(sizes):
+    meals.findCourseInfo = fakeCourseInfo
+    meals.A = True
+    print("%10s %15s %17s %17s" % ("records", "addCourse (us)", "dish lookup (us)", "meal lookup (us)"))
+    for n in sizes:
+        courses, menus = fill(n)
+        add = timeit(lambda i: courses.addCourse("new dish" + str(i)))
+        dishLookup = timeit(lambda i: courses.findCourseIDbyName("dish" + str((i * 7919) % n)))
+        mealLookup = timeit(lambda i: menus.findMenuIDbyName("meal" + str((i * 7919) % n)))
+        print("%10d %15.2f %17.2f %17.2f" % (n, add, dishLookup, mealLookup))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,52 @@
+# Benchmark for the partial updates of meals (PATCH /meals/{ID}, see Menus.patchMenu).
+# It adds dishes and meals, then times n small edits of the meals done with Menus.addMenu (as PUT does: all the fields,
+# with the three dishes looked up and the totals recomputed) and with Menus.patchMenu: changing only the name, and
+# changing only the main dish.   It uses the store chosen by STORE_BACKEND (see storage.makeTables), e.g.
+# STORE_BACKEND=sqlite STORE_PATH=/tmp/bench.db python bench/bench_patch.py
+#
+# To run:  python bench/bench_patch.py [n]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+
+
+def timeEdits(edit, n):
+    start = time.perf_counter()
+    for i in range(n):
+        edit(i)
+    return (time.perf_counter() - start) / n
+
+
+def main(n=20000):
+    rand = random.Random(0)
+    meals.createApp()
+    dishes = 1000
+    meals.courses.insertCourses([{"name": "dish" + str(i), "ID": None, "cal": rand.uniform(10, 900), "size": 100.0,
+                                  "sodium": rand.randint(0, 1500), "sugar": rand.uniform(0, 50)}
+                                 for i in range(dishes)])
+    meals.menus.importMenus([{"name": "meal" + str(i), "appetizer": 1, "main": 2, "dessert": 3} for i in range(100)])
+    menus = [menu for ID, menu in sorted(meals.menus.listMenus().items())]
+    IDs = [menu["ID"] for menu in menus]
+
+    def put(i):  # the client sends all the fields of the meal
+        meal = menus[i % len(menus)]
+        meals.menus.addMenu("put" + str(i), meal["appetizer"], meal["main"], meal["dessert"], meal["ID"])
+
+    def patchName(i):
+        meals.menus.patchMenu(IDs[i % len(IDs)], {"name": "patch" + str(i)})
+
+    def patchMain(i):
+        meals.menus.patchMenu(IDs[i % len(IDs)], {"main": i % dishes + 1})
+
+    print("edits=%d, store=%s, microseconds per edit:" % (n, os.environ.get("STORE_BACKEND", "memory")))
+    print("PUT (addMenu), rename:     %8.1f" % (timeEdits(put, n) * 1e6))
+    print("PATCH, rename:             %8.1f" % (timeEdits(patchName, n) * 1e6))
+    print("PATCH, change the main:    %8.1f" % (timeEdits(patchMain, n) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,98 @@
+# Benchmark for the batching of nutrition lookups into combined queries (see nutrition_batcher.py).
+# A burst of lookups of different dishes is made at once, against a local nutrition stub that answers a combined query
+# "a and b and ..." with one item per food, once with QueryBatcher turned off and once on, and the same with the async
+# client (AsyncQueryBatcher).   It checks that every dish gets the nutrition the stub gives it, including dishes whose
+# names cannot be batched ("... and ...") and dishes the stub does not recognize (looked up again on their own), and
+# prints the number of calls made to the stub and the time taken.
+#
+# To run:  python bench/bench_query_batch.py [dishes] [latency]
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from meal_exceptions import DishNotDefined  # noqa: E402
+from nutrition_async import AsyncNutritionClient, AsyncQueryBatcher  # noqa: E402
+from nutrition_batcher import QueryBatcher  # noqa: E402
+from nutrition_client import NutritionClient, sumItems  # noqa: E402
+from nutrition_stub import NutritionStub, stubItem  # noqa: E402
+
+
+# names returns the names of the dishes looked up: mostly single foods, and a few that are not batched or not known
+def names(dishes, label):
+    result = []
+    for i in range(dishes):
+        if i % 10 == 3:
+            result.append("%s dish %d and rice" % (label, i))
+        elif i % 10 == 7:
+            result.append("%s unknown %d" % (label, i))
+        else:
+            result.append("%s dish %d" % (label, i))
+    return result
+
+
+# expected returns what a lookup of the dish called name returns from the stub
+def expected(name):
+    if "unknown" in name:
+        return DishNotDefined
+    return sumItems([stubItem(food.strip()) for food in name.split(" and ")])
+
+
+def lookupOrError(batcher, name):
+    try:
+        return batcher.lookup(name)
+    except DishNotDefined:
+        return DishNotDefined
+
+
+def runThreads(stub, dishes, max_items):
+    client = NutritionClient("stub", url=stub.url, pool_size=dishes)
+    batcher = QueryBatcher(client, window=0.005, max_items=max_items)
+    todo = names(dishes, "threads %d" % max_items)
+    calls = stub.calls
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=dishes) as executor:
+        results = list(executor.map(lambda name: lookupOrError(batcher, name), todo))
+    elapsed = time.perf_counter() - start
+    assert results == [expected(name) for name in todo]
+    client.close()
+    return stub.calls - calls, elapsed
+
+
+async def lookupOrErrorAsync(batcher, name):
+    try:
+        return await batcher.lookup(name)
+    except DishNotDefined:
+        return DishNotDefined
+
+
+async def runAsync(stub, dishes, max_items):
+    client = AsyncNutritionClient("stub", url=stub.url, max_concurrency=dishes)
+    batcher = AsyncQueryBatcher(client, window=0.005, max_items=max_items)
+    todo = names(dishes, "async %d" % max_items)
+    calls = stub.calls
+    start = time.perf_counter()
+    results = await asyncio.gather(*(lookupOrErrorAsync(batcher, name) for name in todo))
+    elapsed = time.perf_counter() - start
+    assert results == [expected(name) for name in todo]
+    await client.close()
+    return stub.calls - calls, elapsed
+
+
+def main(dishes=200, latency=0.05):
+    stub = NutritionStub(latency=latency).start()
+    try:
+        print("dishes=%d upstream latency=%.3fs" % (dishes, latency))
+        for max_items in (1, 8, 16):
+            calls, elapsed = runThreads(stub, dishes, max_items)
+            print("threads  max_items=%-3d %5d calls to the API  %.2fs" % (max_items, calls, elapsed))
+            calls, elapsed = asyncio.run(runAsync(stub, dishes, max_items))
+            print("asyncio  max_items=%-3d %5d calls to the API  %.2fs" % (max_items, calls, elapsed))
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main(*(float(arg) if "." in arg else int(arg) for arg in sys.argv[1:3]))
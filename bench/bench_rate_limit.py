@@ -0,0 +1,62 @@
+# Benchmark for the rate limiting of the calls to the nutrition API (see rate_limit.py).
+# A local nutrition stub answers at most quota requests per second, and 429 to the others.   A batch of dishes is
+# added with addCourses (BULK lookups) while single dishes are added with addCourse (INTERACTIVE lookups), once with
+# the calls not limited and once with a RateLimiter at the quota.   Without the limiter, the lookups over the quota
+# fail (-4) once their retries are used up; with it, all of them succeed, and the single dishes do not wait for the
+# whole batch.
+#
+# To run:  python bench/bench_rate_limit.py [dishes] [quota]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+from nutrition_client import NutritionClient  # noqa: E402
+from nutrition_stub import NutritionStub  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+
+
+def run(label, stub, limiter, dishes):
+    meals.nutritionClient = NutritionClient("stub", url=stub.url, pool_size=meals.nutritionExecutor._max_workers,
+                                            limiter=limiter, queue_timeout=60.0)
+    meals.nutritionBatcher.client = meals.nutritionClient
+    meals.courses = meals.Courses()
+    meals.nutritionCache.clear()
+    stub.rejected = 0
+    singles = []
+
+    def addSingles():
+        time.sleep(0.2)  # once the batch is queued
+        for i in range(5):
+            start = time.perf_counter()
+            key = meals.courses.addCourse("%s single %d" % (label, i))
+            singles.append((key, time.perf_counter() - start))
+
+    thread = threading.Thread(target=addSingles)
+    thread.start()
+    start = time.perf_counter()
+    results = meals.courses.addCourses(["%s batch %d" % (label, i) for i in range(dishes)])
+    batchTime = time.perf_counter() - start
+    thread.join()
+    added = sum(1 for key in results if key > 0)
+    print("%-12s batch: %d/%d added in %.2fs, 429s=%d; singles: %d/5 added, latency max %.2fs" % (
+        label, added, dishes, batchTime, stub.rejected, sum(1 for key, _ in singles if key > 0),
+        max(latency for _, latency in singles)))
+
+
+def main(dishes=300, quota=50):
+    stub = NutritionStub(latency=0.01, quota=quota).start()
+    meals.A = True
+    meals.nutritionBatcher.max_items = 1  # one call per dish, to measure the limiter alone
+    try:
+        run("unlimited", stub, None, dishes)
+        time.sleep(1.0)  # a new quota window
+        run("limited", stub, RateLimiter(quota * 0.9, burst=5), dishes)
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
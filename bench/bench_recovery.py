@@ -0,0 +1,55 @@
+# Benchmark for recovering the dishes and meals from the journal (see persistence.py) on startup.
+# It writes n dishes and n meals through journaled MemoryTables, with a snapshot taken before the last tail meals so
+# that they (the log tail) have to be replayed, and then measures how long a restart takes to recover the tables.
+#
+# To run:  python bench/bench_recovery.py [n] [tail]
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from persistence import Journal  # noqa: E402
+from storage import MemoryTable, COURSE_FIELDS, MENU_FIELDS, MENU_REFS  # noqa: E402
+
+
+def openTables(directory, snapshot_every):
+    journal = Journal(directory, snapshot_every=snapshot_every)
+    tables = {"courses": MemoryTable(COURSE_FIELDS, name="courses", journal=journal),
+              "menus": MemoryTable(MENU_FIELDS, MENU_REFS, name="menus", journal=journal)}
+    replayed = journal.recover(tables)
+    return journal, tables, replayed
+
+
+def main(n=1000000, tail=100000):
+    directory = tempfile.mkdtemp(prefix="bench_recovery")
+    try:
+        journal, tables, _ = openTables(directory, snapshot_every=4 * n)  # no automatic snapshots
+        start = time.perf_counter()
+        for i in range(n):
+            tables["courses"].add({"name": "dish" + str(i), "ID": None, "cal": 100.5, "size": 100.0,
+                                   "sodium": 300, "sugar": 1.5})
+        for i in range(n):
+            if i == n - tail:
+                journal.snapshot()  # the last tail meals are only in the log
+            tables["menus"].add({"name": "meal" + str(i), "ID": None, "appetizer": 1, "main": 2, "dessert": 3,
+                                 "cal": 301.5, "sodium": 900, "sugar": 4.5})
+        writeTime = time.perf_counter() - start
+        journal.close()
+
+        start = time.perf_counter()
+        journal, tables, replayed = openTables(directory, snapshot_every=4 * n)
+        recoverTime = time.perf_counter() - start
+        journal.close()
+        assert len(tables["courses"]) == n and len(tables["menus"]) == n
+        assert tables["menus"].findIDbyName("meal" + str(n - 1)) == n
+    finally:
+        shutil.rmtree(directory)
+    print("records=%d (dishes + meals)  log tail replayed=%d" % (2 * n, replayed))
+    print("write time:    %6.2fs" % writeTime)
+    print("recovery time: %6.2fs" % recoverTime)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
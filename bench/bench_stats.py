@@ -0,0 +1,77 @@
+# Benchmark for GET /stats (see meals.Stats and table_stats.py).
+# It adds n dishes and n meals, then compares GET /stats, which reads the aggregates kept by the tables, with what
+# clients did before: GET /dishes and GET /meals, and computing the same statistics from all the records.   It also
+# measures what keeping the aggregates costs the writes: the time to add the dishes one by one, with and without them.
+#
+# To run:  python bench/bench_stats.py [n]
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+from storage import MemoryTable, COURSE_FIELDS, COURSE_SORTED, STATS_FIELDS  # noqa: E402
+
+
+def makeCourse(i, rand):
+    return {"name": "dish" + str(i), "ID": None, "cal": rand.uniform(10, 900), "size": 100.0,
+            "sodium": rand.randint(0, 1500), "sugar": rand.uniform(0, 50)}
+
+
+# clientStats computes, from the records, the statistics GET /stats returns (the nearest-rank percentiles exactly)
+def clientStats(records):
+    stats = {"count": len(records)}
+    for field in STATS_FIELDS:
+        values = sorted(record[field] for record in records if record[field] is not None)
+        stats[field] = {"mean": statistics.fmean(values), "min": values[0], "max": values[-1],
+                        "p50": values[math.ceil(0.5 * len(values)) - 1],
+                        "p99": values[math.ceil(0.99 * len(values)) - 1]}
+    return stats
+
+
+def timeAdds(statsFields, n):
+    rand = random.Random(0)
+    table = MemoryTable(COURSE_FIELDS, sortedFields=COURSE_SORTED, statsFields=statsFields)
+    start = time.perf_counter()
+    for i in range(n):
+        table.add(makeCourse(i, rand))
+    return (time.perf_counter() - start) / n
+
+
+def main(n=100000):
+    rand = random.Random(1)
+    meals.createApp()
+    meals.courses.insertCourses([makeCourse(i, rand) for i in range(n)])
+    meals.menus.importMenus([{"name": "meal" + str(i), "appetizer": rand.randint(1, n), "main": rand.randint(1, n),
+                              "dessert": rand.randint(1, n // 10)} for i in range(n)])
+    client = meals.app.test_client()
+
+    start = time.perf_counter()
+    response = client.get("/stats")
+    statsTime = time.perf_counter() - start
+    stats = response.get_json()
+
+    start = time.perf_counter()
+    dishes = clientStats(list(json.loads(client.get("/dishes").data).values()))
+    clientStats(list(json.loads(client.get("/meals").data).values()))
+    downloadTime = time.perf_counter() - start
+
+    print("records=%d (dishes + meals)" % (2 * n))
+    print("GET /stats:                         %8.2f ms" % (statsTime * 1000))
+    print("GET /dishes + /meals and aggregate: %8.2f ms" % (downloadTime * 1000))
+    for field in STATS_FIELDS:
+        print("dishes %-6s p50 %8.2f (exact %8.2f)   p99 %8.2f (exact %8.2f)" % (
+            field, stats["dishes"][field]["p50"], dishes[field]["p50"], stats["dishes"][field]["p99"],
+            dishes[field]["p99"]))
+    print("most used dishes: %s" % [(dish["ID"], dish["meals"]) for dish in stats["meals"]["top_dishes"][:3]])
+    adds = min(n, 50000)
+    print("add a dish: %.2f us without aggregates, %.2f us with them" % (timeAdds((), adds) * 1e6,
+                                                                        timeAdds(STATS_FIELDS, adds) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,51 @@
+# Benchmark for the meal optimizer (POST /meals/suggest).
+# It generates dishes with random nutrients and measures how long bestTriples takes to find the 10 meals with the least
+# sugar under calorie and sodium budgets, for 1k to 10k dishes.   For the smallest size the result is checked against
+# a brute force search over all the triples.
+#
+# To run:  python bench/bench_suggest.py [sizes...]
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from meal_optimizer import DishColumns, bestTriples  # noqa: E402
+
+SIZES = [100, 1000, 10000]
+
+
+def makeDishes(n, seed=0):
+    rand = random.Random(seed)
+    return [{"ID": i + 1, "cal": rand.uniform(20, 900), "sodium": rand.uniform(0, 1500), "sugar": rand.uniform(0, 60)}
+            for i in range(n)]
+
+
+def bruteForce(dishes, high, k):
+    sums = []
+    for triple in itertools.combinations(dishes, 3):
+        if all(sum(d[f] for d in triple) <= bound for f, bound in high.items()):
+            sums.append(sum(d["sugar"] for d in triple))
+    return sorted(sums)[:k]
+
+
+def main(sizes):
+    high = {"cal": 800, "sodium": 1500}
+    k = 10
+    print("%10s %15s" % ("dishes", "bestTriples (ms)"))
+    for n in sizes:
+        dishes = makeDishes(n)
+        columns = DishColumns(dishes)
+        start = time.perf_counter()
+        result = bestTriples(columns, "sugar", high=high, k=k)
+        elapsed = (time.perf_counter() - start) * 1000
+        if n <= 100:
+            expected = bruteForce(dishes, high, k)
+            assert [round(r[0], 6) for r in result] == [round(s, 6) for s in expected]
+        print("%10d %15.1f" % (n, elapsed))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
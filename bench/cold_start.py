@@ -0,0 +1,125 @@
+# Measurement of the cold start of the server: the time from starting its process to its first successful response
+# (200 to GET /dishes), and the time until it accepts connections.   It starts the server in its own process:
+# (1) lazy:  flask run with FLASK_APP=meals.py, which loads the store when it serves its first request
+# (2) eager: flask run with FLASK_APP='meals:createApp()', which loads it before it accepts connections
+# (3) eager with PRELOAD_CACHES=1, which also fills the caches (see meals.createApp)
+# (4) asgi:  uvicorn meals_asgi:app
+# each runs times, with a journal (JOURNAL_DIR) holding n dishes and n meals to recover (none if n is 0).
+# With --image TAG, it also builds the Docker image (from the Dockerfile) and reports its size.
+#
+# To run:  python bench/cold_start.py [n] [times] [--image TAG]
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH, '..')
+sys.path.insert(0, ROOT)
+from persistence import Journal  # noqa: E402
+from storage import MemoryTable, COURSE_FIELDS, MENU_FIELDS, MENU_REFS  # noqa: E402
+
+SERVERS = [
+    ("lazy", {"FLASK_APP": "meals.py"}, ["-m", "flask", "run"]),
+    ("eager", {"FLASK_APP": "meals:createApp()"}, ["-m", "flask", "run"]),
+    ("eager+preload", {"FLASK_APP": "meals:createApp()", "PRELOAD_CACHES": "1"}, ["-m", "flask", "run"]),
+    ("asgi", {}, ["-m", "uvicorn", "meals_asgi:app", "--host", "127.0.0.1", "--log-level", "warning"]),
+]
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# writeJournal writes n dishes and n meals to a journal in directory, as the server would
+def writeJournal(directory, n):
+    journal = Journal(directory)
+    courses = MemoryTable(COURSE_FIELDS, name="courses", journal=journal)
+    menus = MemoryTable(MENU_FIELDS, MENU_REFS, name="menus", journal=journal)
+    journal.recover({"courses": courses, "menus": menus})
+    courses.addMany([{"name": "dish" + str(i), "ID": None, "cal": 100.5, "size": 100.0, "sodium": 300, "sugar": 1.5}
+                     for i in range(n)])
+    menus.addMany([{"name": "meal" + str(i), "ID": None, "appetizer": 1, "main": 2, "dessert": 3, "cal": 301.5,
+                    "sodium": 900, "sugar": 4.5} for i in range(n)])
+    journal.close()
+
+
+# start runs the server and returns (seconds until it accepts connections, seconds until its first 200)
+def start(env, args, journalDir, timeout=120.0):
+    port = freePort()
+    env = dict(os.environ, FLASK_RUN_PORT=str(port), FLASK_RUN_HOST="127.0.0.1", **env)
+    if journalDir:
+        env["JOURNAL_DIR"] = journalDir
+    if "uvicorn" in args:
+        args = args + ["--port", str(port)]
+    begin = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    listening = None
+    try:
+        while time.perf_counter() - begin < timeout:
+            if listening is None:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    listening = time.perf_counter() - begin
+                except OSError:
+                    time.sleep(0.005)
+                    continue
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:%d/dishes?limit=1" % port, timeout=timeout) as response:
+                    if response.status == 200:
+                        return listening, time.perf_counter() - begin
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("no response from the server in %.0fs" % timeout)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# imageSize builds the image tagged tag and returns its size in bytes, or None if docker is not available
+def imageSize(tag):
+    if shutil.which("docker") is None:
+        return None
+    subprocess.run(["docker", "build", "-t", tag, ROOT], check=True)
+    out = subprocess.run(["docker", "image", "inspect", "--format", "{{.Size}}", tag], check=True,
+                         capture_output=True, text=True).stdout
+    return int(out.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the server")
+    parser.add_argument("n", nargs="?", type=int, default=0, help="dishes and meals in the journal")
+    parser.add_argument("times", nargs="?", type=int, default=3)
+    parser.add_argument("--image", help="build the Docker image with this tag and report its size")
+    args = parser.parse_intermixed_args()
+    journalDir = None
+    if args.n:
+        journalDir = tempfile.mkdtemp(prefix="cold_start")
+        writeJournal(journalDir, args.n)
+    try:
+        print("records=%d (dishes + meals in the journal), best of %d" % (2 * args.n, args.times))
+        print("%-16s %14s %16s" % ("", "listening (s)", "first 200 (s)"))
+        for label, env, serverArgs in SERVERS:
+            runs = [start(env, serverArgs, journalDir) for _ in range(args.times)]
+            print("%-16s %14.3f %16.3f" % (label, min(r[0] for r in runs), min(r[1] for r in runs)))
+    finally:
+        if journalDir:
+            shutil.rmtree(journalDir)
+    if args.image:
+        size = imageSize(args.image)
+        if size is None:
+            print("image size: docker is not available")
+        else:
+            print("image size: %.1f MB" % (size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# End-to-end load generator for the dishes / meals API.
+# It serves meals.app with a threaded server on localhost, with the nutrition API replaced by a local NutritionStub,
+# creates an initial catalog, and then has several client threads send a mix of POST, GET, PUT and DELETE requests to
+# /dishes and /meals for a fixed time.   run returns, for each kind of request, the number sent, the throughput and
+# the p50 / p99 latencies, plus the totals.   Everything runs offline.
+#
+# To run:  python bench/loadgen.py [seconds] [clients] [upstream latency]
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+from nutrition_client import NutritionClient  # noqa: E402
+from nutrition_stub import NutritionStub  # noqa: E402
+
+# the kinds of requests sent, with their weights in the mix
+MIX = [
+    ("GET /dishes/{ID}", 40),
+    ("GET /meals/{ID}", 20),
+    ("GET /dishes?limit=50", 5),
+    ("POST /dishes", 10),
+    ("POST /meals", 10),
+    ("PUT /meals/{ID}", 10),
+    ("DELETE /dishes/{ID}", 3),
+    ("DELETE /meals/{ID}", 2),
+]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Client:
+    def __init__(self, base, seed, catalog):
+        self.base = base
+        self.session = requests.Session()
+        self.rand = random.Random(seed)
+        self.catalog = catalog  # shared lists of known dish and meal IDs
+        self.latencies = {kind: [] for kind, _ in MIX}
+        self.errors = 0
+        self.counter = 0
+
+    def newName(self, prefix):
+        self.counter = self.counter + 1
+        return "{} {} {}".format(prefix, id(self), self.counter)
+
+    def pick(self, IDs):
+        return self.rand.choice(IDs) if IDs else 1
+
+    def send(self, kind):
+        dishes, meals_ = self.catalog["dishes"], self.catalog["meals"]
+        method = kind.split()[0]
+        body = None
+        if kind == "GET /dishes/{ID}" or kind == "DELETE /dishes/{ID}":
+            path = "/dishes/{}".format(self.pick(dishes))
+        elif kind == "GET /meals/{ID}" or kind == "DELETE /meals/{ID}":
+            path = "/meals/{}".format(self.pick(meals_))
+        elif kind == "GET /dishes?limit=50":
+            path = "/dishes?limit=50&after={}".format(self.pick(dishes))
+        elif kind == "POST /dishes":
+            path, body = "/dishes", {"name": self.newName("dish")}
+        else:  # POST /meals or PUT /meals/{ID}
+            path = "/meals" if method == "POST" else "/meals/{}".format(self.pick(meals_))
+            body = {"name": self.newName("meal"), "appetizer": self.pick(dishes), "main": self.pick(dishes),
+                    "dessert": self.pick(dishes)}
+        start = time.perf_counter()
+        response = self.session.request(method, self.base + path, json=body)
+        self.latencies[kind].append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            self.errors = self.errors + 1
+        elif method == "POST" and response.status_code == 201:
+            (dishes if path == "/dishes" else meals_).append(response.json())
+
+    def loop(self, until):
+        kinds = [kind for kind, _ in MIX]
+        weights = [weight for _, weight in MIX]
+        while time.perf_counter() < until:
+            self.send(self.rand.choices(kinds, weights)[0])
+
+
+def run(seconds=10.0, clients=8, latency=0.01, dishes=200, mealCount=200, seed=0):
+    stub = NutritionStub(latency=latency, seed=seed).start()
+    meals.nutritionClient = NutritionClient("stub", url=stub.url)
+    meals.nutritionBatcher.client = meals.nutritionClient
+    meals.nutritionCache.clear()
+    server = make_server("127.0.0.1", 0, meals.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        requests.get(base + "/dishes")  # initializes the store
+        session = requests.Session()
+        rand = random.Random(seed)
+        names = ["load dish {}".format(i) for i in range(dishes)]
+        created = session.post(base + "/dishes/batch", json={"names": names}).json()
+        catalog = {"dishes": [entry["ID"] for entry in created if entry["ID"] > 0], "meals": []}
+        for i in range(mealCount):
+            response = session.post(base + "/meals", json={"name": "load meal {}".format(i),
+                                                           "appetizer": rand.choice(catalog["dishes"]),
+                                                           "main": rand.choice(catalog["dishes"]),
+                                                           "dessert": rand.choice(catalog["dishes"])})
+            if response.status_code == 201:
+                catalog["meals"].append(response.json())
+        workers = [Client(base, seed + i + 1, catalog) for i in range(clients)]
+        until = time.perf_counter() + seconds
+        threads = [threading.Thread(target=worker.loop, args=(until,)) for worker in workers]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        stub.stop()
+    results = {}
+    everything = []
+    for kind, _ in MIX:
+        latencies = [l for worker in workers for l in worker.latencies[kind]]
+        everything.extend(latencies)
+        results[kind] = summary(latencies, elapsed)
+    results["total"] = summary(everything, elapsed)
+    results["total"]["errors_5xx"] = sum(worker.errors for worker in workers)
+    results["config"] = {"seconds": seconds, "clients": clients, "upstream_latency_s": latency,
+                         "initial_dishes": dishes, "initial_meals": mealCount}
+    return results
+
+
+def summary(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": None if not latencies else round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": None if not latencies else round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def main(seconds=10.0, clients=8, latency=0.01):
+    results = run(seconds, clients, latency)
+    print("%-22s %9s %10s %9s %9s" % ("request", "count", "req/s", "p50 ms", "p99 ms"))
+    for kind, r in results.items():
+        if kind != "config":
+            print("%-22s %9d %10.1f %9s %9s" % (kind, r["requests"], r["throughput_rps"], r["p50_ms"], r["p99_ms"]))
+    print("5xx errors:", results["total"]["errors_5xx"])
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(float(args[0]) if len(args) > 0 else 10.0, int(args[1]) if len(args) > 1 else 8,
+         float(args[2]) if len(args) > 2 else 0.01)
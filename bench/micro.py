@@ -0,0 +1,80 @@
+# Microbenchmarks of the store: Courses.addCourse, Courses.findCourseIDbyName, Menus.addMenu and makeMenu, with
+# 1k, 100k and 1M dishes and meals already in the store.
+#
+# The nutrition API is not called: findCourseInfo is replaced by a function returning fixed values, so only the cost of
+# the store is measured.   run returns the mean latency of each operation, in microseconds, for each size.
+#
+# To run:  python bench/micro.py [sizes...]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+
+SIZES = [1000, 100000, 1000000]
+REPEAT = 2000
+
+
+def fakeCourseInfo(name):
+    return 250.0, 100.0, 400, 3.5
+
+
+# fill sets meals.courses and meals.menus to a store holding n dishes and n meals
+def fill(n, rand):
+    meals.courses = meals.Courses()
+    meals.menus = meals.Menus()
+    for i in range(n):
+        meals.courses.insertCourse({"name": "dish" + str(i), "cal": rand.uniform(10, 900), "size": 100.0,
+                                    "sodium": rand.randint(0, 1500), "sugar": rand.uniform(0, 50)})
+    for i in range(n):
+        meals.menus.addMenu("meal" + str(i), rand.randint(1, n), rand.randint(1, n), rand.randint(1, n))
+
+
+# timeit returns the mean latency in microseconds of fn(i) for i in range(REPEAT)
+def timeit(fn):
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        fn(i)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def run(sizes=SIZES, seed=0):
+    findCourseInfo = meals.findCourseInfo
+    meals.findCourseInfo = fakeCourseInfo
+    meals.A = True
+    results = {}
+    try:
+        for n in sizes:
+            rand = random.Random(seed)
+            start = time.perf_counter()
+            fill(n, rand)
+            fillTime = time.perf_counter() - start
+            IDs = [rand.randint(1, n) for i in range(REPEAT * 3)]
+            results[str(n)] = {
+                "fill_s": round(fillTime, 3),
+                "addCourse_us": timeit(lambda i: meals.courses.addCourse("new dish" + str(i))),
+                "findCourseIDbyName_us": timeit(lambda i: meals.courses.findCourseIDbyName("dish" + str(IDs[i] - 1))),
+                "addMenu_us": timeit(lambda i: meals.menus.addMenu("new meal" + str(i), IDs[3 * i], IDs[3 * i + 1],
+                                                                   IDs[3 * i + 2])),
+                "makeMenu_us": timeit(lambda i: meals.makeMenu("menu" + str(i), None, IDs[3 * i], IDs[3 * i + 1],
+                                                               IDs[3 * i + 2])),
+            }
+    finally:
+        meals.findCourseInfo = findCourseInfo
+    return results
+
+
+def main(sizes):
+    results = run(sizes)
+    print("%10s %10s %15s %22s %13s %14s" % ("records", "fill (s)", "addCourse (us)", "findCourseIDbyName (us)",
+                                             "addMenu (us)", "makeMenu (us)"))
+    for n, r in results.items():
+        print("%10s %10.1f %15.2f %22.2f %13.2f %14.2f" % (n, r["fill_s"], r["addCourse_us"],
+                                                           r["findCourseIDbyName_us"], r["addMenu_us"],
+                                                           r["makeMenu_us"]))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,124 @@
+# NutritionStub is a local stand-in for the NINJA nutrition API (api.api-ninjas.com/v1/nutrition) used by the
+# benchmarks, so that they run offline and do not use any of the API quota.
+#
+# GET <url>?query=q returns one item for each food in q, where the foods in q are separated by " and " (like the real
+# API does for "cereal and eggs").   The values of an item are derived from its name, so the same food always gets the
+# same nutrition.   The stub can be configured to:
+#   latency      seconds to wait before answering each request
+#   error_rate   fraction of requests answered with 502
+#   empty_rate   fraction of requests answered with an empty list (dish not recognized)
+#   quota        requests answered per second (like the quota of the real API).   The requests over the quota are
+#                answered with 429 and "Retry-After: 1".   None for no quota.
+# The foods whose names contain "unknown" are not recognized: they get no item (so a query of only such foods is
+# answered with an empty list).   calls counts the requests received.
+#
+# To run it standalone:  python bench/nutrition_stub.py [port] [latency]
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# stubItem returns the item the stub returns for the food called name
+def stubItem(name):
+    h = zlib.crc32(name.encode())
+    return {
+        "name": name,
+        "calories": float(h % 900) + 0.5,
+        "serving_size_g": 100.0,
+        "sodium_mg": h % 1500,
+        "sugar_g": float(h % 50) / 2,
+    }
+
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 1024  # the default (5) refuses connections when many clients connect at once
+
+
+class NutritionStub:
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, empty_rate=0.0, seed=0, quota=None):
+        self.latency = latency
+        self.quota = quota
+        self.window = 0  # the second counted in windowCalls
+        self.windowCalls = 0
+        self.rejected = 0
+        self.error_rate = error_rate
+        self.empty_rate = empty_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.queries = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep connections alive, like the real API
+            disable_nagle_algorithm = True  # the headers and body are written separately
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query).get("query", [""])[0]
+                with stub.lock:
+                    stub.calls = stub.calls + 1
+                    stub.queries.append(query)
+                    draw = stub.random.random()
+                    limited = False
+                    if stub.quota is not None:
+                        second = int(time.monotonic())
+                        if second != stub.window:
+                            stub.window = second
+                            stub.windowCalls = 0
+                        stub.windowCalls = stub.windowCalls + 1
+                        limited = stub.windowCalls > stub.quota
+                        if limited:
+                            stub.rejected = stub.rejected + 1
+                if limited:
+                    self.reply(429, {"error": "quota exceeded"}, {"Retry-After": "1"})
+                    return
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if draw < stub.error_rate:
+                    self.reply(502, {"error": "stub error"})
+                elif draw < stub.error_rate + stub.empty_rate:
+                    self.reply(200, [])
+                else:
+                    self.reply(200, [stubItem(food.strip()) for food in query.split(" and ")
+                                     if food.strip() and "unknown" not in food])
+
+            def reply(self, code, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = StubServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d/v1/nutrition" % self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    stub = NutritionStub(port=port, latency=latency)
+    print("nutrition stub listening on", stub.url)
+    sys.stdout.flush()
+    stub.server.serve_forever()
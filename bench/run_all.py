@@ -0,0 +1,93 @@
+# Runs the benchmark suite (the microbenchmarks in micro.py and the load test in loadgen.py) and writes the results as
+# JSON, so that the results of two commits can be compared.   Everything runs offline, against a local nutrition stub.
+#
+# To run:      python bench/run_all.py [--sizes 1000 100000 1000000] [--seconds 10] [--clients 8] [--out FILE]
+#              The results are written to FILE, by default bench/results/<commit>.json
+# To compare:  python bench/run_all.py --compare OLD.json NEW.json [--threshold 0.1]
+#              prints every latency that got worse by more than threshold (10%) and every throughput that dropped by
+#              more than threshold, and exits with status 1 if there is any.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# flatten turns the nested results into a dictionary mapping "a/b/c" paths to numbers
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = prefix + "/" + key if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(oldPath, newPath, threshold):
+    with open(oldPath) as f:
+        old = flatten(json.load(f))
+    with open(newPath) as f:
+        new = flatten(json.load(f))
+    regressions = 0
+    for path in sorted(set(old) & set(new)):
+        if path.startswith("config") or "/config/" in path or not old[path]:
+            continue
+        change = (new[path] - old[path]) / old[path]
+        worse = (change > threshold and (path.endswith("_us") or path.endswith("_ms") or path.endswith("_s"))) or \
+                (change < -threshold and path.endswith("_rps"))
+        if worse:
+            regressions = regressions + 1
+        print("%s %-60s %12.3f -> %12.3f  (%+.1f%%)" % ("!!" if worse else "  ", path, old[path], new[path],
+                                                       change * 100))
+    print("%d regression(s) beyond %.0f%%" % (regressions, threshold * 100))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and write the results as JSON.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=None, help="store sizes for the microbenchmarks")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duration of the load test")
+    parser.add_argument("--clients", type=int, default=8, help="number of client threads of the load test")
+    parser.add_argument("--latency", type=float, default=0.01, help="latency of the nutrition stub, in seconds")
+    parser.add_argument("--out", help="file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    os.environ.setdefault("LOG_LEVEL", "OFF")  # logging would be measured too
+    import micro
+    import loadgen
+    results = {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "micro": micro.run(args.sizes or micro.SIZES),
+        "load": loadgen.run(args.seconds, args.clients, args.latency),
+    }
+    out = args.out or os.path.join(BENCH, "results", results["commit"] + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to", out)
+
+
+if __name__ == '__main__':
+    main()
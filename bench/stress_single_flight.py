@@ -0,0 +1,54 @@
+# Concurrency stress check for adding dishes.
+# It fires N parallel POST /dishes requests for the same dish name at the Flask app, with the nutrition API replaced
+# by a slow local stub, and checks that the stub received exactly one request and that exactly one dish was created
+# (one request gets 201 and the others get -2).
+#
+# To run:  python bench/stress_single_flight.py [N] [rounds]
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+from nutrition_client import NutritionClient  # noqa: E402
+from nutrition_stub import NutritionStub  # noqa: E402
+
+
+def stress(n, name, stub):
+    barrier = threading.Barrier(n)
+    responses = [None] * n
+
+    def post(i):
+        client = meals.app.test_client()
+        barrier.wait()
+        response = client.post('/dishes', json={"name": name})
+        responses[i] = (response.status_code, response.get_json())
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(n)]
+    callsBefore = stub.calls
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    created = [r for r in responses if r[0] == 201]
+    assert stub.calls - callsBefore == 1, "expected 1 upstream call, got %d" % (stub.calls - callsBefore)
+    assert len(created) == 1, "expected 1 created dish, got %s" % responses
+    assert all(r[1] == -2 for r in responses if r[0] != 201), responses
+    assert sum(1 for c in meals.courses.listCourses().values() if c["name"] == name) == 1
+
+
+def main(n=50, rounds=20):
+    stub = NutritionStub(latency=0.2).start()
+    try:
+        meals.app.test_client().get('/dishes')  # initializes courses, menus and A
+        meals.nutritionClient = NutritionClient("stub", url=stub.url)
+        meals.nutritionBatcher.client = meals.nutritionClient
+        for r in range(rounds):
+            stress(n, "stress dish " + str(r), stub)
+    finally:
+        stub.stop()
+    print("OK: %d rounds of %d parallel POST /dishes, one upstream call and one dish each" % (rounds, n))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,80 @@
+# catalog exports and imports all the dishes and meals of a store, in NDJSON (see meals.exportCatalog and
+# meals.importCatalog), to move them from one environment to another:
+# python catalog.py export [FILE]            writes the catalog to FILE (default: standard output)
+# python catalog.py import [FILE]            adds the dishes and meals of the catalog in FILE (default: standard input)
+#
+# By default the store is opened as the server opens it (STORE_BACKEND, STORE_PATH and JOURNAL_DIR, see
+# storage.makeTables), so the server should not be running when importing into a journal.   With --url, the catalog is
+# read from or sent to a running server instead (GET and POST /catalog), e.g.
+# python catalog.py export --url http://old-host:80 > catalog.ndjson
+# python catalog.py import --url http://new-host:80 catalog.ndjson
+# The catalog is streamed in both directions and never held in memory.
+import argparse
+import json
+import os
+import sys
+
+import requests
+
+import meals
+
+# CHUNK is the number of bytes of an exported catalog written at a time
+CHUNK = 65536
+
+
+def openStore():
+    if os.environ.get("STORE_BACKEND", "memory") == "memory" and not os.environ.get("JOURNAL_DIR"):
+        sys.exit("the store is in memory: set STORE_BACKEND=sqlite or JOURNAL_DIR, or use --url")
+    meals.initialize()
+
+
+def closeStore():
+    journal = getattr(meals.courses.table, "journal", None)  # shared by both tables
+    if journal is not None:
+        journal.close()
+
+
+def export(url, out):
+    if url:
+        response = requests.get(url.rstrip("/") + "/catalog", stream=True)
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK):
+            out.write(chunk)
+        return
+    openStore()
+    for line in meals.exportCatalog():
+        out.write(line)
+    closeStore()
+
+
+def load(url, source):
+    if url:
+        response = requests.post(url.rstrip("/") + "/catalog", data=source,
+                                 headers={"Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+        return response.json()
+    openStore()
+    counts = meals.importCatalog(source)
+    closeStore()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the dishes and meals in NDJSON")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("file", nargs="?", help="the catalog file (default: standard output or input)")
+    parser.add_argument("--url", help="the URL of a running server, instead of opening the store")
+    args = parser.parse_intermixed_args()
+    if args.command == "export":
+        out = open(args.file, "wb") if args.file else sys.stdout.buffer
+        with out:
+            export(args.url, out)
+    else:
+        source = open(args.file, "rb") if args.file else sys.stdin.buffer
+        with source:
+            counts = load(args.url, source)
+        print(json.dumps(counts))
+
+
+if __name__ == '__main__':
+    main()
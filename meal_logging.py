@@ -0,0 +1,49 @@
+# Logging for the server.
+#
+# Log records are written as one JSON object per line (time, level, logger, message and any fields passed in
+# extra={"fields": {...}}).   Logging calls made while serving a request only put the record on a queue; a background
+# thread (a QueueListener) formats and writes them, so requests do not wait for stdout to be flushed.
+# The level is set by the LOG_LEVEL environment variable (DEBUG, INFO, WARNING, ERROR, default INFO).   LOG_LEVEL=OFF
+# turns logging off, e.g. in production.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# setupLogging configures the logger called name (and its children) as described above and returns it
+def setupLogging(name, level="INFO", stream=sys.stdout):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers.clear()
+    if level.upper() == "OFF":
+        # a level above CRITICAL rather than logger.disabled, which logging.config (e.g. used by uvicorn) resets
+        logger.setLevel(logging.CRITICAL + 1)
+        logger.addHandler(logging.NullHandler())
+        return logger
+    logger.setLevel(level.upper())
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JSONFormatter())
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)  # write the records still in the queue on exit
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    return logger
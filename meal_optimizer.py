@@ -0,0 +1,120 @@
+# The meal optimizer finds the best appetizer / main / dessert triples of dishes under nutrient budgets, e.g. the 5
+# triples with the least sugar among those with at most 800 cal and 1500 mg of sodium (see POST /meals/suggest).
+#
+# Trying every triple takes O(n^3), which is too slow beyond a few hundred dishes.   Instead:
+# (1) the nutrients of the dishes are kept as columns (NumPy arrays), so constraints are checked for many triples at
+#     once (vectorized), and a dish that breaks a budget on its own is dropped up front.
+# (2) the candidate dishes of each course are sorted by the objective.   For an appetizer a, the mains are visited in
+#     blocks in order of objective, and each block is combined with all the desserts at once.   Once k triples are
+#     known, the objective of the k-th best one (tau) bounds the search: mains and desserts whose objective is too large
+#     to beat tau together with the best remaining choices are never looked at, and the search stops at the first
+#     appetizer for which even the best main and dessert cannot beat tau.
+# (3) for each appetizer, the mains and desserts are also pruned by budget: a main is only kept if it fits with the
+#     appetizer and the smallest dessert, for every nutrient.
+import numpy as np
+
+NUTRIENTS = ["cal", "sodium", "sugar"]
+BLOCK = 64  # number of mains combined with the desserts at once
+
+
+# DishColumns holds the IDs and nutrients of the dishes as NumPy arrays (one entry per dish)
+class DishColumns:
+    def __init__(self, courses):
+        courses = [course for course in courses if all(course.get(f) is not None for f in NUTRIENTS)]
+        self.ids = np.array([course["ID"] for course in courses], dtype=np.int64)
+        self.values = {f: np.array([course[f] for course in courses], dtype=np.float64) for f in NUTRIENTS}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # positions returns the positions in the columns of the dishes with the given IDs (unknown IDs are ignored), or of
+    # all the dishes if IDs is None
+    def positions(self, IDs=None):
+        if IDs is None:
+            return np.arange(len(self.ids))
+        return np.nonzero(np.isin(self.ids, np.array(list(IDs), dtype=np.int64)))[0]
+
+
+# bestTriples returns the (at most) k best triples of dishes from columns, as a list of
+# (objective value, appetizer ID, main ID, dessert ID) tuples, best first.
+# objective is the nutrient to optimize and maximize tells whether it is maximized (otherwise it is minimized).
+# low and high map nutrients to the minimum and maximum totals of a triple.
+# appetizers, mains and desserts are the IDs of the dishes allowed for each course (None for all the dishes).   A dish
+# is used at most once in a triple.   If no course list is given, every dish can be any course; then each set of
+# three dishes is returned once, with its dishes in increasing order of ID as appetizer, main and dessert.
+def bestTriples(columns, objective, maximize=False, low=None, high=None, k=5, appetizers=None, mains=None,
+                desserts=None):
+    low = {f: v for f, v in (low or {}).items() if v is not None}
+    high = {f: v for f, v in (high or {}).items() if v is not None}
+    ordered = appetizers is None and mains is None and desserts is None
+    obj = -columns.values[objective] if maximize else columns.values[objective]  # always minimized
+    values = columns.values
+    ids = columns.ids
+
+    def candidates(IDs):
+        pos = columns.positions(IDs)
+        for f, bound in high.items():  # nutrients are never negative, so a dish over a budget alone is useless
+            pos = pos[values[f][pos] <= bound]
+        return pos[np.argsort(obj[pos], kind="stable")]
+
+    A, M, D = candidates(appetizers), candidates(mains), candidates(desserts)
+    if k <= 0 or not len(A) or not len(M) or not len(D):
+        return []
+    objM, objD = obj[M], obj[D]
+    minM = {f: values[f][M].min() for f in high}
+    minD = {f: values[f][D].min() for f in high}
+    bestObj = np.empty(0)
+    best = np.empty((0, 3), dtype=np.int64)
+    tau = np.inf
+    for a in A:
+        oa = obj[a]
+        if oa + objM[0] + objD[0] >= tau:
+            break  # A is sorted by objective, so no later appetizer can do better
+        # keep the mains that fit with a and the smallest dessert, and the desserts that fit with a and the smallest
+        # main, for every nutrient with a budget
+        mOK = np.ones(len(M), dtype=bool)
+        dOK = np.ones(len(D), dtype=bool)
+        for f, bound in high.items():
+            left = bound - values[f][a]
+            mOK &= values[f][M] <= left - minD[f]
+            dOK &= values[f][D] <= left - minM[f]
+        Ma, Da = M[mOK], D[dOK]
+        if not len(Ma) or not len(Da):
+            continue
+        objMa, objDa = obj[Ma], obj[Da]
+        start = 0
+        while start < len(Ma):
+            if oa + objMa[start] + objDa[0] >= tau:
+                break  # Ma is sorted by objective, so no later main can do better
+            mb = Ma[start:start + BLOCK]
+            start = start + BLOCK
+            dEnd = np.searchsorted(objDa, tau - oa - obj[mb[0]], side="left") if np.isfinite(tau) else len(Da)
+            db = Da[:dEnd]
+            if not len(db):
+                continue
+            total = oa + obj[mb][:, None] + obj[db][None, :]
+            mask = total < tau
+            for f in set(low) | set(high):
+                sums = values[f][a] + values[f][mb][:, None] + values[f][db][None, :]
+                if f in high:
+                    mask &= sums <= high[f]
+                if f in low:
+                    mask &= sums >= low[f]
+            mask &= (mb[:, None] != db[None, :]) & (mb[:, None] != a) & (db[None, :] != a)
+            if ordered:
+                mask &= (ids[a] < ids[mb][:, None]) & (ids[mb][:, None] < ids[db][None, :])
+            rows, cols = np.nonzero(mask)
+            if not len(rows):
+                continue
+            found = np.stack([np.full(len(rows), a), mb[rows], db[cols]], axis=1)
+            bestObj = np.concatenate([bestObj, total[rows, cols]])
+            best = np.concatenate([best, found])
+            if len(bestObj) > k:
+                keep = np.argpartition(bestObj, k - 1)[:k]
+                bestObj, best = bestObj[keep], best[keep]
+            if len(bestObj) == k:
+                tau = bestObj.max()
+    order = np.lexsort((ids[best[:, 2]], ids[best[:, 1]], ids[best[:, 0]], bestObj))
+    sign = -1 if maximize else 1
+    return [(float(sign * bestObj[i]), int(ids[best[i, 0]]), int(ids[best[i, 1]]), int(ids[best[i, 2]]))
+            for i in order]
@@ -1,5 +1,5 @@
-# TO DO:
-# When a dish is deleted, set the field of any meal that refers to that dish to null
+# When a dish is deleted, the field of any meal that refers to that dish is set to null and the dish's calories, sodium
+# and sugar are taken off the meal's totals (see Menus.refreshCourse).
 
 # for why the program returns error code 422 when the ID of a course in a meal is not found see:
 # https://stackoverflow.com/questions/42143115/which-status-code-is-correct-404-or-400-and-when-to-use-either-of-these
@@ -14,25 +14,61 @@
 # export FLASK_RUN_PORT=80
 # export FLASK_RUN_HOST=0.0.0.0
 # flask run --port 80   or:  flask run
+#
+# By default the dishes and meals are kept in the memory of the (single) server process.   To serve requests with
+# several worker processes, keep them in a shared SQLite database instead:
+# export STORE_BACKEND=sqlite
+# export STORE_PATH=/data/meals.db
+# gunicorn --workers 4 --threads 8 --bind 0.0.0.0:80 'meals:createApp()'
+# (with meals:app instead, each worker loads the store when it serves its first request, see createApp)
+#
+# To keep slow nutrition lookups from holding worker threads, serve the same resources with the async server instead
+# (see meals_asgi.py):
+# uvicorn meals_asgi:app --host 0.0.0.0 --port 80
+#
+# The dishes and meals are kept encoded as JSON in a cache of RESPONSE_CACHE_SIZE (default 10000) records per table, so
+# that GET responses are not encoded again for every request (see storage.EncodedCache).
 
 # The resources are:
 # /dishes             These are a collection of dishes.  Each dish has a unique name and is given a unique key.
+# /dishes/batch       POST adds many dishes at once (see DishesBatch).
 # /dishes/{ID} and /dishes/{Name}
 # This refers to a specific dish.  It can be identified either by /dishes/{ID} or /dishes/{name}
 # each dish is a JSON structure: {"name": name,"ID": ID, "cal": cal, "size": size,"sodium": sodium, "sugar": sugar}
+# the cal, size, sodium and sugar of a dish are null while its nutrition is retrieved in the background (ENRICH_ASYNC)
 # /meals              This refers to the collection of meals.  Each meal has a unique key
+# /meals/suggest      POST finds the best meals under nutrient budgets (see MealSuggestions).
+# /catalog            GET exports and POST imports all the dishes and meals, in NDJSON (see Catalog and catalog.py).
+# /stats              GET returns statistics of all the dishes and meals (see Stats).
 # /meals/{ID} and /meals/{name}
 # This refers to a specific meal.  It can be identified either by /meals/{ID} or /dishes/{name}
+# PATCH changes only some of its fields, and If-Match with its ETag (its version) guards against lost updates.
 # each meal is a JSON structure: {"name": name, "ID": ID, "appetizer": ID, "main": ID, "dessert": ID,"cal": cal,
 #                                 "sodium": sodium, "sugar": sugar}}
+# the appetizer, main or dessert of a meal is null if that dish was deleted.
 
 # we use the Flask request package when working with Flask APIs that we create
 # however, when invoking API-Ninja APIs, just use python requests package.
-from flask import Flask, request   # , jsonify
+from flask import Flask, Response, g, request   # , jsonify
 from flask_restful import Resource, Api
-import requests
-import sys
+import hashlib
+import json
+import math
+import threading
+import time
+import zlib
 from meal_exceptions import DishNotDefined, APINotReachable, SomeAPIError  # customized exception names
+from nutrition_cache import NutritionCache, SingleFlight, normalizeQuery
+from nutrition_client import NutritionClient, NINJA_NUTRITION_URL
+from nutrition_batcher import QueryBatcher
+from concurrent.futures import ThreadPoolExecutor
+from storage import MemoryTable, COURSE_FIELDS, MENU_FIELDS, MENU_REFS, COURSE_SORTED, MENU_SORTED, STATS_FIELDS
+from storage import makeTables, encode
+from metrics import Registry, Counter, Histogram, Gauge
+from table_stats import isNumber
+from rate_limit import RateLimiter, ClientLimiter, INTERACTIVE, BULK, BACKGROUND
+from meal_logging import setupLogging
+import os
 import os.path
 if os.path.isfile("My_Ninja_key.py"):
     from My_Ninja_key import NINJA_API_KEY
@@ -42,6 +78,131 @@ else:
 app = Flask(__name__)  # initialize Flask
 api = Api(app)  # create API
 
+# log replaces the print(...); sys.stdout.flush() calls used before.  It is buffered and leveled (see meal_logging.py);
+# set LOG_LEVEL=OFF to turn it off.
+log = setupLogging("meals", os.environ.get("LOG_LEVEL", "INFO"))
+
+# nutritionCache caches the results of findCourseInfo.   It is created when the module is loaded (and not in
+# initialize) so that its contents are kept for the life of the process.   If NUTRITION_CACHE_PATH is
+# set, the cache is also kept in that SQLite file and survives restarts.
+nutritionCache = NutritionCache(max_size=int(os.environ.get("NUTRITION_CACHE_SIZE", "10000")),
+                                ttl=float(os.environ.get("NUTRITION_CACHE_TTL", str(7 * 24 * 3600))),
+                                path=os.environ.get("NUTRITION_CACHE_PATH"))
+
+# nutritionFlight makes sure that only one nutrition lookup is in flight for each (normalized) dish name.   Concurrent
+# lookups of the same name wait for that lookup instead of calling the NINJA API again.
+nutritionFlight = SingleFlight()
+
+# nutritionLimiter keeps the calls to the NINJA API under NUTRITION_RATE calls per second (with bursts of
+# NUTRITION_BURST calls), serving the lookups of POST /dishes before those of batches and background enrichment, and
+# slows down when the API answers 429 (see rate_limit.py).   The calls are not limited if NUTRITION_RATE is not set.
+nutritionLimiter = RateLimiter(float(os.environ["NUTRITION_RATE"]) if os.environ.get("NUTRITION_RATE") else None,
+                               burst=int(os.environ.get("NUTRITION_BURST", "10")))
+
+# nutritionClient calls the NINJA nutrition API.   It reuses its connections across calls, times out slow calls,
+# retries 5xx responses and stops calling the API for a while (circuit breaker) when the API is down.   A lookup that
+# waits more than NUTRITION_QUEUE_TIMEOUT seconds for nutritionLimiter fails with -4.
+nutritionClient = NutritionClient(NINJA_API_KEY,
+                                  url=os.environ.get("NUTRITION_API_URL", NINJA_NUTRITION_URL),
+                                  connect_timeout=float(os.environ.get("NUTRITION_CONNECT_TIMEOUT", "3.05")),
+                                  read_timeout=float(os.environ.get("NUTRITION_READ_TIMEOUT", "10")),
+                                  retries=int(os.environ.get("NUTRITION_RETRIES", "2")),
+                                  pool_size=int(os.environ.get("NUTRITION_WORKERS", "16")),
+                                  limiter=nutritionLimiter,
+                                  queue_timeout=float(os.environ.get("NUTRITION_QUEUE_TIMEOUT", "30")))
+
+# nutritionBatcher combines the lookups of up to NUTRITION_BATCH_SIZE dishes made within NUTRITION_BATCH_WINDOW seconds
+# of each other into one call to the NINJA API (see nutrition_batcher.py).   NUTRITION_BATCH_SIZE=1 turns it off.
+nutritionBatcher = QueryBatcher(nutritionClient, window=float(os.environ.get("NUTRITION_BATCH_WINDOW", "0.005")),
+                                max_items=int(os.environ.get("NUTRITION_BATCH_SIZE", "8")))
+
+# clientLimiter limits each client to CLIENT_RATE requests per second (with bursts of CLIENT_BURST requests), so that
+# one client cannot use up the calls to the NINJA API shared by all (see limitClient).   A client is identified by its
+# address.   The requests are not limited if CLIENT_RATE is not set.
+clientLimiter = (ClientLimiter(float(os.environ["CLIENT_RATE"]), burst=int(os.environ.get("CLIENT_BURST", "20")))
+                 if os.environ.get("CLIENT_RATE") else None)
+
+# TRUST_CLIENT_ID=1 identifies a client by its X-Client-ID header instead (and by its address if it sends none).   Any
+# client can choose its header, and so get a new bucket with each request: set it only behind a proxy that sets (or
+# strips) the header itself, e.g. from an authenticated identity.
+TRUST_CLIENT_ID = os.environ.get("TRUST_CLIENT_ID") == "1"
+
+# nutritionExecutor is the bounded pool of threads used to retrieve the nutrition of many dishes at the same time
+# (see Courses.addCourses).   It has as many threads as nutritionClient has connections.
+nutritionExecutor = ThreadPoolExecutor(max_workers=int(os.environ.get("NUTRITION_WORKERS", "16")),
+                                       thread_name_prefix="nutrition")
+
+# ENRICH_ASYNC makes POST /dishes return 202 at once and retrieve the nutrition of the dish in the background (see
+# Courses.addCourseLater).   A client can also ask for it on each request with the header "Prefer: respond-async".
+# The dishes waiting for their nutrition are queued on enrichmentExecutor, which absorbs bursts of POSTs.
+ENRICH_ASYNC = os.environ.get("ENRICH_ASYNC") == "1"
+enrichmentExecutor = ThreadPoolExecutor(max_workers=int(os.environ.get("ENRICH_WORKERS", "8")),
+                                        thread_name_prefix="enrichment")
+
+# metrics served on GET /metrics (see metrics.py).   The store and cache gauges are read when the metrics are served.
+metrics = Registry()
+requestLatency = metrics.add(Histogram("meals_request_duration_seconds", "Time taken to serve requests",
+                                       ("method", "route", "status")))
+nutritionLatency = metrics.add(Histogram("meals_nutrition_lookup_duration_seconds",
+                                         "Time taken by calls to the nutrition API, by outcome", ("outcome",)))
+nutritionLookups = metrics.add(Counter("meals_nutrition_lookups_total", "Calls to the nutrition API, by outcome",
+                                       ("outcome",)))
+metrics.add(Gauge("meals_store_records", "Number of records in the store",
+                  lambda: {("dishes",): len(courses.table), ("meals",): len(menus.table)}, ("store",)))
+metrics.add(Gauge("meals_nutrition_cache", "Counters and size of the nutrition cache",
+                  lambda: {(stat,): value for stat, value in nutritionCache.stats().items()}, ("stat",)))
+metrics.add(Gauge("meals_response_cache", "Counters and size of the caches of records encoded as JSON",
+                  lambda: {(store, stat): value
+                           for store, table in (("dishes", courses.table), ("meals", menus.table))
+                           for stat, value in table.encodedCache.stats().items()}, ("store", "stat")))
+metrics.add(Gauge("meals_enrichment_dishes", "Number of dishes whose nutrition is pending or failed",
+                  lambda: courses.enrichmentCounts(), ("status",)))
+metrics.add(Gauge("meals_nutrition_limiter", "Current rate, waiting lookups and 429 responses of the nutrition limiter",
+                  lambda: {(stat,): value for stat, value in nutritionLimiter.stats().items()}, ("stat",)))
+metrics.add(Gauge("meals_nutrition_batches", "Combined calls to the nutrition API, and dishes looked up again alone",
+                  lambda: {(stat,): value for stat, value in nutritionBatcher.stats().items()}, ("stat",)))
+metrics.add(Gauge("meals_client_rejected", "Requests rejected by the per-client rate limit",
+                  lambda: clientLimiter.rejected if clientLimiter is not None else 0))
+metrics.add(Gauge("meals_nutrition_circuit_open", "1 if the circuit breaker of the nutrition client is open",
+                  lambda: int(nutritionClient.breaker.state() != "closed")))
+
+
+# startTimer and observeRequest time every request and record its latency by method, route and status code
+@app.before_request
+def startTimer():
+    g.startTime = time.perf_counter()
+
+
+# limitClient answers 429 (Too Many Requests) with -8 to a client that exceeds its rate (see clientLimiter).   The
+# Retry-After header tells when it may send its next request.   GET /metrics is not limited.
+@app.before_request
+def limitClient():
+    if request.path == "/metrics":
+        return None
+    wait = clientWait(request.headers.get('X-Client-ID'), request.remote_addr)
+    if wait:
+        return Response("-8\n", status=429, mimetype='application/json', headers={'Retry-After': str(wait)})
+    return None
+
+
+# clientWait returns 0 if the client with the given X-Client-ID header (or None) and address may make a request now,
+# and otherwise the number of seconds (rounded up) it must wait.   The header is ignored unless TRUST_CLIENT_ID is set.
+# It is also used by the async server.
+def clientWait(clientID, address):
+    if clientLimiter is None:
+        return 0
+    wait = clientLimiter.allow(clientID if TRUST_CLIENT_ID and clientID else address)
+    return int(math.ceil(wait))
+
+
+@app.after_request
+def observeRequest(response):
+    if 'startTime' in g:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        requestLatency.observe(time.perf_counter() - g.startTime, request.method, route, response.status_code)
+    return response
+
+
 global courses
 # I have changed the status codes to be returned.   Specifically, (1) if there is an error is the request message,
 # then status code 422 should be returned in place of 400, (2) if an API is called and it does not respond, then
@@ -56,58 +217,63 @@ global A
 # findCourseInfo takes the name of a course (dish) and uses the nutrition API from NINJA APIs to retrieve the calories,
 # serving size (in grams), sodium (in mg) and sugar (in grams) of the course.  If the API does not return a valid
 # result, then it will throw an error and set all the fields to 0.
-def findCourseInfo(name):
-    query = name
-    api_url = 'https://api.api-ninjas.com/v1/nutrition?query={}'.format(query)
+# It raises DishNotDefined, APINotReachable or SomeAPIError (see NutritionClient.lookup) if the lookup fails.
+# Results are cached in nutritionCache, so that the NINJA API is only called for dishes not looked up recently.
+# Concurrent lookups of the same name are coalesced into one call to the API by nutritionFlight.
+# priority is the priority of the lookup in nutritionLimiter: INTERACTIVE, BULK or BACKGROUND.
+def findCourseInfo(name, priority=INTERACTIVE):
+    info = nutritionCache.get(name)
+    if info is None:
+        info = nutritionFlight.do(normalizeQuery(name), lambda: fetchCourseInfo(name, priority))
+    return info
+
+
+# fetchCourseInfo retrieves the nutrition of the dish called name from the NINJA API and caches it.   The cache is
+# checked again first, since a lookup of the same name may have completed after our caller missed the cache.
+# The latency and outcome of each call to the API are recorded in the metrics.
+def fetchCourseInfo(name, priority=INTERACTIVE):
+    info = nutritionCache.peek(name)
+    if info is not None:
+        return info
+    start = time.perf_counter()
+    outcome = "ok"
     try:
-        response = requests.get(api_url, headers={'X-Api-Key': NINJA_API_KEY})
-    except:
-        print("Error from api.api-ninjas.com/v1/nutrition.  response code = ", response.status_code)
-        print("response text = ", response.text)
-        print("raising SomeAPIError")
-        sys.stdout.flush()
-        raise SomeAPIError
-    else:
-        if response.status_code == requests.codes.ok:
-            try:
-                # the response might include multiple items.  E.g., if the query to Ninja is for "cereal and eggs", it
-                # will return one item for cereal and one for eggs.  However, "cereal and eggs" is treated as one dish,
-                # so the calories, sodium, etc. of the dish is the sum of the calories, sodium, etc. of the items in the
-                # response.
-                resp = response.json()
-                if not resp:  # response.json() is empty
-                    raise Exception
-                calories = 0
-                serving_size = 0
-                sodium = 0
-                sugar = 0
-                for val in resp:
-                    calories += val.get("calories")
-                    serving_size += val.get("serving_size_g")
-                    sodium += val.get("sodium_mg")
-                    sugar += val.get("sugar_g")
-                return calories, serving_size, sodium, sugar
-            except:  # if API returns empty text, then this dish is not found.   Raise DishNotDefined exception
-                print("Response Error from api.api-ninjas.com/v1/nutrition.  response code = ", response.status_code)
-                print("response text = ", response.text)
-                # print("if empty text then API did not recognize dish called ", name)
-                print("raising DishNotDefined")
-                sys.stdout.flush()
-                raise DishNotDefined
-        else:  # bad response code from api.api-ninjas.com/v1/nutrition.   Probably "502" Internal Server error.  Need
-               # to retry
-            print("Bad response code from api.api-ninjas.com/v1/nutrition.  response code = ", response.status_code)
-            print("response text = ", response.text)
-            print("raising APINotReachable")
-            sys.stdout.flush()
-            raise APINotReachable  # need to add custom exception class to handle the different exceptions
+        info = nutritionBatcher.lookup(name, priority)
+    except DishNotDefined:
+        outcome = "not_found"
+        raise
+    except APINotReachable:
+        outcome = "unreachable"
+        log.warning("api.api-ninjas.com/v1/nutrition not reachable", extra={"fields": {"dish": name}})
+        raise
+    except SomeAPIError:
+        outcome = "error"
+        log.warning("error from api.api-ninjas.com/v1/nutrition", extra={"fields": {"dish": name}})
+        raise
+    finally:
+        nutritionLatency.observe(time.perf_counter() - start, outcome)
+        nutritionLookups.inc(outcome)
+    nutritionCache.put(name, info)
+    return info
+
+
+# findCourseInfoOrCode is like findCourseInfo, except that instead of raising an exception it returns the error code
+# that addCourse returns for it: -3 if the API does not recognize the dish and -4 for any other API error.
+def findCourseInfoOrCode(name, priority=INTERACTIVE):
+    try:
+        return findCourseInfo(name, priority)
+    except DishNotDefined:
+        return -3
+    except (APINotReachable, SomeAPIError):
+        return -4
 
 
 # takes the name of a course and returns a JSON document for that course including calories and serving size
-# the ID supplied becomes the ID field of the course
-def makeCourse(name, ID):
+# the ID supplied becomes the ID field of the course.   If info (the cal, size, sodium and sugar of the course) is
+# not supplied, it is retrieved with findCourseInfo.
+def makeCourse(name, ID, info=None):
     try:
-        cal, size, sodium, sugar = findCourseInfo(name)
+        cal, size, sodium, sugar = findCourseInfo(name) if info is None else info
     except APINotReachable:  # server not responding
         raise APINotReachable  # propagate exception
     except DishNotDefined:  # API does not recognize this dish name
@@ -127,24 +293,29 @@ def makeCourse(name, ID):
 
 
 # Courses is an internal class used to store information about courses.   A course is the same as a dish.
+# The courses are kept in table, a MemoryTable or SQLiteTable (see storage.py).   The table assigns the IDs, keeps the
+# index from names to IDs and makes every operation on it thread-safe.
+# The dishes added with addCourseLater are kept without nutrition (cal, size, sodium and sugar are None) until it is
+# retrieved.   enrichment maps the IDs of these dishes to "pending", or to the error code (-3 or -4) of a failed lookup.
 class Courses:
-    def __init__(self):
-        self.courseID = 0
-        self.courses = {}
+    def __init__(self, table=None):
+        self.table = table if table is not None else MemoryTable(COURSE_FIELDS, sortedFields=COURSE_SORTED,
+                                                                 statsFields=STATS_FIELDS)
+        self.lock = threading.Lock()  # protects enrichment
+        self.enrichment = {}
 
     # addCourse returns the courseID for the new dish added, if operation is successful.  Otherwise it returns:
     # -2 if the dish of supplied name already exists.
     # -3 if api.api-ninjas.com/v1/nutrition does not recognize this dish name.
     # -4 if api.api-ninjas.com/v1/nutrition was not reachable or some other server error. E
+    # The name is checked before the (slow) nutrition lookup, so that the API is not called for an existing dish, and
+    # checked again by the table when the dish is inserted, so that concurrent adds of one name create one dish.
     def addCourse(self, name):
-        self.courseID = self.courseID + 1
         try:
-            if name in [n['name'] for n in self.courses.values()]:
-                print(("Course name  " + name + " already defined"))
-                sys.stdout.flush()
+            if self.table.findIDbyName(name) is not None:
+                log.debug("Course name %s already defined", name)
                 return -2  # courseID == -2 means that dish of given name already exists
-            else:
-                self.courses[self.courseID] = makeCourse(name, self.courseID)
+            courseID = self.table.add(makeCourse(name, None))  # -2 if the name was added in the meantime
         except DishNotDefined:
             # return -3 means that api.api-ninjas.com/v1/nutrition does not recognize this dish name
             return -3
@@ -155,43 +326,335 @@ class Courses:
         # return -4 means also if api.api-ninjas.com/v1/nutrition returned another error condition
             return -4
         else:
-            return self.courseID
+            return courseID
+
+    # addCourses adds the dishes with the given names and returns a list with, for each name, the value addCourse
+    # would return for it (the new courseID, -2, -3 or -4).   A name that already exists, or that appears earlier in
+    # names, gets -2.   The nutrition of the remaining names is retrieved concurrently using nutritionExecutor, so
+    # adding many dishes takes about as long as the slowest lookup rather than the sum of all the lookups.
+    def addCourses(self, names):
+        results = [-2] * len(names)
+        positions = {}  # maps each new name to its position in names
+        for i, name in enumerate(names):
+            if name not in positions and self.table.findIDbyName(name) is None:
+                positions[name] = i
+        infos = nutritionExecutor.map(lambda name: findCourseInfoOrCode(name, BULK), positions.keys())
+        for (name, i), info in zip(positions.items(), infos):
+            if isinstance(info, int):  # error code
+                results[i] = info
+            else:  # -2 if the name was added while the nutrition was retrieved
+                results[i] = self.table.add(makeCourse(name, None, info))
+        return results
+
+    # addCourseLater adds the dish called name without waiting for its nutrition, which is retrieved in the background
+    # by enrichmentExecutor (see enrichCourse).   It returns the courseID of the new dish, or -2 if a dish of that name
+    # already exists.   If the nutrition of a dish of that name failed before, it is retried and the ID of that dish
+    # is returned.   isPending tells whether the nutrition of the dish is still to be retrieved.
+    def addCourseLater(self, name):
+        courseID = self.table.findIDbyName(name)
+        if courseID is not None:
+            with self.lock:
+                if self.enrichment.get(courseID) not in (-3, -4):
+                    log.debug("Course name %s already defined", name)
+                    return -2  # courseID == -2 means that dish of given name already exists
+                self.enrichment[courseID] = "pending"
+        else:
+            info = nutritionCache.get(name)
+            if info is not None:  # no need to wait
+                return self.table.add(makeCourse(name, None, info))
+            with self.lock:  # so that the enrichment does not complete before the dish is marked pending
+                courseID = self.table.add(makeCourse(name, None, (None, None, None, None)))
+                if courseID < 0:
+                    return courseID  # -2 if the name was added in the meantime
+                self.enrichment[courseID] = "pending"
+        enrichmentExecutor.submit(self.enrichCourse, courseID, name)
+        return courseID
+
+    # enrichCourse retrieves the nutrition of the dish added by addCourseLater, and either stores it in the dish or
+    # records why it failed
+    def enrichCourse(self, courseID, name):
+        info = findCourseInfoOrCode(name, BACKGROUND)
+        if isinstance(info, int):  # error code
+            log.info("nutrition of dish failed", extra={"fields": {"dish": name, "ID": courseID, "code": info}})
+            with self.lock:
+                if courseID in self.enrichment:  # unless deleted in the meantime
+                    self.enrichment[courseID] = info
+            return
+        with self.lock:
+            if self.enrichment.pop(courseID, None) is not None:
+                self.table.replace(courseID, makeCourse(name, courseID, info))
+
+    def isPending(self, courseID):
+        return self.enrichment.get(courseID) == "pending"
+
+    # enrichmentStatus returns None if the dish with ID courseID has its nutrition, and otherwise the fields added to
+    # the dish by GET /dishes/{ID}: {"status": "pending"}, or {"status": "failed", "error": -3 or -4}
+    def enrichmentStatus(self, courseID):
+        status = self.enrichment.get(courseID)
+        if status is None:
+            return None
+        if status == "pending":
+            return {"status": "pending"}
+        return {"status": "failed", "error": status}
+
+    # enrichmentCounts returns the number of dishes pending and failed, by status
+    def enrichmentCounts(self):
+        with self.lock:
+            statuses = list(self.enrichment.values())
+        pending = statuses.count("pending")
+        return {("pending",): pending, ("failed",): len(statuses) - pending}
+
+    # resumeEnrichment queues again the dishes that were left without nutrition (e.g. by a restart while they were
+    # pending)
+    def resumeEnrichment(self):
+        for course in self.table.all().values():
+            if course["cal"] is None:
+                with self.lock:
+                    self.enrichment[course["ID"]] = "pending"
+                enrichmentExecutor.submit(self.enrichCourse, course["ID"], course["name"])
 
     # deleteCourse returns True if courseID was valid and therefore deletion was successful, otherwise returns False
+    # The meals that refer to the deleted dish are updated (see Menus.refreshCourse).
     def deleteCourse(self, courseID):
-        try:
-            del self.courses[courseID]
-            return True  # Course was deleted successfully
-        except KeyError:
+        with self.lock:
+            course = self.table.delete(courseID)
+            self.enrichment.pop(courseID, None)
+        if course is None:
             return False  # False means that this courseID is not valid
+        menus.refreshCourse(courseID, course, None)
+        return True
 
     # If the dish ID supplied is valid, findCourse returns the course corresponding to the dish ID.
     # Otherwise it returns None
     def findCourse(self, courseID):
-        try:
-            return self.courses[courseID]
-        except KeyError:
-            return None  # None for course means that this courseID is not valid
+        return self.table.get(courseID)  # None for course means that this courseID is not valid
+
+    # findCourseJSON is findCourse returning the course already encoded as JSON (see MemoryTable.encoded)
+    def findCourseJSON(self, courseID):
+        return self.table.encoded(courseID)
 
     # If the dish_name supplied is valid, findCourse returns the course corresponding to that dish.
     # Otherwise it returns None
     def findCourseIDbyName(self, dish_name):
-        courseID = None
-        for key, value in self.courses.items():
-            if dish_name == value['name']:
-                courseID = key
-                break
-        return courseID
+        return self.table.findIDbyName(dish_name)
 
     # listCourses returns the dictionary mapping dish IDs to dishes
     def listCourses(self):
-        return self.courses
+        return self.table.all()
 
-    # insertCourse adds the given course to the collection of courses and returns that course's ID
+    # insertCourse adds the given course to the collection of courses and returns that course's ID (or -2 if a course
+    # with that name already exists)
     def insertCourse(self, course):
-        self.courseID = self.courseID + 1
-        self.courses[self.courseID] = course
-        return self.courseID
+        return self.table.add(dict(course))
+
+    # insertCourses is insertCourse for many courses at once, and returns the list of their IDs (or -2s)
+    def insertCourses(self, courses):
+        return self.table.addMany([dict(course) for course in courses])
+
+    # importCourses adds the dishes (dictionaries with a name and, optionally, cal, size, sodium and sugar) and returns
+    # the list of their new IDs, or of the codes addCourse would return for them.   The dishes whose nutrition is given
+    # are inserted as they are, and the nutrition of the others is retrieved concurrently with nutritionExecutor (as in
+    # addCourses).
+    def importCourses(self, dishes):
+        results = [-2] * len(dishes)
+        courses = []
+        positions = []  # the position in dishes of each of courses
+        missing = {}  # maps the position of each dish without nutrition to its name
+        for i, dish in enumerate(dishes):
+            info = tuple(dish.get(field) for field in ("cal", "size", "sodium", "sugar"))
+            if None not in info:
+                courses.append(makeCourse(dish["name"], None, info))
+                positions.append(i)
+            elif self.table.findIDbyName(dish["name"]) is None:
+                missing[i] = dish["name"]
+        infos = nutritionExecutor.map(lambda name: findCourseInfoOrCode(name, BULK), missing.values())
+        for (i, name), info in zip(missing.items(), infos):
+            if isinstance(info, int):  # error code
+                results[i] = info
+            else:
+                courses.append(makeCourse(name, None, info))
+                positions.append(i)
+        for i, key in zip(positions, self.insertCourses(courses)):
+            results[i] = key
+        return results
+
+
+# NutritionCacheStats implements the /nutrition/cache resource.  GET returns the hit, miss and eviction counters of
+# nutritionCache.
+class NutritionCacheStats(Resource):
+    def get(self):
+        return nutritionCache.stats(), 200
+
+
+# MetricsResource implements the /metrics resource.  GET returns the metrics in the Prometheus text format.
+class MetricsResource(Resource):
+    def get(self):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Stats implements the /stats resource.  GET returns statistics of all the dishes and meals: their number and, for each
+# of cal, sodium and sugar, the number of records with a value, its mean, min, max and percentiles, as well as the
+# dishes used by the most meals (top=N of them, default 10).   They are read from the aggregates kept up to date by the
+# tables as records are added and deleted (see table_stats.py), and min and max from their sorted indexes, so a GET
+# does not visit the records whatever their number.   The percentiles are within 1% of the exact ones.
+# Like GET /dishes, the response has an ETag, and If-None-Match with that ETag returns 304 (Not Modified).
+class Stats(Resource):
+    def get(self):
+        try:
+            top = int(request.args.get('top', 10))
+            if top < 0:
+                raise ValueError
+        except ValueError:
+            if A:
+                return -1, 400
+            else:
+                return -1, 422
+        etag = "{}-{}-{:x}".format(courses.table.etag(), menus.table.etag(), zlib.crc32(request.query_string))
+        headers = {'ETag': '"{}"'.format(etag)}
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        mealStats = tableStats(menus.table, top)
+        mealStats["top_dishes"] = []
+        for courseID, count in mealStats.pop("top"):
+            course = courses.findCourse(courseID)
+            if course is not None:  # unless deleted in the meantime
+                mealStats["top_dishes"].append({"ID": courseID, "name": course["name"], "meals": count})
+        dishStats = tableStats(courses.table)
+        del dishStats["top"]
+        return {"dishes": dishStats, "meals": mealStats}, 200, headers
+
+
+# tableStats returns the statistics of the records of table (see Stats), with the IDs most referred to by them.   The
+# percentiles of the sketches are only within 1% of the values, so they are clamped to the exact min and max, read from
+# the sorted indexes: e.g. p50 is 100 and not 100.49 when every value is 100.
+def tableStats(table, top=0):
+    summary = table.stats().summary(top)
+    stats = {"count": summary["count"]}
+    for field, fieldStats in summary["fields"].items():
+        lowest = table.query({}, field, limit=1)
+        highest = table.query({}, field, descending=True, limit=1)
+        low = lowest[0][field] if lowest else None
+        high = highest[0][field] if highest else None
+        stats[field] = {"count": fieldStats["count"], "mean": fieldStats["mean"], "min": low, "max": high}
+        for key, value in fieldStats.items():  # the percentiles
+            if key not in stats[field]:
+                stats[field][key] = value if value is None or low is None else min(max(value, low), high)
+    stats["top"] = summary["top"]
+    return stats
+
+
+# STREAM_PAGE is the number of records read from a table at a time when a list of records is streamed
+STREAM_PAGE = 1000
+
+
+# listResponse returns the response to GET /dishes or GET /meals, whose records are in table.   Without query
+# parameters it returns the dictionary mapping IDs to records, as it always did.   Query parameters are:
+# limit=N      return at most N records (a page), N >= 0.   The response has an X-Next-After header with the ID to
+#              pass in after= to get the next page, if there might be more records.
+# after=ID     return only the records with IDs greater than ID (default 0).   With order_by, after=V,ID returns only
+#              the records after the one whose field is V and ID is ID (the X-Next-After of an ordered query)
+# stream=ndjson  stream the records, one JSON object per line, without building the whole response in memory
+# stream=json    stream the same dictionary as without parameters, in chunks
+# min_F=X, max_F=Y   return only the records whose field F is between X and Y, where F is one of the fields that can be
+#              queried by range (cal, size, sodium and sugar for dishes; cal, sodium and sugar for meals)
+# order_by=F   return the records ordered by field F, lowest first (or highest first with order=desc)
+# If min_, max_ or order_by parameters are given, the records are returned in a list (to keep their order), e.g.
+# GET /meals?max_cal=600&max_sodium=800&order_by=sugar&limit=10 returns the 10 meals under 600 cal and 800 mg of sodium
+# with the least sugar, and after=V,ID with the X-Next-After of that response returns the next 10.   These queries use
+# the sorted indexes of the table (see storage.py), not a scan.
+# Every response has an ETag that changes when the records change.   If the request has an If-None-Match header with
+# that ETag, 304 (Not Modified) is returned with no body.
+# The responses are made of the records already encoded as JSON by the table (see MemoryTable.encodedPage), not encoded
+# again, and are the same bytes as flask_restful would write.
+def listResponse(table):
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        if limit is not None and limit < 0:
+            raise ValueError
+        filters = {}
+        for field in table.sortedFields:
+            low = request.args.get('min_' + field)
+            high = request.args.get('max_' + field)
+            if low is not None or high is not None:
+                filters[field] = (None if low is None else finiteFloat(low),
+                                  None if high is None else finiteFloat(high))
+        order_by = request.args.get('order_by')
+        if order_by is not None and order_by not in table.sortedFields:
+            raise ValueError
+        after = request.args.get('after')
+        if not filters and order_by is None:
+            after = int(request.args.get('after', 0))
+        elif after is not None and order_by is not None:  # the cursor of an ordered query: V,ID
+            value, ID = after.split(',')
+            after = (finiteFloat(value), int(ID))
+        elif after is not None:
+            after = int(after)
+    except ValueError:
+        if A:
+            return -1, 400
+        else:
+            return -1, 422
+    stream = request.args.get('stream')
+    # the ETag of the table, made different for each combination of query parameters
+    etag = "{}-{:x}".format(table.etag(), zlib.crc32(request.query_string))
+    headers = {'ETag': '"{}"'.format(etag)}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if filters or order_by is not None:
+        records = table.query(filters, order_by, request.args.get('order') == 'desc', limit, after)
+        if limit is not None and len(records) == limit and records:
+            last = records[-1]
+            headers['X-Next-After'] = (str(last["ID"]) if order_by is None
+                                       else "{!r},{}".format(last[order_by], last["ID"]))
+        return records, 200, headers
+    if stream == 'ndjson':
+        lines = (data + b"\n" for ID, data in iterEncoded(table, after, limit))
+        return Response(lines, mimetype='application/x-ndjson', headers=headers)
+    if stream == 'json':
+        def chunks():
+            separator = b"{"
+            for ID, data in iterEncoded(table, after, limit):
+                yield b'%s"%d": %s' % (separator, ID, data)
+                separator = b", "
+            yield b"{}" if separator == b"{" else b"}"
+        return Response(chunks(), mimetype='application/json', headers=headers)
+    pairs = table.encodedPage(after, limit)
+    if limit is not None and len(pairs) == limit and pairs:
+        headers['X-Next-After'] = str(pairs[-1][0])
+    return jsonResponse(encodedDict(pairs), headers)
+
+
+# finiteFloat returns the number in text, and raises ValueError if it is not one or is not finite (e.g. nan or inf,
+# which no field of a record holds)
+def finiteFloat(text):
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(text)
+    return value
+
+
+# encodedDict returns the JSON dictionary mapping IDs to records, given the list of (ID, encoded record) pairs
+def encodedDict(pairs):
+    return b"{" + b", ".join(b'"%d": %s' % (ID, data) for ID, data in pairs) + b"}"
+
+
+# jsonResponse returns the response with the given JSON (bytes) body, ending with a newline as in flask_restful
+def jsonResponse(data, headers=None):
+    return Response(data + b"\n", mimetype='application/json', headers=headers)
+
+
+# iterEncoded yields the (ID, encoded record) pairs of the records of table with IDs greater than after, at most limit
+# of them (None for no limit), reading them from the table STREAM_PAGE records at a time
+def iterEncoded(table, after=0, limit=None):
+    while limit is None or limit > 0:
+        pairs = table.encodedPage(after, STREAM_PAGE if limit is None else min(limit, STREAM_PAGE))
+        if not pairs:
+            return
+        for pair in pairs:
+            yield pair
+        after = pairs[-1][0]
+        if limit is not None:
+            limit = limit - len(pairs)
 
 
 # Dishes implements the /dishes resource.  It uses courses (an instance of the Courses class) to store/retrieve
@@ -203,37 +666,33 @@ class Dishes(Resource):
     # POST adds a dish to the Dishes resource and returns its ID with code 201 (success, resource created)
     # POST might fail because and will return non-positive IDs as follows:
     # ID == 0 means that content-type is not application/json.  Error code 415 (Unsupported Media Type)
-    # ID == -1 means that 'name' parameter was not specified.  Error code 400 (Bad request)
+    # ID == -1 means that 'name' parameter was not specified or is not a string.  Error code 400 (Bad request)
     # ID == -2 means that dish of given name already exists. Error code 400
     # ID == -3 means that api.api-ninjas.com/v1/nutrition does not recognize this dish name. Error code 400
     # ID == -4 means that api.api-ninjas.com/v1/nutrition was not reachable or some other server error. Error code 400
+    # With ENRICH_ASYNC, or the header "Prefer: respond-async", the dish is added without waiting for its nutrition and
+    # its ID is returned with code 202 (Accepted).   GET /dishes/{ID} then tells whether the nutrition is still pending
+    # or failed (with -3 or -4).
     def post(self):
         content_type = request.headers.get('Content-Type')
         if content_type == 'application/json':
             try:
                 courseName = request.json['name']
-            except KeyError:  # no such parameter "name"
-                print("POST /dishes exception: 'name' parameter not supplied")
-                sys.stdout.flush()
+                if not isinstance(courseName, str):
+                    raise TypeError
+            except (KeyError, TypeError):  # no such parameter "name", or it is not a string
+                log.debug("POST /dishes exception: 'name' parameter not supplied or not a string")
                 if A:
                     return -1, 400  # 400 Bad Request.   0 returned key value means that for  was not successful
                 else:
                     return -1, 422
             else:  # found parameter
-                key = courses.addCourse(courseName)
-                if key > 0:  # successful course creation
-                    return key, 201
-                else:  # operation not successful.  key is negative and gives error code
-                    if key == -4:  #API Ninjas nutrition API error (timeout,...)
-                        if A:
-                            return key, 400
-                        else:
-                            return key, 504
-                    # otherwise error in request message content so return 422
-                    if A:
-                        return key, 400
-                    else:
-                        return key, 422
+                if enrichAsync(request.headers.get('Prefer')):
+                    key = courses.addCourseLater(courseName)
+                    if key > 0 and courses.isPending(key):
+                        return key, 202  # 202 Accepted
+                    return courseKeyResponse(key)
+                return courseKeyResponse(courses.addCourse(courseName))
                 # except NameError:
                 #     print("courses not initialized")
                 #     sys.stdout.flush()
@@ -245,9 +704,59 @@ class Dishes(Resource):
         else:
             return 0, 415  # 415 Unsupported Media Type
 
-    # returns the dictionary of all the courses in the dishes resource.
+    # returns the dictionary of all the courses in the dishes resource.   It can also return them a page at a time or
+    # stream them (see listResponse).
     def get(self):
-        return courses.listCourses()
+        return listResponse(courses.table)
+
+
+# enrichAsync tells whether a POST /dishes with the given Prefer header retrieves the nutrition in the background
+def enrichAsync(prefer):
+    return ENRICH_ASYNC or (prefer is not None and "respond-async" in prefer)
+
+
+# courseKeyResponse returns the response to POST /dishes when Courses.addCourse returned key.   It is also used by the
+# async server (see meals_asgi.py).
+def courseKeyResponse(key):
+    if key > 0:  # successful course creation
+        return key, 201
+    else:  # operation not successful.  key is negative and gives error code
+        if key == -4:  #API Ninjas nutrition API error (timeout,...)
+            if A:
+                return key, 400
+            else:
+                return key, 504
+        # otherwise error in request message content so return 422
+        if A:
+            return key, 400
+        else:
+            return key, 422
+
+
+# DishesBatch implements the /dishes/batch resource.  It adds many dishes in one request.
+class DishesBatch(Resource):
+    global courses
+
+    # POST takes a JSON object {"names": [name1, name2, ...]} and adds a dish for each name.   It returns with code 200
+    # a list with one {"name": name, "ID": ID} entry for each name, in the same order, where ID is either the ID of the
+    # new dish or the negative code POST /dishes would return for that name (-2, -3 or -4).
+    # ID == 0 means that content-type is not application/json.  Error code 415 (Unsupported Media Type)
+    # ID == -1 means that 'names' was not supplied or is not a list of strings.  Error code 400 (A) or 422
+    def post(self):
+        content_type = request.headers.get('Content-Type')
+        if content_type != 'application/json':
+            return 0, 415  # 415 Unsupported Media Type
+        try:
+            names = request.json['names']
+            if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                raise TypeError
+        except (KeyError, TypeError):
+            if A:
+                return -1, 400
+            else:
+                return -1, 422
+        keys = courses.addCourses(names)
+        return [{"name": name, "ID": key} for name, key in zip(names, keys)], 200
 
 
 # Dish implements the /dishes/{dish} resource.  It uses courses (an instance of the Courses class) to store/retrieve
@@ -259,6 +768,7 @@ class Dish(Resource):
     # GET takes either a dish ID or a dish name and returns the JSON object containing for that dish with resp code 200.
     # (1) If neither the dish ID nor a dish name is specified, it returns -1 with error code 400 (Bad request).
     # (2) if dish name or dish ID does not exist, it returns -5 with error code 404 (Not Found).
+    # If the nutrition of the dish is pending or failed (see Courses.addCourseLater), the dish has a "status" field too.
     def get(self, ID=None, name=None):
         # ID, if present, is ID (integer) of dish. name, if present, is the name (string of dish)
         # One of these must be present otherwise the request would be GET /dishes
@@ -271,8 +781,14 @@ class Dish(Resource):
                 return -5, 404
         #   # if reach here then dishID is an integer, the dish (course) ID
         try:
-            dish = courses.findCourse(dishID)
-            return dish, 200
+            status = courses.enrichmentStatus(dishID)
+            if status is not None:
+                dish = courses.findCourse(dishID)
+                return dict(dish, **status) if dish is not None else dish, 200
+            dish = courses.findCourseJSON(dishID)
+            if dish is None:
+                return dish, 200
+            return jsonResponse(dish)
         except:  # dish ID provided in not valid
             return -5, 404
 
@@ -322,83 +838,216 @@ def makeMenu(name, ID, appetizerID, mainID, dessertID):
         }
         return menu
     except:
-        print("makeMenu: KeyError")
-        sys.stdout.flush()
+        log.debug("makeMenu: KeyError")
         return None
 
 
 # Menus is an internal class used to store information about menus.   A menu is the same as a meal.
+# Like Courses, the menus are kept in table, a MemoryTable or SQLiteTable (see storage.py).
 class Menus:
-    def __init__(self):
-        self.menuID = 0
-        self.menus = {}
+    def __init__(self, table=None):
+        self.table = table if table is not None else MemoryTable(MENU_FIELDS, MENU_REFS, MENU_SORTED,
+                                                                 statsFields=STATS_FIELDS)
+
+    # refreshCourse updates the meals that refer to the course with ID courseID after that course changed from old to
+    # new.   new is None if the course was deleted, in which case the meals' references to it are set to None.   The
+    # table's index from courses to the meals referring to them is used, so only the affected meals are visited and
+    # their totals are adjusted by the difference between old and new instead of being recomputed.
+    # Each meal is only replaced if it did not change since it was read (and is read again otherwise), so a meal whose
+    # reference was already set to None (see repairMenu) is not adjusted twice.
+    def refreshCourse(self, courseID, old, new):
+        for menuID in self.table.findIDsReferencing(courseID):
+            while True:
+                menu = self.table.get(menuID)
+                if menu is None or courseID not in [menu[ref] for ref in MENU_REFS]:
+                    break  # deleted, or no longer refers to the course
+                changed = dict(menu)
+                for ref in MENU_REFS:
+                    if menu[ref] == courseID:
+                        for field in ("cal", "sodium", "sugar"):
+                            changed[field] = changed[field] - old[field] + (new[field] if new is not None else 0)
+                        if new is None:
+                            changed[ref] = None
+                if self.table.replace(menuID, changed, menu) != -9:
+                    break
+
+    # repairMenu takes the dishes that no longer exist off the meal with ID menuID: their references are set to None and
+    # the totals are recomputed from the remaining dishes.   A meal added while one of its dishes was deleted may have
+    # been missed by refreshCourse (it was not in the index yet), and a crash between the deletion of a dish and
+    # refreshCourse leaves meals referring to it, so addMenu and repairReferences call it.   It returns True if the meal
+    # was changed.
+    def repairMenu(self, menuID):
+        while True:
+            menu = self.table.get(menuID)
+            if menu is None:
+                return False
+            dishes = {ref: courses.findCourse(menu[ref]) for ref in MENU_REFS if menu[ref] is not None}
+            if None not in dishes.values():
+                return False  # all its dishes exist
+            changed = dict(menu)
+            for field in ("cal", "sodium", "sugar"):
+                changed[field] = sum(dish[field] or 0 for dish in dishes.values() if dish is not None)
+            for ref, dish in dishes.items():
+                if dish is None:
+                    changed[ref] = None
+            if self.table.replace(menuID, changed, menu) != -9:
+                return True
+
+    # repairReferences repairs (see repairMenu) the meals that refer to dishes that do not exist, e.g. after recovering
+    # from a crash.   It only looks up each dish referred to once, and visits only the meals referring to missing ones.
+    def repairReferences(self):
+        repaired = 0
+        for courseID in self.table.referencedIDs():
+            if courses.findCourse(courseID) is None:
+                for menuID in self.table.findIDsReferencing(courseID):
+                    repaired = repaired + self.repairMenu(menuID)
+        if repaired:
+            log.warning("repaired meals referring to deleted dishes", extra={"fields": {"meals": repaired}})
+        return repaired
 
     # addMenu will add a completely new menu for POST request.  In this case, menu_ID is not passed in.
     # addMenu will also be used for PUT request, in which case the existing menu_ID is passed in (it is reused).
+    # It returns -7 if the nutrition of one of the dishes is pending or failed (see Courses.addCourseLater), since the
+    # totals of the meal cannot be computed yet.
     def addMenu(self, menu_name, appetizerID, mainID, desertID, menu_ID = None):
         if menu_ID is None:
             # then trying to add new meal with name menu_name.   Need to check that this name does not already exist
             if self.findMenuIDbyName(menu_name) !=  None:
                 # -2 return value means that the menu_name already exists
                 return -2
-            else:
-                # menu_name is a new meal name.   assign a new ID
-                self.menuID = self.menuID + 1
-                menu_ID = self.menuID
         else:
             # trying to update menu with existing ID menu_ID
-            if menu_ID not in self.menus.keys():     # if menu_ID passed in is not a valid meal ID
+            if self.table.get(menu_ID) is None:     # if menu_ID passed in is not a valid meal ID
                 return -5  # -5 return value means that menu_ID is not a valid ID
-                # ******  NEED to check that menu_name being supplied for existing meal, if different from existing
-                # menu_name, does not already exist as the name of another menu.
-                # ******  MAYBE say that can supply only a menu_ID or a menu_NAME but not both????
-        # if we reach here, menu_ID is the ID for a new or existing meal
+            # the menu_name being supplied for an existing meal must not already be the name of another meal
+            if self.findMenuIDbyName(menu_name) not in (None, menu_ID):
+                return -2  # -2 return value means that the menu_name already exists
+        # if we reach here, menu_ID is the ID for an existing meal, or None for a new meal (the table assigns its ID)
+        if any(courses.enrichmentStatus(ID) is not None for ID in (appetizerID, mainID, desertID)):
+            return -7  # -7 means that the nutrition of one of the dishes is pending or failed
         menu = makeMenu(menu_name, menu_ID, appetizerID, mainID, desertID)
         if menu is None:
-            print("addMenu:  menu == None")
+            log.debug("addMenu:  menu == None")
             # returned menu is None then one of the dish IDs does not exist.  the menu was not added.
             if A:
-                print("returning -5")
                 return -5  # -5 is overloaded & covers two different cases that should have different status codes
             else:
-                print("returning -6")
                 return -6  # -6 means that one of the sent dish IDs (appetizer, main, dessert) does not exist.
+        elif menu_ID is None:
+            menuID = self.table.add(menu)  # -2 if the name was added in the meantime
         else:
-            self.menus[menu_ID] = menu
-            return menu_ID
+            menuID = self.table.replace(menu_ID, menu)  # -5 or -2 if the meal was changed in the meantime
+        # a dish deleted after makeMenu read it may have been refreshed before the meal was in the table
+        if menuID > 0 and any(courses.findCourse(menu[ref]) is None for ref in MENU_REFS):
+            self.repairMenu(menuID)
+        return menuID
 
     def findMenu(self, menuID):
-        try:
-            return self.menus[menuID]
-        except KeyError:
+        menu = self.table.get(menuID)
+        if menu is None:
             raise KeyError
+        return menu
+
+    # findMenuJSON is findMenu returning the menu already encoded as JSON (see MemoryTable.encoded)
+    def findMenuJSON(self, menuID):
+        menu = self.table.encoded(menuID)
+        if menu is None:
+            raise KeyError
+        return menu
 
     def findMenuIDbyName(self, menu_name):
-        menuID = None
-        for key, value in self.menus.items():
-            if menu_name == value['name']:
-                menuID = key
-                break
-        return menuID
+        return self.table.findIDbyName(menu_name)
+
+    # importMenus adds the meals (dictionaries with a name, appetizer, main and dessert and, optionally, cal, sodium
+    # and sugar) and returns the list of their new IDs, or of the codes addMenu would return for them.   The meals
+    # whose totals are given are inserted as they are, and the totals of the others are computed by addMenu.
+    def importMenus(self, meals):
+        results = [-2] * len(meals)
+        menus = []
+        positions = []  # the position in meals of each of menus
+        for i, meal in enumerate(meals):
+            if any(meal.get(field) is None for field in ("cal", "sodium", "sugar")):
+                results[i] = self.addMenu(meal["name"], meal["appetizer"], meal["main"], meal["dessert"])
+                continue
+            menus.append({"name": meal["name"], "ID": None, "appetizer": meal["appetizer"], "main": meal["main"],
+                          "dessert": meal["dessert"], "cal": meal["cal"], "sodium": meal["sodium"],
+                          "sugar": meal["sugar"]})
+            positions.append(i)
+        for i, key in zip(positions, self.table.addMany(menus)):
+            results[i] = key
+        # as in addMenu, the meals referring to dishes deleted while they were added are repaired
+        missing = {menu[ref] for menu in menus for ref in MENU_REFS if menu[ref] is not None}
+        missing = {courseID for courseID in missing if courses.findCourse(courseID) is None}
+        for menu in menus:
+            if menu["ID"] is not None and any(menu[ref] in missing for ref in MENU_REFS):
+                self.repairMenu(menu["ID"])
+        return results
+
+    # patchMenu changes the fields of the meal with ID menuID given in changes (a dictionary with some of name,
+    # appetizer, main and dessert), and returns the changed meal.   Only the dishes that changed are looked up, and the
+    # totals are adjusted by the difference between the old and the new dish (as in refreshCourse) rather than
+    # recomputed, so changing only the name does not look up any dish.   The meal is replaced only if it did not change
+    # since it was read (see MemoryTable.replace), and is read again otherwise, so concurrent patches of different
+    # fields are all applied.   If matches is given, the meal is only changed if matches(its version) is True (see
+    # mealVersion), e.g. if the client read that version.
+    # It returns the same error codes as addMenu (-5 if there is no such meal), or -9 if matches(version) is False.
+    def patchMenu(self, menuID, changes, matches=None):
+        while True:
+            menu = self.table.get(menuID)
+            if menu is None:
+                return -5  # -5 return value means that menuID is not a valid ID
+            if matches is not None and not matches(mealVersion(encode(menu))):
+                return -9  # -9 means that the meal is not at the version the client expects
+            new = dict(menu)
+            new["name"] = changes.get("name", menu["name"])
+            dangling = False  # True if an old dish of the meal does not exist any more
+            for ref in MENU_REFS:
+                courseID = changes.get(ref, menu[ref])
+                if courseID == menu[ref]:
+                    continue
+                course = courses.findCourse(courseID)
+                if course is None:
+                    return -5 if A else -6  # as in addMenu, one of the dish IDs does not exist
+                if courses.enrichmentStatus(courseID) is not None:
+                    return -7  # -7 means that the nutrition of one of the dishes is pending or failed
+                old = courses.findCourse(menu[ref]) if menu[ref] is not None else None
+                if old is None and menu[ref] is not None:
+                    dangling = True  # its nutrients are not known any more: the totals are recomputed below
+                else:
+                    for field in ("cal", "sodium", "sugar"):
+                        new[field] = new[field] - (old[field] if old is not None else 0) + course[field]
+                new[ref] = courseID
+            if dangling:
+                dishes = {ref: courses.findCourse(new[ref]) for ref in MENU_REFS if new[ref] is not None}
+                for field in ("cal", "sodium", "sugar"):
+                    new[field] = sum(dish[field] or 0 for dish in dishes.values() if dish is not None)
+                for ref, dish in dishes.items():
+                    if dish is None:
+                        new[ref] = None
+            result = self.table.replace(menuID, new, menu)
+            if result == -9:  # the meal changed since it was read: patch it again
+                continue
+            if result < 0:
+                return result
+            # as in addMenu, a dish deleted while the meal was patched is taken off it
+            if any(courses.findCourse(new[ref]) is None for ref in MENU_REFS if new[ref] is not None):
+                self.repairMenu(menuID)
+                new = self.table.get(menuID) or new
+            return new
 
     def deleteMenu(self, menuID):
-        try:
-            del self.menus[menuID]
-            return True  # meal was deleted successfully
-        except KeyError:
-            return False  # False means that this mealID is not valid
+        return self.table.delete(menuID) is not None  # False means that this mealID is not valid
 
     def updateMenuName(self, ID, new_name):
-        try:
-            menu = self.menus[ID]
-            menu['name'] = new_name
-            self.menus[ID] = menu
-            return True
-        except:
+        menu = self.table.get(ID)
+        if menu is None:
             return False
+        menu = dict(menu)
+        menu['name'] = new_name
+        return self.table.replace(ID, menu) == ID  # False if another meal already has this name
 
     def listMenus(self):
-        return self.menus
+        return self.table.all()
 
 
 # Menus implements the /meals resource.  It uses menus (an instance of the Menus class) to store/retrieve
@@ -412,18 +1061,20 @@ class Meals(Resource):
         if content_type == 'application/json':
             try:
                 mealName = request.json['name']
+                if not isinstance(mealName, str):
+                    raise TypeError
                 appetizerID = int(request.json['appetizer'])
                 mainID = int(request.json['main'])
                 desertID = int(request.json['dessert'])
             except:
-                # one of the required parameters was not supplied
+                # one of the required parameters was not supplied (or the name is not a string)
                 if A:
                     return -1, 400
                 else:
                     return -1, 422
             else:
                 menuID = menus.addMenu(mealName, appetizerID, mainID, desertID)
-                print("post: menuID = ", menuID)
+                log.debug("post: menuID = %s", menuID)
                 if menuID > 0:
                     # a positive menuID indicates that the mean was added with the new ID menuID
                     return menuID, 201
@@ -434,6 +1085,9 @@ class Meals(Resource):
                         return -5, 404  # 404 Not Found
                     elif (menuID == -6):
                         return -6, 422
+                    elif menuID == -7:
+                        # the nutrition of one of the dishes is not known yet (or could not be retrieved)
+                        return -7, 409  # 409 Conflict
                     elif menuID == -2:
                         # the mealName already exists
                         if A:
@@ -444,13 +1098,87 @@ class Meals(Resource):
                         # currently, no other negative values can be returned from addMenu but for future extensions this is here
                         return menuID, 400
         else:
-            print("content_type is not application/json.   content_type = ", str(content_type))
-            sys.stdout.flush()
+            log.debug("content_type is not application/json.   content_type = %s", content_type)
             return 0, 415  # 415 Unsupported Media Type
 
-    # returns all the meals in the collection.
+    # returns all the meals in the collection.   It can also return them a page at a time or stream them (see
+    # listResponse).
     def get(self):
-        return menus.listMenus()  # returns dictionary of menus (meals)
+        return listResponse(menus.table)  # returns dictionary of menus (meals)
+
+
+# dishColumns holds the dishes as columns for the meal optimizer, with the ETag of the dishes table they were built from,
+# so they are only rebuilt after the dishes change
+dishColumns = (None, None)
+
+
+# MAX_SUGGESTIONS is the largest number of triples POST /meals/suggest returns
+MAX_SUGGESTIONS = 100
+
+
+# MealSuggestions implements the /meals/suggest resource.  It uses the meal optimizer (see meal_optimizer.py) to find
+# the best appetizer / main / dessert triples of dishes under nutrient budgets.
+class MealSuggestions(Resource):
+    # POST takes a JSON object with:
+    #   "minimize": N or "maximize": N   the nutrient to optimize (cal, sodium or sugar).  One of them is required.
+    #   "max_cal", "max_sodium", "max_sugar", "min_cal", ...   budgets on the totals of the meal (optional)
+    #   "k"          the number of triples to return, from 1 to MAX_SUGGESTIONS (default 5)
+    #   "appetizers", "mains", "desserts"   the IDs of the dishes allowed for each course (optional, default all)
+    #   "create"     if true, a meal is created for each triple (with Menus.addMenu), named "<name> 1", "<name> 2", ...
+    #   "name"       the prefix of the names of the created meals (required if create is true)
+    # It returns with code 200 a list of the best triples, best first, each as a JSON object with the appetizer, main
+    # and dessert IDs and the cal, sodium and sugar of the meal.   If meals were created, each object also has the ID
+    # of its meal (or the negative code addMenu returned for it, e.g. -2 if the name already exists).
+    # ID == 0 means that content-type is not application/json.  Error code 415 (Unsupported Media Type)
+    # ID == -1 means that a parameter is missing or not valid.  Error code 400 (A) or 422
+    def post(self):
+        global dishColumns
+        from meal_optimizer import DishColumns, bestTriples, NUTRIENTS  # NumPy is only loaded when it is needed
+        content_type = request.headers.get('Content-Type')
+        if content_type != 'application/json':
+            return 0, 415  # 415 Unsupported Media Type
+        try:
+            body = request.json
+            maximize = 'maximize' in body
+            objective = body['maximize'] if maximize else body['minimize']
+            if objective not in NUTRIENTS:
+                raise ValueError
+            low = {f: float(body['min_' + f]) for f in NUTRIENTS if body.get('min_' + f) is not None}
+            high = {f: float(body['max_' + f]) for f in NUTRIENTS if body.get('max_' + f) is not None}
+            k = int(body.get('k', 5))
+            if not 1 <= k <= MAX_SUGGESTIONS:  # the optimizer enumerates more triples, and holds more, as k grows
+                raise ValueError
+            roles = [None if body.get(role) is None else [int(ID) for ID in body[role]]
+                     for role in ('appetizers', 'mains', 'desserts')]
+            create = bool(body.get('create', False))
+            prefix = str(body['name']) if create else None
+        except (KeyError, TypeError, ValueError):
+            if A:
+                return -1, 400
+            else:
+                return -1, 422
+        etag = courses.table.etag()
+        if dishColumns[0] != etag:
+            dishColumns = (etag, DishColumns(courses.listCourses().values()))
+        columns = dishColumns[1]
+        suggestions = []
+        for i, (value, appetizerID, mainID, dessertID) in enumerate(bestTriples(columns, objective, maximize, low, high,
+                                                                                k, *roles)):
+            meal = makeMenu(None, None, appetizerID, mainID, dessertID)
+            if meal is None:  # one of the dishes was deleted in the meantime
+                continue
+            del meal["name"], meal["ID"]
+            if create:
+                meal["ID"] = menus.addMenu(prefix + " " + str(i + 1), appetizerID, mainID, dessertID)
+            suggestions.append(meal)
+        return suggestions, 200
+
+
+# mealVersion returns the version of a meal given encoded as JSON: a hash of it, so that it changes whenever the meal
+# changes, and is the same in every process (e.g. gunicorn workers sharing a SQLite store) and after a restart.   It is
+# the ETag of the meal.
+def mealVersion(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
 
 
 class Meal(Resource):
@@ -467,8 +1195,8 @@ class Meal(Resource):
                 return -5, 404
         # if reach here then mealID is an integer, the meal ID
         try:
-            meal = menus.findMenu(mealID)
-            return meal, 200
+            meal = menus.findMenuJSON(mealID)
+            return jsonResponse(meal, {'ETag': '"{}"'.format(mealVersion(meal))})
         except:  # meal ID provided in not valid
             return -5, 404
 
@@ -496,11 +1224,13 @@ class Meal(Resource):
         if content_type == 'application/json':
             try:
                 mealName = request.json['name']
+                if not isinstance(mealName, str):
+                    raise TypeError
                 appetizerID = int(request.json['appetizer'])
                 mainID = int(request.json['main'])
                 desertID = int(request.json['dessert'])
             except:
-                # one of the required parameters was not supplied
+                # one of the required parameters was not supplied (or the name is not a string)
                 if A:
                     return -1, 400
                 else:
@@ -510,6 +1240,14 @@ class Meal(Resource):
                 if menuID > 0:
                     return menuID, 200
                 else:
+                    if menuID == -2:
+                        # the new mealName already belongs to another meal
+                        if A:
+                            return -2, 400
+                        else:
+                            return -2, 422
+                    if menuID == -7:
+                        return -7, 409  # the nutrition of one of the dishes is pending or failed
                     # could not create this menu - one of the dish IDs or the meal ID supplied was not found
                     if A:
                         return menuID, 404
@@ -519,40 +1257,256 @@ class Meal(Resource):
                         else:
                             return menuID, 422  # either missing parameter or incorrect parameter
         else:
-            print("content_type is not application/json.   content_type = ", str(content_type))
-            sys.stdout.flush()
+            log.debug("content_type is not application/json.   content_type = %s", content_type)
             return 0, 415  # 415 Unsupported Media Type
 
-@app.before_first_request
-# This code gets executed when application is started by Flask.   Initializes global data structures needed.
-def before_first_request_func():
+    # PATCH changes only some of the fields of a meal, given in a JSON object with any of name, appetizer, main and
+    # dessert (see Menus.patchMenu).   If the request has an If-Match header, the meal is only changed if it is still at
+    # a version given there (its ETag, returned by GET /meals/{ID} and by PATCH), and otherwise 412 (Precondition
+    # Failed) is returned, so that clients editing the same meal do not overwrite each other's changes.   It returns the
+    # meal ID, with the new ETag of the meal.
+    def patch(self, ID=None, name=None):
+        content_type = request.headers.get('Content-Type')
+        if content_type != 'application/json':
+            log.debug("content_type is not application/json.   content_type = %s", content_type)
+            return 0, 415  # 415 Unsupported Media Type
+        if ID:
+            mealID = int(ID)
+        else:  # then name is supplied
+            mealID = menus.findMenuIDbyName(name.strip())
+            if mealID is None:  # no such meal given by name
+                return -5, 404
+        try:
+            changes = {}
+            if 'name' in request.json:
+                if not isinstance(request.json['name'], str):
+                    raise ValueError
+                changes['name'] = request.json['name']
+            for ref in MENU_REFS:
+                if ref in request.json:
+                    changes[ref] = int(request.json[ref])
+            if not changes:
+                raise ValueError
+        except:
+            # the body is not a JSON object with some of the fields of a meal
+            if A:
+                return -1, 400
+            else:
+                return -1, 422
+        meal = menus.patchMenu(mealID, changes, request.if_match.contains if request.if_match else None)
+        if not isinstance(meal, int):
+            return mealID, 200, {'ETag': '"{}"'.format(mealVersion(encode(meal)))}
+        if meal == -2:
+            # the new name already belongs to another meal
+            if A:
+                return -2, 400
+            else:
+                return -2, 422
+        if meal == -7:
+            return -7, 409  # the nutrition of one of the dishes is pending or failed
+        if meal == -9:
+            return -9, 412  # 412 Precondition Failed: the meal changed since the client read it
+        if meal == -5:
+            return -5, 404  # the meal (or, if A, one of the dishes) was Not Found
+        return meal, 422  # -6: one of the dishes was not found
+
+# IMPORT_BATCH is the number of dishes or meals of a catalog added to the tables at a time
+IMPORT_BATCH = 1000
+
+
+# exportCatalog yields the lines of the catalog of all the dishes and meals, in NDJSON: {"dish": dish} for each dish,
+# then {"meal": meal} for each meal.   The records are read from the tables STREAM_PAGE at a time, already encoded as
+# JSON (see iterEncoded), so the catalog is never held in memory.
+def exportCatalog():
+    for ID, data in iterEncoded(courses.table):
+        yield b'{"dish": ' + data + b'}\n'
+    for ID, data in iterEncoded(menus.table):
+        yield b'{"meal": ' + data + b'}\n'
+
+
+# importCatalog adds the dishes and meals of the catalog whose lines are given (as written by exportCatalog), reading
+# the lines one at a time and adding the records IMPORT_BATCH at a time.   The IDs of the catalog are not kept: each
+# record gets a new ID, and the dishes of each meal are found by their IDs in the catalog.   A dish whose name already
+# exists is not added, but the meals of the catalog referring to it refer to the existing dish.   It returns the
+# number of records added, of records that already existed, of records that could not be added (a dish not
+# recognized by the nutrition API or a meal referring to a dish not in the catalog) and of lines that are not valid
+# (including records with a nutrient that is not a number).
+def importCatalog(lines):
+    dishIDs = {}  # maps the IDs of the dishes in the catalog to their IDs in the table
+    dishes = []
+    meals = []
+    counts = {"dishes": 0, "meals": 0, "existing": 0, "failed": 0, "invalid": 0}
+
+    def addDishes():
+        for dish, key in zip(dishes, courses.importCourses(dishes)):
+            if key == -2:
+                key = courses.findCourseIDbyName(dish["name"])
+                counts["existing"] = counts["existing"] + 1
+            elif key > 0:
+                counts["dishes"] = counts["dishes"] + 1
+            else:
+                counts["failed"] = counts["failed"] + 1
+            if key is not None and key > 0 and dish.get("ID") is not None:
+                dishIDs[dish["ID"]] = key
+        del dishes[:]
+
+    def addMeals():
+        for key in menus.importMenus(meals):
+            if key > 0:
+                counts["meals"] = counts["meals"] + 1
+            elif key == -2:
+                counts["existing"] = counts["existing"] + 1
+            else:
+                counts["failed"] = counts["failed"] + 1
+        del meals[:]
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if "dish" in item:
+                dish = item["dish"]
+                if not isinstance(dish["name"], str) or not validNutrients(dish, ("cal", "size", "sodium", "sugar")):
+                    raise ValueError
+                dishes.append(dish)
+            else:
+                meal = dict(item["meal"])
+                if not isinstance(meal["name"], str) or not validNutrients(meal, ("cal", "sodium", "sugar")):
+                    raise ValueError
+                if dishes:  # the meal may refer to them
+                    addDishes()
+                if any(meal[ref] is not None and meal[ref] not in dishIDs for ref in MENU_REFS):
+                    counts["failed"] = counts["failed"] + 1  # refers to a dish that is not in the catalog
+                    continue
+                for ref in MENU_REFS:
+                    meal[ref] = None if meal[ref] is None else dishIDs[meal[ref]]
+                meals.append(meal)
+        except (ValueError, KeyError, TypeError):
+            counts["invalid"] = counts["invalid"] + 1
+            continue
+        if len(dishes) >= IMPORT_BATCH:
+            addDishes()
+        if len(meals) >= IMPORT_BATCH:
+            addMeals()
+    addDishes()
+    addMeals()
+    return counts
+
+
+# validNutrients tells whether each of the fields of record is missing, None (to be computed) or a finite number
+def validNutrients(record, fields):
+    return all(record.get(field) is None or isNumber(record[field]) for field in fields)
+
+
+# Catalog implements the /catalog resource, used to move all the dishes and meals from one server to another (see also
+# catalog.py).
+class Catalog(Resource):
+    # GET streams the catalog of all the dishes and meals, in NDJSON (see exportCatalog)
+    def get(self):
+        return Response(exportCatalog(), mimetype='application/x-ndjson')
+
+    # POST takes a catalog in NDJSON (Content-Type application/x-ndjson), as returned by GET, and adds its dishes and
+    # meals (see importCatalog).   The body is read one line at a time.   It returns with code 200 a JSON object with
+    # the number of dishes and meals added, and of records that already existed, failed or were not valid.
+    # If the content-type is not application/x-ndjson, it returns 0 with code 415 (Unsupported Media Type).
+    def post(self):
+        if request.headers.get('Content-Type') != 'application/x-ndjson':
+            return 0, 415
+        return importCatalog(iterLines(request.stream)), 200
+
+
+# iterLines yields the lines of the binary stream, reading it size bytes at a time (reading a request body line by
+# line is very slow when the body is sent in chunks)
+def iterLines(stream, size=65536):
+    rest = b""
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+# initialize creates the global data structures needed (courses, menus and A).   It is called by createApp when the
+# server starts, or else before the first request is served (see initializeOnce).
+def initialize():
     global courses
     global menus
     global A
-    courses = Courses()
-    print("created courses")
-    sys.stdout.flush()
-    menus = Menus()
+    global initialized
+    # the tables are in memory, or in a SQLite file shared by all the worker processes (see storage.makeTables)
+    courseTable, menuTable = makeTables()
+    courses = Courses(courseTable)
+    log.info("created courses")
+    menus = Menus(menuTable)
     A = True
+    menus.repairReferences()
+    courses.resumeEnrichment()
+    initialized = True
+
+
+initialized = False
+initializeLock = threading.Lock()
+
+
+# initializeOnce initializes the server before its first request, unless createApp did
+@app.before_request
+def initializeOnce():
+    if not initialized:
+        with initializeLock:
+            if not initialized:
+                initialize()
+
+
+# createApp initializes the server and returns the Flask app.   A server started with it, e.g.
+# gunicorn --workers 4 --bind 0.0.0.0:80 'meals:createApp()'    or:   FLASK_APP='meals:createApp()' flask run
+# loads the tables (e.g. recovers them from the journal) before it accepts connections, so its first client does not
+# wait for that.   If PRELOAD_CACHES is "1", the caches are filled too (see preloadCaches).
+def createApp():
+    with initializeLock:
+        if not initialized:
+            initialize()
+    if os.environ.get("PRELOAD_CACHES") == "1":
+        preloadCaches()
+    return app
+
+
+# preloadCaches fills the nutrition cache from its SQLite file (NUTRITION_CACHE_PATH), and the response caches with
+# the dishes and meals with the smallest IDs, as many as they hold
+def preloadCaches():
+    loaded = nutritionCache.preload()
+    for table in (courses.table, menus.table):
+        table.encodedPage(0, table.encodedCache.max_size)
+    log.info("preloaded caches", extra={"fields": {"nutrition": loaded}})
 
 
 # associate the Resource '/dishes' with the class Dishes
 # associate the Resource '/meals' with the class Meals
 # associate the Resource '/words/total' with the class Count
 api.add_resource(Dishes, '/dishes')
+api.add_resource(DishesBatch, '/dishes/batch')
 api.add_resource(Dish, '/dishes/<int:ID>', endpoint='/dishes/<int:ID>')
 api.add_resource(Dish, '/dishes/<string:name>', endpoint='/dishes/<string:name>')
+api.add_resource(NutritionCacheStats, '/nutrition/cache')
+api.add_resource(MetricsResource, '/metrics')
 api.add_resource(Meals, '/meals')
+api.add_resource(MealSuggestions, '/meals/suggest')
 api.add_resource(Meal, '/meals/<int:ID>', endpoint='/meals/<int:ID>')
 api.add_resource(Meal, '/meals/<string:name>', endpoint='/meals/<string:name>')
+api.add_resource(Catalog, '/catalog')
+api.add_resource(Stats, '/stats')
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
     # initialize courses and menus dictionaries
     courses = Courses()
-    print("created courses")
-    sys.stdout.flush()
+    log.info("created courses")
     menus = Menus()
     # # enter some test data
     # co = {'name': 'test1', 'ID': 1, 'cal': 204.3, 'size': 100.0, 'sodium': 430, 'sugar': 1.5}
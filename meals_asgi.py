@@ -0,0 +1,330 @@
+# meals_asgi serves the same resources as meals.py as an ASGI application, e.g. with uvicorn:
+# pip install uvicorn aiohttp
+# uvicorn meals_asgi:app --host 0.0.0.0 --port 80      or:  python meals_asgi.py
+#
+# With meals.py under flask or gunicorn, each POST /dishes holds a worker thread for as long as the NINJA API takes to
+# answer, so the number of dishes being added at once (and the GETs that can be served meanwhile) is capped by the
+# number of threads.   Here, POST /dishes and POST /dishes/batch are served by coroutines on the event loop, which look
+# up the nutrition with AsyncNutritionClient (see nutrition_async.py): a lookup waiting on the API holds no thread, so
+# thousands of dishes can be added at once.   At most NUTRITION_CONCURRENCY (default 64) calls are made to the API at
+# the same time; the other lookups wait for their turn.
+#
+# All the other requests (GET /dishes, the /meals resources, DELETE, ...) are passed to the Flask app of meals.py,
+# which serves them in a pool of FLASK_THREADS (default 32) threads.   Since no thread waits on the API, GETs are served
+# at full speed while dishes are being added.   The status codes are the same as with meals.py, including the A flag.
+# The POST /dishes that retrieve the nutrition in the background (see meals.enrichAsync) are passed to Flask as well,
+# since they return at once.
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import meals
+from meal_exceptions import DishNotDefined, APINotReachable, SomeAPIError
+from nutrition_async import AsyncNutritionClient, AsyncQueryBatcher, AsyncSingleFlight
+from nutrition_cache import normalizeQuery
+from nutrition_client import NINJA_NUTRITION_URL
+from rate_limit import INTERACTIVE, BULK
+
+# nutritionClient shares its circuit breaker and rate limiter with the client of meals.py, which is still used by the
+# requests served by Flask
+nutritionClient = AsyncNutritionClient(meals.NINJA_API_KEY,
+                                       url=os.environ.get("NUTRITION_API_URL", NINJA_NUTRITION_URL),
+                                       connect_timeout=float(os.environ.get("NUTRITION_CONNECT_TIMEOUT", "3.05")),
+                                       read_timeout=float(os.environ.get("NUTRITION_READ_TIMEOUT", "10")),
+                                       retries=int(os.environ.get("NUTRITION_RETRIES", "2")),
+                                       max_concurrency=int(os.environ.get("NUTRITION_CONCURRENCY", "64")),
+                                       breaker=meals.nutritionClient.breaker,
+                                       limiter=meals.nutritionLimiter,
+                                       queue_timeout=meals.nutritionClient.queue_timeout)
+nutritionFlight = AsyncSingleFlight()
+nutritionBatcher = AsyncQueryBatcher(nutritionClient, window=meals.nutritionBatcher.window,
+                                     max_items=meals.nutritionBatcher.max_items)
+
+# flaskExecutor runs the requests passed to Flask, and the reads and writes of the tables (which may block on the
+# SQLite file)
+flaskExecutor = ThreadPoolExecutor(max_workers=int(os.environ.get("FLASK_THREADS", "32")), thread_name_prefix="flask")
+
+# CHUNK is the number of bytes of a Flask response sent at a time
+CHUNK = 65536
+
+ready = None  # future set when the tables are initialized
+
+
+async def run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(flaskExecutor, fn, *args)
+
+
+# findCourseInfoOrCode is the async counterpart of meals.findCourseInfoOrCode.   It uses the same nutritionCache.
+async def findCourseInfoOrCode(name, priority=INTERACTIVE):
+    info = meals.nutritionCache.get(name)
+    if info is not None:
+        return info
+    try:
+        return await nutritionFlight.do(normalizeQuery(name), lambda: fetchCourseInfo(name, priority))
+    except DishNotDefined:
+        return -3
+    except (APINotReachable, SomeAPIError):
+        return -4
+
+
+# fetchCourseInfo is the async counterpart of meals.fetchCourseInfo
+async def fetchCourseInfo(name, priority=INTERACTIVE):
+    info = meals.nutritionCache.peek(name)
+    if info is not None:
+        return info
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        info = await nutritionBatcher.lookup(name, priority)
+    except DishNotDefined:
+        outcome = "not_found"
+        raise
+    except APINotReachable:
+        outcome = "unreachable"
+        meals.log.warning("api.api-ninjas.com/v1/nutrition not reachable", extra={"fields": {"dish": name}})
+        raise
+    except SomeAPIError:
+        outcome = "error"
+        meals.log.warning("error from api.api-ninjas.com/v1/nutrition", extra={"fields": {"dish": name}})
+        raise
+    finally:
+        meals.nutritionLatency.observe(time.perf_counter() - start, outcome)
+        meals.nutritionLookups.inc(outcome)
+    meals.nutritionCache.put(name, info)
+    return info
+
+
+# addCourse is the async counterpart of Courses.addCourse and returns the same values
+async def addCourse(name, priority=INTERACTIVE):
+    if await run(meals.courses.findCourseIDbyName, name) is not None:
+        return -2  # dish of given name already exists
+    info = await findCourseInfoOrCode(name, priority)
+    if isinstance(info, int):  # error code
+        return info
+    return await run(meals.courses.table.add, meals.makeCourse(name, None, info))  # -2 if added in the meantime
+
+
+# addCourses is the async counterpart of Courses.addCourses and returns the same values
+async def addCourses(names):
+    results = [-2] * len(names)
+    positions = {}  # maps each new name to its position in names
+    for i, name in enumerate(names):
+        if name not in positions:
+            positions[name] = i
+    keys = await asyncio.gather(*(addCourse(name, BULK) for name in positions))
+    for i, key in zip(positions.values(), keys):
+        results[i] = key
+    return results
+
+
+# postDish serves POST /dishes like Dishes.post.   It returns None if the body is not a JSON object, so the request is
+# passed to Flask, which answers it as before.
+async def postDish(contentType, body):
+    if contentType != 'application/json':
+        return 0, 415  # 415 Unsupported Media Type
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if not isinstance(data.get('name'), str):
+        meals.log.debug("POST /dishes exception: 'name' parameter not supplied or not a string")
+        if meals.A:
+            return -1, 400
+        else:
+            return -1, 422
+    return meals.courseKeyResponse(await addCourse(data['name']))
+
+
+# postDishes serves POST /dishes/batch like DishesBatch.post
+async def postDishes(contentType, body):
+    if contentType != 'application/json':
+        return 0, 415  # 415 Unsupported Media Type
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    names = data.get('names')
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        if meals.A:
+            return -1, 400
+        else:
+            return -1, 422
+    keys = await addCourses(names)
+    return [{"name": name, "ID": key} for name, key in zip(names, keys)], 200
+
+
+# ASYNC_ROUTES maps the paths whose POST requests are served on the event loop to their handlers
+ASYNC_ROUTES = {"/dishes": postDish, "/dishes/batch": postDishes}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    await initialize()
+    body = await readBody(receive)
+    handler = ASYNC_ROUTES.get(scope["path"]) if scope["method"] == "POST" else None
+    if handler is not None:
+        start = time.perf_counter()
+        contentType = None
+        prefer = None
+        clientID = None
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                contentType = value.decode("latin1")
+            elif name == b"prefer":
+                prefer = value.decode("latin1")
+            elif name == b"x-client-id":
+                clientID = value.decode("latin1")
+        if handler is postDish and meals.enrichAsync(prefer):
+            handler = None  # the request is passed to Flask
+        wait = meals.clientWait(clientID, (scope.get("client") or ("", 0))[0]) if handler is not None else 0
+        if wait:  # as meals.limitClient
+            await send({"type": "http.response.start", "status": 429,
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", b"3"),
+                                    (b"retry-after", str(wait).encode())]})
+            await send({"type": "http.response.body", "body": b"-8\n"})
+            meals.requestLatency.observe(time.perf_counter() - start, "POST", scope["path"], 429)
+            return
+        response = await handler(contentType, body) if handler is not None else None
+        if response is not None:
+            data, status = response
+            payload = (json.dumps(data) + "\n").encode()  # as flask_restful writes it
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(payload)).encode())]})
+            await send({"type": "http.response.body", "body": payload})
+            meals.requestLatency.observe(time.perf_counter() - start, "POST", scope["path"], status)
+            return
+    await callFlask(scope, body, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await initialize()
+            nutritionClient.open()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await nutritionClient.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# initialize creates the tables (on the first call) with meals.createApp, in flaskExecutor
+async def initialize():
+    global ready
+    if ready is None:
+        ready = asyncio.ensure_future(run(meals.createApp))
+    await asyncio.shield(ready)
+
+
+async def readBody(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+# callFlask serves the request with the Flask app of meals.py in flaskExecutor.   The response is sent CHUNK bytes at
+# a time, so streamed responses (e.g. GET /dishes?stream=ndjson) are not built in memory.
+async def callFlask(scope, body, send):
+    status, headers, result, chunk, done = await run(startFlask, wsgiEnviron(scope, body))
+    try:
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]})
+        while not done:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk, done = await run(readChunk, result)
+        await send({"type": "http.response.body", "body": chunk})
+    finally:
+        if hasattr(result, "close"):
+            await run(result.close)
+
+
+def startFlask(environ):
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = meals.app(environ, start_response)
+    iterator = iter(result)
+    chunk, done = readChunk(iterator)
+    return started[0], started[1], _Result(result, iterator), chunk, done
+
+
+# _Result keeps the iterable returned by the WSGI app (to close it) with its iterator (to read from it)
+class _Result:
+    def __init__(self, result, iterator):
+        self.result = result
+        self.iterator = iterator
+
+    def __iter__(self):
+        return self.iterator
+
+    def close(self):
+        if hasattr(self.result, "close"):
+            self.result.close()
+
+
+# readChunk reads about CHUNK bytes from a WSGI response and returns them and whether the response is complete
+def readChunk(result):
+    chunks = []
+    size = 0
+    for data in result:
+        chunks.append(data)
+        size = size + len(data)
+        if size >= CHUNK:
+            return b"".join(chunks), False
+    return b"".join(chunks), True
+
+
+# wsgiEnviron returns the WSGI environment of the ASGI request scope with the given body
+def wsgiEnviron(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+        "PATH_INFO": scope["path"].encode().decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "80")), log_level="warning")
@@ -0,0 +1,114 @@
+# Metrics of the server, served in the Prometheus text format on GET /metrics.
+#
+# Counter and Histogram hold values for each combination of their label values (e.g. one histogram of request
+# latencies for each route, method and status code).   Gauge reads its values from a function when the metrics are
+# rendered, e.g. the number of dishes in the store.   All of them are thread-safe and cheap to update, since they are
+# updated on the path of every request.
+import bisect
+import threading
+
+# the upper bounds (in seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def formatLabels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # maps label values to the count
+
+    def inc(self, *labelValues, amount=1):
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            for labelValues, value in sorted(self.values.items()):
+                lines.append("{}{} {}".format(self.name, formatLabels(self.labels, labelValues), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}  # maps label values to [bucket counts..., sum, count]
+
+    def observe(self, value, *labelValues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labelValues)
+            if counts is None:
+                counts = self.values[labelValues] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                counts[i] = counts[i] + 1
+            counts[-2] = counts[-2] + value
+            counts[-1] = counts[-1] + 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        names = self.labels + ("le",)
+        with self.lock:
+            for labelValues, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative = cumulative + count
+                    lines.append("{}_bucket{} {}".format(self.name, formatLabels(names, labelValues + (bound,)),
+                                                         cumulative))
+                lines.append("{}_bucket{} {}".format(self.name, formatLabels(names, labelValues + ("+Inf",)),
+                                                     counts[-1]))
+                labels = formatLabels(self.labels, labelValues)
+                lines.append("{}_sum{} {}".format(self.name, labels, counts[-2]))
+                lines.append("{}_count{} {}".format(self.name, labels, counts[-1]))
+        return lines
+
+
+# Gauge reads its values when rendered: read returns either a number, or a dictionary mapping tuples of label values
+# to numbers
+class Gauge:
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} gauge".format(self.name)]
+        try:
+            values = self.read()
+        except Exception:  # e.g. the store is not initialized yet
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelValues, value in sorted(values.items()):
+            lines.append("{}{} {}".format(self.name, formatLabels(self.labels, labelValues), value))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # render returns all the metrics in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
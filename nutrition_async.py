@@ -0,0 +1,221 @@
+# AsyncNutritionClient is the non-blocking counterpart of NutritionClient (see nutrition_client.py), used by the async
+# server (see meals_asgi.py).   A lookup waiting on the NINJA API does not hold a thread, only a coroutine, so thousands
+# of lookups can be in flight at once.   It has the same timeouts, retries with jittered backoff and circuit breaker as
+# NutritionClient, and at most max_concurrency calls are made to the API at the same time (the other lookups wait
+# for their turn).   It can share the RateLimiter of a NutritionClient, whose tokens it takes without blocking the
+# event loop (see RateLimiter.poll).
+#
+# It needs the aiohttp package (pip install aiohttp).
+import asyncio
+
+import aiohttp
+
+from meal_exceptions import APINotReachable, DishNotDefined, SomeAPIError
+from nutrition_batcher import SEPARATOR, assignItems, batchable
+from nutrition_cache import normalizeQuery
+from nutrition_client import CircuitBreaker, NINJA_NUTRITION_URL, itemsFromResponse, retryDelay, sumItems
+from rate_limit import INTERACTIVE, retryAfter
+
+
+class AsyncNutritionClient:
+    def __init__(self, api_key, url=NINJA_NUTRITION_URL, connect_timeout=3.05, read_timeout=10.0, retries=2,
+                 backoff=0.2, max_backoff=2.0, max_concurrency=64, breaker=None, limiter=None, queue_timeout=30.0):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries  # number of retries after the first attempt
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        # the breaker can be shared with a NutritionClient, so both stop calling the API when it is down
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.limiter = limiter  # None if the calls are not limited
+        self.queue_timeout = queue_timeout
+        self.limit = None  # semaphore bounding the calls in flight, created in the event loop
+        self.session = None
+
+    # open creates the connection pool.   It must be called in the event loop that makes the lookups.
+    def open(self):
+        if self.session is None:
+            self.limit = asyncio.Semaphore(self.max_concurrency)
+            self.session = aiohttp.ClientSession(headers={'X-Api-Key': self.api_key}, timeout=self.timeout,
+                                                 connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+
+    # lookup returns (cal, size, sodium, sugar) for the dish called name, and raises the same exceptions as
+    # NutritionClient.lookup
+    async def lookup(self, name, priority=INTERACTIVE):
+        return sumItems(await self.query(name, priority))
+
+    async def query(self, query, priority=INTERACTIVE):
+        if not await self.take(priority):
+            raise APINotReachable  # waited too long for our turn
+        if not self.breaker.allow():
+            raise APINotReachable
+        self.open()
+        attempt = 0
+        async with self.limit:
+            while True:
+                limited = False
+                try:
+                    async with self.session.get(self.url, params={'query': query}) as response:
+                        status, content = response.status, await response.read()
+                        header = response.headers.get('Retry-After')
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    failed = True  # API not reachable.  retry
+                except aiohttp.ClientError:
+                    self.breaker.recordFailure()
+                    raise SomeAPIError
+                else:
+                    limited = status == 429
+                    if limited and self.limiter is not None:  # quota exceeded.  retry when the limiter lets us
+                        self.limiter.throttle(retryAfter(header))
+                    failed = limited or status >= 500
+                if not failed:
+                    break
+                attempt = attempt + 1
+                if attempt <= self.retries:
+                    if not limited:
+                        await asyncio.sleep(retryDelay(self.backoff, self.max_backoff, attempt))
+                    if await self.take(priority):
+                        continue
+                if limited:
+                    self.breaker.recordSuccess()  # the API answered
+                else:
+                    self.breaker.recordFailure()
+                raise APINotReachable
+        self.breaker.recordSuccess()  # the API answered, even if it does not recognize the dish
+        if self.limiter is not None:
+            self.limiter.recover()
+        return itemsFromResponse(status, content)
+
+    # take waits for the limiter to let a call with the given priority through, and returns False if that would take
+    # more than queue_timeout seconds
+    async def take(self, priority):
+        if self.limiter is None:
+            return True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        while True:
+            wait = self.limiter.poll(priority)
+            if wait == 0:
+                return True
+            if loop.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# AsyncSingleFlight is the asyncio counterpart of SingleFlight (see nutrition_cache.py): concurrent lookups of the same
+# key wait for the first one instead of calling the API again.   It is only used from one event loop, so it needs no
+# lock.
+class AsyncSingleFlight:
+    def __init__(self):
+        self.calls = {}  # maps key to the future of the call in flight for it
+
+    # do returns await fn() for the first caller with key, and the same result for callers that arrive while it runs
+    async def do(self, key, fn):
+        call = self.calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call)
+        call = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            call.exception()  # mark the exception as retrieved, in case no other caller waits for it
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+
+# AsyncQueryBatcher is the asyncio counterpart of QueryBatcher (see nutrition_batcher.py): the lookups made within
+# window seconds of each other (up to max_items of them) are sent to the API as one combined query.   It is only used
+# from one event loop, so it needs no lock.
+class AsyncQueryBatcher:
+    def __init__(self, client, window=0.005, max_items=8, max_chars=500):
+        self.client = client
+        self.window = window
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.batch = None  # maps the normalized name of each dish of the next batch to its _AsyncLookup
+        self.size = 0  # the length of the combined query of the next batch
+        self.timer = None
+        self.calls = 0
+        self.fallbacks = 0
+
+    # lookup returns (cal, size, sodium, sugar) for the dish called name, and raises the same exceptions as
+    # AsyncNutritionClient.lookup
+    async def lookup(self, name, priority=INTERACTIVE):
+        if self.max_items <= 1 or not batchable(name):
+            return await self.client.lookup(name, priority)
+        key = normalizeQuery(name)
+        if self.batch is not None and self.size + len(key) + len(SEPARATOR) > self.max_chars:
+            self.flush()
+        if self.batch is None:
+            self.batch = {}
+            self.size = 0
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        lookup = self.batch.get(key)
+        if lookup is None:
+            lookup = self.batch[key] = _AsyncLookup(name, priority)
+            self.size = self.size + len(key) + len(SEPARATOR)
+        lookup.priority = min(lookup.priority, priority)
+        if len(self.batch) >= self.max_items:
+            self.flush()
+        info = await asyncio.shield(lookup.future)
+        if info is None:  # look the dish up on its own
+            return await self.client.lookup(name, priority)
+        return info
+
+    # flush sends the next batch
+    def flush(self):
+        batch = self.batch
+        self.batch = None
+        self.timer.cancel()
+        asyncio.ensure_future(self.send(batch))
+
+    # send makes the call for the lookups of batch and sets their futures to their result, their error, or None if
+    # the dish must be looked up on its own
+    async def send(self, batch):
+        keys = list(batch)
+        lookups = [batch[key] for key in keys]
+        if len(lookups) == 1:
+            lookups[0].future.set_result(None)  # a call on its own anyway
+            return
+        self.calls = self.calls + 1
+        try:
+            items = await self.client.query(SEPARATOR.join(keys), min(lookup.priority for lookup in lookups))
+        except DishNotDefined:
+            items = []  # none of the dishes was recognized in the combined query
+        except Exception as e:
+            for lookup in lookups:
+                lookup.future.set_exception(e)
+                lookup.future.exception()  # mark the exception as retrieved, in case its caller was cancelled
+            return
+        for lookup, assigned in zip(lookups, assignItems(keys, items)):
+            if assigned is None:
+                self.fallbacks = self.fallbacks + 1
+                lookup.future.set_result(None)
+                continue
+            try:
+                lookup.future.set_result(sumItems(assigned))
+            except DishNotDefined as e:
+                lookup.future.set_exception(e)
+                lookup.future.exception()
+
+
+class _AsyncLookup:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
@@ -0,0 +1,157 @@
+# QueryBatcher cuts the number of calls made to the NINJA nutrition API under bursts of lookups.   The API answers a
+# query naming several foods, e.g. "cereal and eggs", with one item for each food, so the lookups of several dishes can
+# be made with one call.   The lookups that arrive within window seconds of each other (up to max_items of them) are
+# sent as one combined query "dish1 and dish2 and ...", and the items of the response are given back to their dishes
+# by name.
+#
+# A dish gets its result from the combined query only when exactly one item of the response has its (normalized)
+# name.   The dishes for which that is not the case (e.g. the API split or renamed the food, or did not recognize it)
+# are looked up again on their own, as are the dishes whose names would make the combined query ambiguous (see
+# batchable).   If the combined call fails (e.g. the API is not reachable), all its lookups fail with the same error.
+#
+# The first lookup of a batch waits for the window (or until the batch is full) and then makes the call for all of
+# them, so no thread is needed besides the callers.   The dishes looked up again on their own are looked up by their
+# own callers, at the same time.
+import re
+import threading
+import time
+
+from meal_exceptions import DishNotDefined
+from nutrition_cache import normalizeQuery
+from nutrition_client import sumItems
+from rate_limit import INTERACTIVE
+
+# SEPARATOR joins the names of the dishes in a combined query
+SEPARATOR = " and "
+
+# AMBIGUOUS matches the names that cannot be part of a combined query: those that name several foods themselves
+AMBIGUOUS = re.compile(r"\band\b|[,;&+]", re.IGNORECASE)
+
+
+# batchable tells whether the dish called name can be looked up in a combined query
+def batchable(name):
+    return bool(name.strip()) and AMBIGUOUS.search(name) is None
+
+
+# assignItems returns, for each of the (normalized, distinct) names of a combined query, the list of items of the
+# response that belong to it, or None if that is not clear
+def assignItems(names, items):
+    byName = {}
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get("name"), str):
+            key = normalizeQuery(item["name"])
+            byName[key] = byName.get(key, 0) + 1, item
+    assigned = []
+    for name in names:
+        count, item = byName.get(name, (0, None))
+        assigned.append([item] if count == 1 else None)
+    return assigned
+
+
+class QueryBatcher:
+    # client is the NutritionClient making the calls.   max_chars bounds the length of a combined query.
+    def __init__(self, client, window=0.005, max_items=8, max_chars=500):
+        self.client = client
+        self.window = window
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.cond = threading.Condition()
+        self.batch = _Batch()  # the batch the next lookups join
+        self.calls = 0  # combined calls made
+        self.fallbacks = 0  # dishes looked up again on their own
+
+    # lookup returns (cal, size, sodium, sugar) for the dish called name, and raises the same exceptions as
+    # NutritionClient.lookup
+    def lookup(self, name, priority=INTERACTIVE):
+        if self.max_items <= 1 or not batchable(name):
+            return self.client.lookup(name, priority)
+        key = normalizeQuery(name)
+        with self.cond:
+            batch = self.batch
+            if batch.size + len(key) + len(SEPARATOR) > self.max_chars and batch.lookups:
+                batch = self.closeBatch()
+            lookup = batch.lookups.get(key)
+            if lookup is None:
+                lookup = batch.lookups[key] = _Lookup(name, priority)
+                batch.size = batch.size + len(key) + len(SEPARATOR)
+            lookup.priority = min(lookup.priority, priority)
+            leader = len(batch.lookups) == 1 and lookup.waiters == 0
+            lookup.waiters = lookup.waiters + 1
+            if len(batch.lookups) >= self.max_items:
+                self.closeBatch()
+        if leader:
+            with self.cond:
+                deadline = time.monotonic() + self.window
+                while self.batch is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.closeBatch()
+                        break
+                    self.cond.wait(remaining)
+            self.send(batch)
+        lookup.done.wait()
+        if lookup.error is not None:
+            raise lookup.error
+        if lookup.fallback:
+            return self.client.lookup(name, priority)
+        return lookup.result
+
+    # closeBatch starts a new batch for the next lookups, and wakes up the leader of the closed one.   The caller must
+    # hold self.cond.
+    def closeBatch(self):
+        self.batch = _Batch()
+        self.cond.notify_all()
+        return self.batch
+
+    # send makes the call for the lookups of batch and gives each its result, its error, or the task of looking the
+    # dish up on its own (fallback)
+    def send(self, batch):
+        keys = list(batch.lookups)
+        lookups = [batch.lookups[key] for key in keys]
+        if len(lookups) == 1:
+            lookups[0].fallback = True  # a call on its own anyway
+            lookups[0].done.set()
+            return
+        with self.cond:
+            self.calls = self.calls + 1
+        try:
+            items = self.client.query(SEPARATOR.join(keys), min(lookup.priority for lookup in lookups))
+        except DishNotDefined:
+            items = []  # none of the dishes was recognized in the combined query
+        except Exception as e:
+            for lookup in lookups:
+                lookup.error = e
+                lookup.done.set()
+            return
+        for lookup, assigned in zip(lookups, assignItems(keys, items)):
+            if assigned is None:
+                lookup.fallback = True
+                with self.cond:
+                    self.fallbacks = self.fallbacks + 1
+            else:
+                try:
+                    lookup.result = sumItems(assigned)
+                except DishNotDefined as e:
+                    lookup.error = e
+            lookup.done.set()
+
+    def stats(self):
+        with self.cond:
+            return {"calls": self.calls, "fallbacks": self.fallbacks}
+
+
+class _Batch:
+    def __init__(self):
+        self.lookups = {}  # maps the normalized name of each dish to its _Lookup
+        self.size = 0  # the length of the combined query
+
+
+class _Lookup:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.waiters = 0
+        self.fallback = False  # True if the dish must be looked up on its own
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,167 @@
+# NutritionCache caches the results of nutrition lookups (calories, serving size, sodium and sugar of a dish) so that
+# adding a dish whose nutrition was already retrieved does not call api.api-ninjas.com/v1/nutrition again.
+#
+# The cache has two tiers:
+# (1) an in-memory LRU tier bounded by size (max_size entries) and by age (ttl seconds).
+# (2) an optional on-disk tier kept in a SQLite file (path).   It survives restarts of the server.  Entries found in
+#     the disk tier are promoted to the memory tier.
+# Entries are keyed by the normalized query string (see normalizeQuery), so that "Pizza" and " pizza " share an entry.
+# Only successful lookups are cached.   Lookups that fail (dish not recognized, API not reachable) are not cached.
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# normalizeQuery returns the key under which the nutrition of the dish called name is cached: lower case, without
+# leading or trailing whitespace, and with runs of whitespace replaced by a single space
+def normalizeQuery(name):
+    return " ".join(name.lower().split())
+
+
+class NutritionCache:
+    def __init__(self, max_size=10000, ttl=7 * 24 * 3600, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # maps query to (stored_at, (cal, size, sodium, sugar)), least recent first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.diskHits = 0
+        self.db = None
+        if path:
+            # the connection is shared by all threads.  access to it is serialized by self.lock
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS nutrition (query TEXT PRIMARY KEY, stored_at REAL, "
+                            "cal REAL, size REAL, sodium REAL, sugar REAL)")
+            self.db.commit()
+
+    # get returns the cached (cal, size, sodium, sugar) for the dish called name, or None if it is not cached or its
+    # entry is older than ttl seconds
+    def get(self, name):
+        query = normalizeQuery(name)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(query)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self.entries.move_to_end(query)
+                    self.hits = self.hits + 1
+                    return entry[1]
+                del self.entries[query]  # expired
+                self.evictions = self.evictions + 1
+            if self.db is not None:
+                row = self.db.execute("SELECT stored_at, cal, size, sodium, sugar FROM nutrition WHERE query = ?",
+                                      (query,)).fetchone()
+                if row is not None:
+                    if now - row[0] <= self.ttl:
+                        self.hits = self.hits + 1
+                        self.diskHits = self.diskHits + 1
+                        self.insert(query, row[0], tuple(row[1:]))
+                        return tuple(row[1:])
+                    self.db.execute("DELETE FROM nutrition WHERE query = ?", (query,))
+                    self.db.commit()
+                    self.evictions = self.evictions + 1
+            self.misses = self.misses + 1
+            return None
+
+    # peek returns the (cal, size, sodium, sugar) cached in the memory tier for the dish called name, or None.   Unlike
+    # get, it does not count as a hit or miss and does not make the entry the most recently used one.
+    def peek(self, name):
+        with self.lock:
+            entry = self.entries.get(normalizeQuery(name))
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                return entry[1]
+            return None
+
+    # put caches info, the (cal, size, sodium, sugar) of the dish called name, in both tiers
+    def put(self, name, info):
+        query = normalizeQuery(name)
+        now = time.time()
+        with self.lock:
+            self.insert(query, now, tuple(info))
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO nutrition VALUES (?, ?, ?, ?, ?, ?)", (query, now) + tuple(info))
+                self.db.commit()
+
+    # insert adds an entry to the memory tier, evicting the least recently used entries beyond max_size.
+    # The caller must hold self.lock.
+    def insert(self, query, stored_at, info):
+        self.entries[query] = (stored_at, info)
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    # preload fills the memory tier with the most recently stored entries of the disk tier that have not expired, so
+    # that the first lookups after a restart do not read the disk.   It returns the number of entries loaded.
+    def preload(self):
+        if self.db is None:
+            return 0
+        with self.lock:
+            rows = self.db.execute("SELECT query, stored_at, cal, size, sodium, sugar FROM nutrition WHERE stored_at >= ? "
+                                   "ORDER BY stored_at DESC LIMIT ?", (time.time() - self.ttl, self.max_size)).fetchall()
+            for row in reversed(rows):  # the most recent entry is inserted last, as the most recently used one
+                self.insert(row[0], row[1], tuple(row[2:]))
+            return len(rows)
+
+    # clear removes all the entries from both tiers.  The counters are not reset.
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM nutrition")
+                self.db.commit()
+
+    # stats returns the counters of the cache as a dictionary
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.diskHits,
+                "evictions": self.evictions
+            }
+
+
+# SingleFlight coalesces concurrent calls for the same key: while a call for a key is in flight, other callers with the
+# same key wait for it and get its result (or its exception) instead of making their own call.
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # maps key to the _Call in flight for it
+
+    # do returns fn() for the first caller with key, and the same result for callers that arrive while it runs
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,206 @@
+# NutritionClient retrieves the calories, serving size (in grams), sodium (in mg) and sugar (in grams) of a dish from
+# the NINJA nutrition API (api.api-ninjas.com/v1/nutrition).
+#
+# Unlike calling requests.get for each dish, the client:
+# (1) keeps a pool of keep-alive connections (a requests.Session), so that a TLS handshake is not needed on every call.
+# (2) uses connect and read timeouts, so that a slow API cannot hold the caller forever.
+# (3) retries, with jittered exponential backoff, when the API returns a 5xx response or cannot be reached.
+# (4) has a circuit breaker.  After failure_threshold consecutive failed lookups the circuit opens and, for
+#     reset_timeout seconds, lookups fail immediately with APINotReachable instead of waiting on the API.  After that
+#     one trial lookup is let through; if it succeeds the circuit closes again.
+# (5) can take its calls from a RateLimiter (see rate_limit.py), so the API quota is not exceeded.   Each lookup has a
+#     priority, and a lookup that waits more than queue_timeout seconds for its turn fails with APINotReachable.   A 429
+#     response (quota exceeded) slows the limiter down for the time given by its Retry-After header, and is retried.
+import json
+import random
+import threading
+import time
+
+from meal_exceptions import DishNotDefined, APINotReachable, SomeAPIError
+from rate_limit import INTERACTIVE, retryAfter
+
+NINJA_NUTRITION_URL = 'https://api.api-ninjas.com/v1/nutrition'
+
+# requests is imported when the first client session is opened (see NutritionClient.open) rather than when the server
+# starts, since importing it takes a good part of the start up time and many requests never call the API
+requests = None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0  # number of consecutive failures
+        self.openedAt = None  # time at which the circuit was opened, or None if it is closed
+        self.trialInFlight = False
+
+    # allow returns True if a call may be made to the API now.  When the circuit is open it returns False, except for
+    # a single trial call once reset_timeout seconds have passed since the circuit opened.
+    def allow(self):
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if not self.trialInFlight and time.monotonic() - self.openedAt >= self.reset_timeout:
+                self.trialInFlight = True
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.trialInFlight = False
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures = self.failures + 1
+            self.trialInFlight = False
+            if self.openedAt is not None or self.failures >= self.failure_threshold:
+                self.openedAt = time.monotonic()  # open the circuit, or keep it open after a failed trial call
+
+    def state(self):
+        with self.lock:
+            if self.openedAt is None:
+                return "closed"
+            return "half-open" if self.trialInFlight else "open"
+
+
+class NutritionClient:
+    def __init__(self, api_key, url=NINJA_NUTRITION_URL, connect_timeout=3.05, read_timeout=10.0, retries=2,
+                 backoff=0.2, max_backoff=2.0, pool_size=10, failure_threshold=5, reset_timeout=30.0, limiter=None,
+                 queue_timeout=30.0):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries  # number of retries after the first attempt
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.limiter = limiter  # None if the calls are not limited
+        self.queue_timeout = queue_timeout
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.session = None  # opened by the first call (see open)
+
+    # open creates the pool of connections to the API, importing requests the first time
+    def open(self):
+        global requests
+        with self.lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'X-Api-Key': self.api_key})
+                self.session = session
+            return self.session
+
+    # lookup returns (cal, size, sodium, sugar) for the dish called name.
+    # It raises DishNotDefined if the API does not recognize the dish, APINotReachable if the API could not be reached
+    # or kept returning errors (or the circuit is open), and SomeAPIError for any other error.
+    # priority is the priority of the lookup in the limiter (see rate_limit.py).
+    def lookup(self, name, priority=INTERACTIVE):
+        return sumItems(self.query(name, priority))
+
+    # query calls the API for the query string and returns the list of items in its response.  The response holds
+    # one item for each food recognized in the query.  If no food is recognized, DishNotDefined is raised.
+    def query(self, query, priority=INTERACTIVE):
+        if not self.take(priority):
+            raise APINotReachable  # waited too long for our turn
+        if not self.breaker.allow():
+            raise APINotReachable
+        session = self.session or self.open()
+        attempt = 0
+        while True:
+            limited = False
+            try:
+                response = session.get(self.url, params={'query': query}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                failed = True  # API not reachable.  retry
+            except requests.RequestException:
+                self.breaker.recordFailure()
+                raise SomeAPIError
+            else:
+                limited = response.status_code == 429
+                if limited:  # quota exceeded.  retry when the limiter lets us
+                    self.throttle(response.headers.get('Retry-After'))
+                failed = limited or response.status_code >= 500
+            if not failed:
+                break
+            attempt = attempt + 1
+            if attempt <= self.retries:
+                if not limited:
+                    self.sleepBeforeRetry(attempt)
+                if self.take(priority):
+                    continue
+            if limited:
+                self.breaker.recordSuccess()  # the API answered
+            else:
+                self.breaker.recordFailure()
+            raise APINotReachable
+        self.breaker.recordSuccess()  # the API answered, even if it does not recognize the dish
+        if self.limiter is not None:
+            self.limiter.recover()
+        return itemsFromResponse(response.status_code, response.content)
+
+    # take waits for the limiter to let a call with the given priority through, and returns False if that took more
+    # than queue_timeout seconds
+    def take(self, priority):
+        return self.limiter is None or self.limiter.acquire(priority, self.queue_timeout)
+
+    # throttle slows the limiter down after a 429 response with the given Retry-After header
+    def throttle(self, header):
+        if self.limiter is not None:
+            self.limiter.throttle(retryAfter(header))
+
+    # sleepBeforeRetry waits before retry number attempt (see retryDelay)
+    def sleepBeforeRetry(self, attempt):
+        time.sleep(retryDelay(self.backoff, self.max_backoff, attempt))
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+# retryDelay returns the time to wait before retry number attempt, using exponential backoff with "full jitter" (a
+# random wait between 0 and the backoff), so that many callers do not retry at the same moment
+def retryDelay(backoff, max_backoff, attempt):
+    return random.uniform(0, min(max_backoff, backoff * (2 ** attempt)))
+
+
+# itemsFromResponse returns the list of items in a response of the API that was not a 5xx error, given its status code
+# and body.   It raises APINotReachable if the API refused the call and DishNotDefined if it did not recognize any food.
+def itemsFromResponse(status_code, content):
+    if status_code != 200:
+        raise APINotReachable  # e.g. bad API key or quota exceeded.  retrying will not help
+    try:
+        items = json.loads(content)
+    except ValueError:
+        raise DishNotDefined
+    if not items:  # API returns an empty list if it does not recognize the dish
+        raise DishNotDefined
+    return items
+
+
+# sumItems returns (cal, size, sodium, sugar) for a dish from the items returned by the API for it.
+# The response might include multiple items.  E.g., if the query to Ninja is for "cereal and eggs", it will return one
+# item for cereal and one for eggs.  However, "cereal and eggs" is treated as one dish, so the calories, sodium, etc.
+# of the dish is the sum of the calories, sodium, etc. of the items in the response.
+def sumItems(items):
+    try:
+        calories = 0
+        serving_size = 0
+        sodium = 0
+        sugar = 0
+        for val in items:
+            calories += val.get("calories")
+            serving_size += val.get("serving_size_g")
+            sodium += val.get("sodium_mg")
+            sugar += val.get("sugar_g")
+        return calories, serving_size, sodium, sugar
+    except (TypeError, AttributeError):  # item is missing some of the fields
+        raise DishNotDefined
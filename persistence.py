@@ -0,0 +1,138 @@
+# Journal makes the records of MemoryTables (see storage.py) durable, so that the dishes and meals survive a restart
+# without re-calling the NINJA API for every dish.
+#
+# Every add, replace and delete done on a table is appended to a log (one JSON line per operation).   The log is kept
+# in numbered segments, journal.<seq>.log, in the directory of the journal.   Every snapshot_every operations, a
+# compact snapshot of all the tables is written (snapshot.pickle) and a new log segment is started; the segments older
+# than the snapshot are then deleted.   On startup, recover loads the latest snapshot and replays the log segments
+# written after it.
+#
+# To get a snapshot that matches a log position, the snapshot is taken while holding the write locks of all the tables.
+# Writers always take the lock of their table before the lock of the journal, and the snapshot takes the table locks
+# in a fixed order before the journal lock, so the locks cannot deadlock.   Only the copying of the tables' columns is
+# done under the locks; the snapshot file is written by a background thread.
+import glob
+import json
+import os
+import pickle
+import re
+import threading
+
+SNAPSHOT = "snapshot.pickle"
+
+
+class Journal:
+    def __init__(self, directory, snapshot_every=100000, fsync=False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync  # if True, each operation is written to disk before the request returns
+        self.lock = threading.Lock()
+        self.tables = {}  # maps the name of each table to the table
+        self.seq = 0  # number of the current log segment
+        self.log = None
+        self.appended = 0  # operations appended since the last snapshot
+        self.snapshotting = False
+        os.makedirs(directory, exist_ok=True)
+
+    def segmentPath(self, seq):
+        return os.path.join(self.directory, "journal.{}.log".format(seq))
+
+    # segments returns the numbers of the log segments in the directory, in increasing order
+    def segments(self):
+        seqs = []
+        for path in glob.glob(os.path.join(self.directory, "journal.*.log")):
+            match = re.match(r"journal\.(\d+)\.log$", os.path.basename(path))
+            if match:
+                seqs.append(int(match.group(1)))
+        return sorted(seqs)
+
+    # recover fills tables (a dictionary mapping table names to MemoryTables) from the latest snapshot and the log
+    # segments written after it, and then opens a new log segment for the operations that follow.   It returns the
+    # number of operations replayed from the log.
+    def recover(self, tables):
+        self.tables = tables
+        seq = 0
+        path = os.path.join(self.directory, SNAPSHOT)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+            seq = snapshot["seq"]
+            for name, (lastID, records) in snapshot["tables"].items():
+                tables[name].restore(records, lastID)
+        replayed = 0
+        for segment in self.segments():
+            if segment < seq:
+                continue
+            with open(self.segmentPath(segment), "rb") as f:
+                for line in f:
+                    try:
+                        op, name, payload = json.loads(line)
+                    except ValueError:  # a partly written last line, if the process died while writing it
+                        break
+                    tables[name].apply(op, payload)
+                    replayed = replayed + 1
+            seq = segment
+        self.seq = seq + 1
+        self.log = open(self.segmentPath(self.seq), "ab")
+        self.appended = replayed
+        return replayed
+
+    # append adds the operation op ("add", "replace" or "delete") on the table called name to the log.  payload is the
+    # record for add and replace, and the ID for delete.   The caller must hold the write lock of the table.
+    def append(self, op, name, payload):
+        self.appendMany(op, name, [payload])
+
+    # appendMany adds the operation op on the table called name for each of the payloads, writing them to the log at
+    # once
+    def appendMany(self, op, name, payloads):
+        data = b"".join(json.dumps([op, name, payload], separators=(",", ":")).encode() + b"\n" for payload in payloads)
+        with self.lock:
+            self.log.write(data)
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.appended = self.appended + len(payloads)
+            start = self.appended >= self.snapshot_every and not self.snapshotting
+            if start:
+                self.snapshotting = True
+        if start:
+            # the snapshot needs the locks of all the tables, and our caller holds one of them, so it is taken by
+            # another thread
+            threading.Thread(target=self.snapshot, name="journal-snapshot", daemon=True).start()
+
+    # snapshot writes a snapshot of all the tables and starts a new log segment
+    def snapshot(self):
+        try:
+            names = sorted(self.tables)
+            for name in names:
+                self.tables[name].lock.acquireWrite()
+            try:
+                with self.lock:
+                    state = {name: (self.tables[name].lastID, self.tables[name].dump()) for name in names}
+                    self.log.close()
+                    self.seq = self.seq + 1
+                    seq = self.seq
+                    self.log = open(self.segmentPath(seq), "ab")
+                    self.appended = 0
+            finally:
+                for name in reversed(names):
+                    self.tables[name].lock.releaseWrite()
+            # the snapshot holds the tables as they were when segment seq was started
+            path = os.path.join(self.directory, SNAPSHOT)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump({"seq": seq, "tables": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            for segment in self.segments():
+                if segment < seq:
+                    os.remove(self.segmentPath(segment))
+        finally:
+            with self.lock:
+                self.snapshotting = False
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
@@ -0,0 +1,155 @@
+# Rate limiting of the calls to the NINJA nutrition API and of the requests of each client.
+#
+# api-ninjas enforces a quota: once it is exceeded, every lookup fails (429 Too Many Requests), so the dishes being
+# added fail with -4.   RateLimiter keeps the calls made by NutritionClient (see nutrition_client.py) under a rate:
+# (1) a token bucket allows rate calls per second on average, and bursts of up to burst calls.
+# (2) the callers waiting for a token are served by priority (INTERACTIVE before BULK before BACKGROUND), and in order
+#     of arrival for the same priority, so a POST /dishes is not stuck behind thousands of lookups of a batch import.
+# (3) when the API answers 429, throttle stops all the calls for the time given by its Retry-After header and halves
+#     the rate.   The rate grows back to its configured value as calls succeed (recover).
+#
+# ClientLimiter limits the requests of each client of the server (a token bucket per client), so that one client
+# cannot use up the budget of calls to the API shared by all the clients.
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# the priorities of the calls to the API, highest first
+INTERACTIVE = 0  # POST /dishes
+BULK = 1  # POST /dishes/batch, POST /catalog
+BACKGROUND = 2  # the background enrichment of dishes (ENRICH_ASYNC)
+
+# DEFAULT_RETRY_AFTER is the number of seconds the calls stop for after a 429 response without Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimiter:
+    # rate is in calls per second.   If rate is None, the calls are not limited (but still stop after a 429).
+    def __init__(self, rate=None, burst=10):
+        self.maxRate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.pausedUntil = 0.0  # no call is made before this time (see throttle)
+        self.cond = threading.Condition()
+        self.waiters = []  # heap of the (priority, arrival) of the callers waiting in acquire
+        self.arrivals = itertools.count()
+        self.throttles = 0
+
+    # delay returns the number of seconds until a token can be taken.   The caller must hold self.cond.
+    def delay(self, now):
+        if now < self.pausedUntil:
+            return self.pausedUntil - now
+        if self.rate is None:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    # acquire waits until a call with the given priority may be made, and returns True.   It returns False if that
+    # takes more than timeout seconds (None to wait for as long as it takes).
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        with self.cond:
+            me = (priority, next(self.arrivals))
+            heapq.heappush(self.waiters, me)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None  # until woken up, unless we are the first waiter
+                    if self.waiters[0] == me:
+                        wait = self.delay(now)
+                        if wait == 0:
+                            self.tokens = self.tokens - 1
+                            return True
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self.cond.wait(wait)
+            finally:
+                self.waiters.remove(me)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()  # the next waiter may now be first
+
+    # poll takes a token without waiting, for callers that cannot block (the async client).   It returns 0 if the call
+    # with the given priority may be made now, and otherwise the number of seconds to wait before polling again.   A
+    # token is not taken while a caller with the same or a higher priority is waiting in acquire.
+    def poll(self, priority=INTERACTIVE):
+        with self.cond:
+            now = time.monotonic()
+            wait = self.delay(now)
+            if self.waiters and self.waiters[0][0] <= priority:
+                return max(wait, 0.01)
+            if wait == 0:
+                self.tokens = self.tokens - 1
+            return wait
+
+    # throttle is called when the API answers 429: no call is made for retry_after seconds, and the rate is halved
+    def throttle(self, retry_after=None):
+        with self.cond:
+            now = time.monotonic()
+            self.pausedUntil = max(self.pausedUntil, now + (DEFAULT_RETRY_AFTER if retry_after is None else
+                                                            retry_after))
+            if self.rate is not None:
+                self.delay(now)
+                self.rate = max(self.maxRate / 16.0, self.rate / 2.0)
+                self.tokens = 0.0
+            self.throttles = self.throttles + 1
+            self.cond.notify_all()
+
+    # recover is called when a call succeeds: the rate grows back towards its configured value
+    def recover(self):
+        if self.rate == self.maxRate:  # the common case, checked without the lock
+            return
+        with self.cond:
+            self.delay(time.monotonic())
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 20.0)
+
+    def stats(self):
+        with self.cond:
+            return {"rate": self.rate if self.rate is not None else 0, "waiting": len(self.waiters),
+                    "throttles": self.throttles}
+
+
+# retryAfter returns the number of seconds in the Retry-After header value, or None if it is missing or is not a number
+# of seconds (the HTTP date form is not used by the API)
+def retryAfter(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# ClientLimiter allows each client rate requests per second on average, and bursts of up to burst requests.   The
+# buckets of the max_clients clients seen most recently are kept.
+class ClientLimiter:
+    def __init__(self, rate, burst=20, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # maps each client to [tokens, updated], least recent first
+        self.rejected = 0
+
+    # allow returns 0 if the client may make a request now, and otherwise the number of seconds until it may
+    def allow(self, client):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = [float(self.burst), now]
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] = bucket[0] - 1
+                return 0
+            self.rejected = self.rejected + 1
+            return (1 - bucket[0]) / self.rate
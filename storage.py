@@ -0,0 +1,1019 @@
+# Storage for the records (dishes and meals) kept by Courses and Menus.
+#
+# A table holds records.   Each record is a dictionary with a unique "name" and a unique integer "ID" that the table
+# assigns when the record is added.   IDs are never reused.   There are two implementations of a table with the same
+# methods:
+# (1) MemoryTable keeps the records in the memory of the process, in compact columns.   It is thread-safe: it uses a
+#     reader-writer lock, so concurrent reads (GET requests) do not block each other while writes are exclusive.
+#     It can be made durable with a Journal (see persistence.py).
+# (2) SQLiteTable keeps the records in a SQLite database file in WAL mode.   Several processes (e.g. gunicorn workers)
+#     using the same file see the same records, and readers do not block the writer.
+#
+# The methods of a table are:
+#   add(record)           assigns a new ID to record and adds it.  Returns the ID, or -2 if a record with that name
+#                         already exists (the check and the insertion are one atomic step)
+#   addMany(records)      adds the records like add, in one step (one transaction, or one hold of the lock), and
+#                         returns the list of their IDs or -2s
+#   replace(ID, record, expected)
+#                         replaces the record with that ID.  Returns ID, -5 if there is no such record, or -2 if the
+#                         new name belongs to another record.  If expected is given, the record is only replaced if it
+#                         is still equal to expected (compare-and-swap), and -9 is returned if it is not.
+#   delete(ID)            removes the record with that ID and returns it, or None if there is no such record
+#   get(ID)               returns the record with that ID, or None
+#   findIDbyName(name)    returns the ID of the record with that name, or None
+#   findIDsReferencing(ID)  returns the set of IDs of the records whose reference fields (refs, e.g. the appetizer,
+#                         main and dessert of a meal) hold ID
+#   referencedIDs()       returns the set of the IDs held in the reference fields of the records
+#   all()                 returns a dictionary mapping IDs to records
+#   page(after, limit)    returns the list of (at most limit) records with the smallest IDs greater than after, in
+#                         order of ID.  limit None means no limit.
+#   etag()                returns a string that changes whenever the records of the table change
+#   encoded(ID)           returns the record with that ID encoded as JSON (bytes), or None.  The encoded records are
+#                         cached (see EncodedCache), so a record read often is only encoded once.
+#   encodedPage(after, limit)  returns the list of (ID, encoded record) pairs of the records page(after, limit) returns
+#   query(filters, order_by, descending, limit, after)
+#                         returns the list of (at most limit) records whose fields are within the ranges in filters (a
+#                         dictionary mapping field names to (low, high) pairs, inclusive, where None means unbounded),
+#                         ordered by the field order_by, then by ID (or by ID if it is None).   Only the sorted fields of
+#                         the table (sortedFields) can be used in filters and order_by.   after, if not None, is the
+#                         cursor of the last record of the previous page: its (order_by value, ID) pair, or its ID if
+#                         order_by is None.   Only the records after it in that order are returned.
+#   stats()               returns the aggregates of the records (a TableStats, see table_stats.py) of the fields
+#                         statsFields and of the refs, up to date, or None if the table has no statsFields
+#   len(table)            the number of records
+import bisect
+import json
+import math
+import os
+import sqlite3
+import threading
+import uuid
+from array import array
+from collections import OrderedDict
+
+from persistence import Journal
+from table_stats import TableStats
+
+
+# RWLock is a reader-writer lock.   Any number of threads can hold it for reading at the same time, but a thread
+# holding it for writing holds it alone.   Waiting writers are preferred over new readers so writers do not starve.
+class RWLock:
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.writersWaiting = 0
+
+    def acquireRead(self):
+        with self.cond:
+            while self.writer or self.writersWaiting:
+                self.cond.wait()
+            self.readers = self.readers + 1
+
+    def releaseRead(self):
+        with self.cond:
+            self.readers = self.readers - 1
+            if self.readers == 0:
+                self.cond.notify_all()
+
+    def acquireWrite(self):
+        with self.cond:
+            self.writersWaiting = self.writersWaiting + 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.writersWaiting = self.writersWaiting - 1
+            self.writer = True
+
+    def releaseWrite(self):
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+    def reading(self):
+        return _Held(self.acquireRead, self.releaseRead)
+
+    def writing(self):
+        return _Held(self.acquireWrite, self.releaseWrite)
+
+
+# SortedList is a sorted list of (value, ID) pairs, where value is a number and ID an integer: the sorted index of one
+# field of a table.   The pairs are stored in buckets of about LOAD pairs, so adding or removing a pair moves at most a
+# bucket's worth of pairs (instead of half the list), and finding a pair or the start of a range takes O(log n).
+# Each bucket is two arrays, of the values (as doubles) and of the IDs, so a pair takes 16 bytes rather than a tuple
+# and two number objects.
+class SortedList:
+    LOAD = 1000
+
+    def __init__(self, items=()):
+        items = sorted(items)
+        self.buckets = []  # the (values, IDs) arrays of each bucket
+        self.maxes = []  # the largest pair of each bucket
+        for i in range(0, len(items), self.LOAD):
+            chunk = items[i:i + self.LOAD]
+            self.buckets.append((array("d", [value for value, ID in chunk]), array("q", [ID for value, ID in chunk])))
+            self.maxes.append((float(chunk[-1][0]), chunk[-1][1]))
+        self.size = len(items)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, item):
+        self.size = self.size + 1
+        if not self.buckets:
+            self.buckets.append((array("d", [item[0]]), array("q", [item[1]])))
+            self.maxes.append((float(item[0]), item[1]))
+            return
+        i = min(bisect.bisect_left(self.maxes, item), len(self.maxes) - 1)
+        values, IDs = self.buckets[i]
+        j = position(values, IDs, item)
+        values.insert(j, item[0])
+        IDs.insert(j, item[1])
+        self.maxes[i] = (values[-1], IDs[-1])
+        if len(values) > 2 * self.LOAD:  # split the bucket in two
+            self.buckets[i:i + 1] = [(values[:self.LOAD], IDs[:self.LOAD]), (values[self.LOAD:], IDs[self.LOAD:])]
+            self.maxes[i:i + 1] = [(values[self.LOAD - 1], IDs[self.LOAD - 1]), (values[-1], IDs[-1])]
+
+    def remove(self, item):
+        i = bisect.bisect_left(self.maxes, item)
+        values, IDs = self.buckets[i] if i < len(self.buckets) else ((), ())
+        j = position(values, IDs, item)
+        if j == len(values) or values[j] != item[0] or IDs[j] != item[1]:
+            raise ValueError("item not in SortedList")
+        del values[j]
+        del IDs[j]
+        self.size = self.size - 1
+        if values:
+            self.maxes[i] = (values[-1], IDs[-1])
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    # irange yields the pairs x with low <= x <= high in increasing order, or in decreasing order if reverse is True.
+    # low or high None means unbounded.   Like the pairs, low and high are compared as tuples, e.g. low=(v,) starts at
+    # the first pair with value v.   The values are yielded as floats.
+    def irange(self, low=None, high=None, reverse=False):
+        if not self.buckets:
+            return
+        if not reverse:
+            i = 0 if low is None else bisect.bisect_left(self.maxes, low)
+            j = 0 if low is None or i == len(self.buckets) else position(*self.buckets[i], low)
+            while i < len(self.buckets):
+                values, IDs = self.buckets[i]
+                end = len(values) if high is None else position(values, IDs, high, True)
+                for k in range(j, end):
+                    yield values[k], IDs[k]
+                if end < len(values):
+                    return
+                i, j = i + 1, 0
+        else:
+            i = len(self.buckets) - 1 if high is None else min(bisect.bisect_right(self.maxes, high),
+                                                                 len(self.buckets) - 1)
+            j = len(self.buckets[i][0]) if high is None else position(*self.buckets[i], high, True)
+            while i >= 0:
+                values, IDs = self.buckets[i]
+                start = 0 if low is None else position(values, IDs, low)
+                for k in range(j - 1, start - 1, -1):
+                    yield values[k], IDs[k]
+                if start > 0:
+                    return
+                i = i - 1
+                j = len(self.buckets[i][0]) if i >= 0 else 0
+
+
+# position returns the position in a bucket (its values and IDs) of the first pair not less than item, or greater
+# than item if right is True.   item is a (value,) or (value, ID) tuple.
+def position(values, IDs, item, right=False):
+    lo = bisect.bisect_left(values, item[0])
+    if len(item) == 1:  # (value,) is less than any pair with that value
+        return lo
+    hi = bisect.bisect_right(values, item[0], lo)
+    if right:
+        return bisect.bisect_right(IDs, item[1], lo, hi)
+    return bisect.bisect_left(IDs, item[1], lo, hi)
+
+
+# EncodedCache is an LRU cache of the records of a table encoded as JSON, keyed by ID, holding at most max_size records.
+# A table discards the entry of a record when the record changes.   If the table can be changed by other processes
+# (SQLiteTable), the entries are also tagged with the table's ETag and all dropped when it changes (see validate).
+class EncodedCache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # maps IDs to encoded records, least recent first
+        self.tag = None
+        self.hits = 0
+        self.misses = 0
+
+    # get returns the encoded record with that ID, or None.   If count is False, it does not count as a hit or miss
+    # and does not make the entry the most recently used one (e.g. when listing all the records).
+    def get(self, ID, count=True):
+        with self.lock:
+            data = self.entries.get(ID)
+            if count:
+                if data is None:
+                    self.misses = self.misses + 1
+                else:
+                    self.hits = self.hits + 1
+                    self.entries.move_to_end(ID)
+            return data
+
+    # put caches data, the encoded record with that ID, unless tag is given and the entries have another tag.   If evict
+    # is False, data is only cached if the cache is not full.
+    def put(self, ID, data, tag=None, evict=True):
+        with self.lock:
+            if tag is not None and tag != self.tag:
+                return
+            if not evict and len(self.entries) >= self.max_size:
+                return
+            self.entries[ID] = data
+            self.entries.move_to_end(ID)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, ID):
+        with self.lock:
+            self.entries.pop(ID, None)
+
+    # validate drops all the entries if tag is not the tag they were cached with
+    def validate(self, tag):
+        with self.lock:
+            if tag != self.tag:
+                self.entries.clear()
+                self.tag = tag
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+# encode returns record encoded as JSON, as flask_restful encodes it
+def encode(record):
+    return json.dumps(record).encode()
+
+
+class _Held:
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# MemoryTable keeps its records in columns rather than as one dictionary per record, which takes a fraction of the
+# memory.   The records are kept in slots, in increasing order of ID: ids holds the ID of each slot, names its name (or
+# None if the record in it was deleted), and each field has a column with its value in each slot.   A column is an
+# array of doubles, with a kind per slot telling whether the value is a float, an int or None, unless the field holds
+# other values (e.g. strings), in which case the column is a list.   A record is only made into a dictionary when it is
+# read (get, all, page, query and delete return dictionaries, as before).
+# IDs are assigned in increasing order, so a new record is appended and the slot of an ID is found by bisection.   The
+# slot of a deleted record is left free, and the free slots are dropped once they outnumber the records.
+# fields are the names of the fields of a record other than "ID" and "name" (as for SQLiteTable).
+# If a journal (see persistence.py) is given, every change to a MemoryTable is logged to it under the table's name,
+# so that the table can be recovered after a restart.
+class MemoryTable:
+    def __init__(self, fields, refs=(), sortedFields=(), name=None, journal=None, cache_size=10000, statsFields=()):
+        self.fields = tuple(fields)
+        self.refs = tuple(refs)
+        self.sortedFields = tuple(sortedFields)
+        self.name = name
+        self.journal = journal
+        # maps each sorted field to a SortedList of the (value, ID) pairs of the records (with a value in that field)
+        self.sortedIndexes = {field: SortedList() for field in self.sortedFields}
+        self.lock = RWLock()
+        self.lastID = 0
+        self.ids = array("q")  # the ID of each slot, in increasing order
+        self.names = []  # the name of the record in each slot, or None if the slot is free
+        self.columns = {field: array("d") for field in self.fields}
+        self.kinds = {field: bytearray() for field in self.fields}  # FLOAT, INT or NONE for each slot
+        self.count = 0  # the number of records
+        self.idsByName = {}  # maps the name of each record to its ID
+        self.referencing = {}  # maps each ID held in a reference field to the IDs of the records holding it
+        self.epoch = uuid.uuid4().hex  # the versions of two different instances of the table must not be confused
+        self.version = 0  # incremented on every change
+        self.encodedCache = EncodedCache(cache_size)
+        # the aggregates of the records, kept up to date by insert and remove
+        self.aggregates = TableStats(statsFields, self.refs) if statsFields else None
+
+    def add(self, record):
+        checkSorted(record, self.sortedFields)
+        with self.lock.writing():
+            if record["name"] in self.idsByName:
+                return -2
+            self.lastID = self.lastID + 1
+            record["ID"] = self.lastID
+            self.insert(record)
+            if self.journal is not None:
+                self.journal.append("add", self.name, record)
+            return self.lastID
+
+    def addMany(self, records):
+        for record in records:  # before any is added, so a bad record leaves the table unchanged
+            checkSorted(record, self.sortedFields)
+        with self.lock.writing():
+            IDs = []
+            added = []
+            for record in records:
+                if record["name"] in self.idsByName:
+                    IDs.append(-2)
+                    continue
+                self.lastID = self.lastID + 1
+                record["ID"] = self.lastID
+                self.insert(record)
+                IDs.append(self.lastID)
+                added.append(record)
+            if self.journal is not None and added:
+                self.journal.appendMany("add", self.name, added)
+            return IDs
+
+    def replace(self, ID, record, expected=None):
+        with self.lock.writing():
+            i = self.slot(ID)
+            if i is None:
+                return -5
+            if expected is not None and self.record(i) != expected:
+                return -9
+            if self.idsByName.get(record["name"], ID) != ID:
+                return -2
+            checkSorted(record, self.sortedFields)  # before the old record is removed
+            record["ID"] = ID
+            self.remove(ID)
+            self.insert(record)
+            if self.journal is not None:
+                self.journal.append("replace", self.name, record)
+            return ID
+
+    def delete(self, ID):
+        with self.lock.writing():
+            record = self.remove(ID)
+            if record is not None:
+                if self.journal is not None:
+                    self.journal.append("delete", self.name, ID)
+                if len(self.ids) - self.count > max(COMPACT_MIN, self.count):
+                    self.compact()
+            return record
+
+    # slot returns the slot of the record with that ID, or None if there is no such record
+    def slot(self, ID):
+        i = bisect.bisect_left(self.ids, ID)
+        if i < len(self.ids) and self.ids[i] == ID and self.names[i] is not None:
+            return i
+        return None
+
+    # value returns the value of field in slot i
+    def value(self, field, i):
+        column = self.columns[field]
+        if type(column) is list:
+            return column[i]
+        kind = self.kinds[field][i]
+        if kind == FLOAT:
+            return column[i]
+        if kind == INT:
+            return int(column[i])
+        return None
+
+    # record returns the record in slot i as a dictionary
+    def record(self, i):
+        record = {"name": self.names[i], "ID": self.ids[i]}
+        for field in self.fields:
+            record[field] = self.value(field, i)
+        return record
+
+    # store puts record in the slot of its ID, which is added if the table never held that ID
+    def store(self, record):
+        ID = record["ID"]
+        i = bisect.bisect_left(self.ids, ID)
+        if i == len(self.ids) or self.ids[i] != ID:  # a new slot, at the end unless the IDs are out of order
+            self.ids.insert(i, ID)
+            self.names.insert(i, None)
+            for field in self.fields:
+                column = self.columns[field]
+                column.insert(i, None if type(column) is list else 0.0)
+                self.kinds[field].insert(i, NONE)
+        self.names[i] = record["name"]
+        for field in self.fields:
+            value = record.get(field)
+            column = self.columns[field]
+            if type(column) is not list:
+                kind = kindOf(value)
+                if kind is not None:
+                    column[i] = 0.0 if kind == NONE else value
+                    self.kinds[field][i] = kind
+                    continue
+                # not a number: the field's column becomes a list of its values
+                column = self.columns[field] = [self.value(field, j) for j in range(len(self.ids))]
+            column[i] = value
+        return i
+
+    # insert and remove change the records and the indexes on them.  The caller must hold the write lock.   insert
+    # checks the record before it changes anything, so a record that cannot be indexed raises ValueError and leaves the
+    # table unchanged.
+    def insert(self, record):
+        checkSorted(record, self.sortedFields)
+        self.store(record)
+        self.encodedCache.discard(record["ID"])
+        self.count = self.count + 1
+        self.idsByName[record["name"]] = record["ID"]
+        for field, index in self.sortedIndexes.items():
+            if record.get(field) is not None:
+                index.add((record[field], record["ID"]))
+        self.version = self.version + 1
+        for ref in self.refs:
+            if record.get(ref) is not None:
+                self.addReference(record[ref], record["ID"])
+        if self.aggregates is not None:
+            self.aggregates.add(record)
+
+    def remove(self, ID):
+        i = self.slot(ID)
+        if i is None:
+            return None
+        record = self.record(i)
+        self.names[i] = None
+        self.encodedCache.discard(ID)
+        self.count = self.count - 1
+        del self.idsByName[record["name"]]
+        for field, index in self.sortedIndexes.items():
+            if record[field] is not None:
+                index.remove((record[field], ID))
+        self.version = self.version + 1
+        for ref in self.refs:
+            if record[ref] is not None:
+                self.removeReference(record[ref], ID)
+        if self.aggregates is not None:
+            self.aggregates.remove(record)
+        return record
+
+    # addReference and removeReference change referencing, which maps each ID held in a reference field to the IDs of
+    # the records holding it: a single ID, an array of up to REFERENCES_ARRAY IDs, or else a set of IDs
+    def addReference(self, target, ID):
+        IDs = self.referencing.get(target)
+        if IDs is None:
+            self.referencing[target] = ID
+        elif type(IDs) is int:
+            if IDs != ID:
+                self.referencing[target] = array("q", [IDs, ID])
+        elif type(IDs) is set:
+            IDs.add(ID)
+        elif ID not in IDs:
+            if len(IDs) < REFERENCES_ARRAY:
+                IDs.append(ID)
+            else:
+                self.referencing[target] = set(IDs) | {ID}
+
+    def removeReference(self, target, ID):
+        IDs = self.referencing.get(target)
+        if IDs is None:
+            return
+        if type(IDs) is int:
+            if IDs == ID:
+                del self.referencing[target]
+        elif ID in IDs:
+            IDs.remove(ID)
+            if len(IDs) == 1:
+                self.referencing[target] = next(iter(IDs))
+
+    # compact drops the free slots
+    def compact(self):
+        keep = [i for i, name in enumerate(self.names) if name is not None]
+        self.ids = array("q", [self.ids[i] for i in keep])
+        self.names = [self.names[i] for i in keep]
+        for field in self.fields:
+            column = self.columns[field]
+            values = [column[i] for i in keep]
+            self.columns[field] = values if type(column) is list else array("d", values)
+            kinds = self.kinds[field]
+            self.kinds[field] = bytearray([kinds[i] for i in keep])
+
+    # apply redoes an operation read from the journal (see Journal.append), without logging it again
+    def apply(self, op, payload):
+        if op == "delete":
+            self.remove(payload)
+        else:
+            self.remove(payload["ID"])
+            self.insert(payload)
+            self.lastID = max(self.lastID, payload["ID"])
+
+    # dump returns a copy of the columns of the table, for a snapshot (see Journal.snapshot).   The caller must hold the
+    # write lock.
+    def dump(self):
+        return {"ids": array("q", self.ids), "names": list(self.names),
+                "columns": {field: column[:] for field, column in self.columns.items()},
+                "kinds": {field: bytearray(kinds) for field, kinds in self.kinds.items()}}
+
+    # restore replaces the contents of the table with records read from a snapshot: the columns returned by dump, or
+    # a dictionary mapping IDs to records (as in the snapshots written before the records were kept in columns).
+    # lastID is the last ID assigned when the snapshot was taken.
+    def restore(self, records, lastID):
+        if "columns" in records:
+            self.ids, self.names = records["ids"], records["names"]
+            self.columns, self.kinds = records["columns"], records["kinds"]
+        else:
+            self.ids, self.names = array("q"), []
+            self.columns = {field: array("d") for field in self.fields}
+            self.kinds = {field: bytearray() for field in self.fields}
+            for record in sorted(records.values(), key=lambda record: record["ID"]):
+                self.store(record)
+        self.compact()
+        self.count = len(self.ids)
+        self.idsByName = dict(zip(self.names, self.ids))
+        self.referencing = {}
+        for ref in self.refs:
+            for i, ID in enumerate(self.ids):
+                value = self.value(ref, i)
+                if value is not None:
+                    self.addReference(value, ID)
+        # the indexes are built at the end, all at once, which is faster than adding the records one by one
+        self.sortedIndexes = {field: SortedList((self.value(field, i), ID) for i, ID in enumerate(self.ids)
+                                                if self.value(field, i) is not None)
+                              for field in self.sortedFields}
+        if self.aggregates is not None:
+            self.loadAggregates()
+        self.lastID = lastID
+        self.version = self.version + 1
+        self.encodedCache.clear()
+
+    # setStats makes the table keep the aggregates of the fields statsFields (and of its refs), loaded from its records.
+    # Loading them once the table is recovered from its journal is faster than updating them for every operation
+    # replayed.
+    def setStats(self, statsFields):
+        with self.lock.writing():
+            self.aggregates = TableStats(statsFields, self.refs)
+            self.loadAggregates()
+
+    # loadAggregates loads the aggregates from the columns.   The caller must hold the write lock.
+    def loadAggregates(self):
+        self.aggregates.load(self.count, {field: [self.value(field, i) for i, name in enumerate(self.names)
+                                                  if name is not None]
+                                          for field in self.aggregates.columns})
+
+    def get(self, ID):
+        with self.lock.reading():
+            i = self.slot(ID)
+            return None if i is None else self.record(i)
+
+    def findIDbyName(self, name):
+        with self.lock.reading():
+            return self.idsByName.get(name)
+
+    def findIDsReferencing(self, ID):
+        with self.lock.reading():
+            IDs = self.referencing.get(ID)
+            if IDs is None:
+                return set()
+            return {IDs} if type(IDs) is int else set(IDs)
+
+    def referencedIDs(self):
+        with self.lock.reading():
+            return set(self.referencing)
+
+    def all(self):
+        with self.lock.reading():
+            return {self.ids[i]: self.record(i) for i, name in enumerate(self.names) if name is not None}
+
+    def page(self, after=0, limit=None):
+        with self.lock.reading():
+            records = []
+            i = bisect.bisect_right(self.ids, after)
+            while i < len(self.ids) and (limit is None or len(records) < limit):
+                if self.names[i] is not None:
+                    records.append(self.record(i))
+                i = i + 1
+            return records
+
+    def etag(self):
+        return "{}-{}".format(self.epoch, self.version)
+
+    # the encoded records are cached while the read lock is held, so a writer cannot change a record between its
+    # encoding and its caching
+    def encoded(self, ID):
+        data = self.encodedCache.get(ID)
+        if data is not None:
+            return data
+        with self.lock.reading():
+            i = self.slot(ID)
+            if i is None:
+                return None
+            data = encode(self.record(i))
+            self.encodedCache.put(ID, data)
+            return data
+
+    # encodedPage caches the records it encodes only while the cache is not full, so as not to evict the records read
+    # often
+    def encodedPage(self, after=0, limit=None):
+        with self.lock.reading():
+            pairs = []
+            i = bisect.bisect_right(self.ids, after)
+            while i < len(self.ids) and (limit is None or len(pairs) < limit):
+                if self.names[i] is not None:
+                    ID = self.ids[i]
+                    data = self.encodedCache.get(ID, False)
+                    if data is None:
+                        data = encode(self.record(i))
+                        self.encodedCache.put(ID, data, evict=False)
+                    pairs.append((ID, data))
+                i = i + 1
+            return pairs
+
+    # query walks the sorted index of one field (order_by, or else the first field filtered on) between the bounds of
+    # its filter (from the cursor after, if ordered by it), and checks the other filters on each record it meets.  It takes O(log n + k), where k is the number
+    # of records within the bounds of that one field (plus sorting the records found by ID if order_by is None).
+    def query(self, filters, order_by=None, descending=False, limit=None, after=None):
+        field = order_by if order_by is not None else next(iter(filters), None)
+        with self.lock.reading():
+            if field is None:
+                slots = reversed(range(len(self.ids))) if descending else range(len(self.ids))
+                slots = (i for i in slots if self.names[i] is not None)
+            else:
+                low, high = filters.get(field, (None, None))
+                low = None if low is None else (low,)
+                high = None if high is None else (high, math.inf)
+                if order_by is not None and after is not None:  # the walk starts at the cursor
+                    if descending:
+                        high = after if high is None else min(high, after)
+                    else:
+                        low = after if low is None else max(low, after)
+                pairs = self.sortedIndexes[field].irange(low, high, descending)
+                slots = (self.slot(ID) for value, ID in pairs if order_by is None or (value, ID) != after)
+            if order_by is None and after is not None:
+                slots = (i for i in slots if (self.ids[i] < after if descending else self.ids[i] > after))
+            byID = order_by is None and field is not None  # the records found must be sorted by ID at the end
+            results = []
+            for i in slots:
+                if all(inRange(self.value(f, i), low, high) for f, (low, high) in filters.items()):
+                    results.append(self.record(i))
+                    if not byID and limit is not None and len(results) >= limit:
+                        break
+        if byID:
+            results.sort(key=lambda record: record["ID"], reverse=descending)
+            results = results[:limit]
+        return results
+
+    def stats(self):
+        return self.aggregates
+
+    def __len__(self):
+        return self.count
+
+
+# the kinds of the values in the columns of a MemoryTable
+FLOAT, INT, NONE = 0, 1, 2
+COMPACT_MIN = 1024  # the free slots of a MemoryTable are kept while there are fewer than this
+REFERENCES_ARRAY = 64  # the largest number of IDs kept in an array rather than a set in MemoryTable.referencing
+
+
+# checkSorted raises ValueError if a sorted field of record holds something other than None or a finite number, which
+# the sorted indexes cannot order (and the range queries could not compare)
+def checkSorted(record, sortedFields):
+    for field in sortedFields:
+        value = record.get(field)
+        if value is not None and (kindOf(value) not in (FLOAT, INT) or not math.isfinite(value)):
+            raise ValueError("{} is not a number: {!r}".format(field, value))
+
+
+# kindOf returns the kind of value in a column of doubles, or None if it cannot be kept in one
+def kindOf(value):
+    if value is None:
+        return NONE
+    if isinstance(value, float):
+        return FLOAT
+    if isinstance(value, int) and not isinstance(value, bool) and -2 ** 53 <= value <= 2 ** 53:
+        return INT
+    return None
+
+
+class SQLiteTable:
+    # fields are the names of the fields of a record other than "ID" and "name".  refs are the fields among them that
+    # hold the IDs of other records, and sortedFields are those that can be queried by range (see query).
+    # The aggregates (see stats) are kept in the process and updated by its own writes.   They are loaded again from
+    # the table when it was changed by another process (e.g. another gunicorn worker).
+    def __init__(self, path, table, fields, refs=(), sortedFields=(), cache_size=10000, statsFields=()):
+        self.path = path
+        self.table = table
+        self.fields = list(fields)
+        self.refs = tuple(refs)
+        self.sortedFields = tuple(sortedFields)
+        self.columns = ["ID", "name"] + self.fields
+        self.local = threading.local()  # each thread has its own connection
+        self.encodedCache = EncodedCache(cache_size)  # dropped whenever the table changes, in any process
+        self.aggregates = TableStats(statsFields, self.refs) if statsFields else None
+        self.aggregatesVersion = None  # the version of the table the aggregates are of (None: not loaded)
+        self.aggregatesLock = threading.Lock()
+        # the fields are declared without a type, so SQLite stores each value as given (an int stays an int and a
+        # float stays a float) and the records read back are the same as the records written
+        self.connection().execute("CREATE TABLE IF NOT EXISTS {} (ID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                  "name TEXT UNIQUE NOT NULL, {})".format(table, ", ".join(self.fields)))
+        for field in self.refs + self.sortedFields:
+            self.connection().execute("CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})".format(table, field))
+        # the version of the table is kept in the versions table and incremented by triggers on every change
+        db = self.connection()
+        db.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, epoch TEXT, version INTEGER)")
+        db.execute("INSERT OR IGNORE INTO versions VALUES (?, ?, 0)", (table, uuid.uuid4().hex))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            db.execute("CREATE TRIGGER IF NOT EXISTS {0}_{2} AFTER {1} ON {0} BEGIN UPDATE versions SET "
+                       "version = version + 1 WHERE name = '{0}'; END".format(table, event, event.lower()))
+
+    # connection returns the connection of the current thread to the database, opening it if needed
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)  # transactions are explicit
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    # toRecord returns the record stored in row, with its fields in the same order as the records made by meals.py
+    def toRecord(self, row):
+        if row is None:
+            return None
+        record = {"name": row[1], "ID": row[0]}
+        record.update(zip(self.fields, row[2:]))
+        return record
+
+    def add(self, record):
+        checkSorted(record, self.sortedFields)
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")  # takes the write lock, so the name check and the insert are atomic
+        try:
+            if db.execute("SELECT 1 FROM {} WHERE name = ?".format(self.table), (record["name"],)).fetchone():
+                db.execute("ROLLBACK")
+                return -2
+            before = self.currentVersion(db)
+            row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table,)).fetchone()
+            record["ID"] = (row[0] if row else 0) + 1
+            db.execute("INSERT INTO {} VALUES ({})".format(self.table, ", ".join("?" * len(self.columns))),
+                       [record[column] for column in self.columns])
+            self.aggregate(db, before, added=[record])
+            db.execute("COMMIT")
+            return record["ID"]
+        except BaseException:
+            self.rollback(db)
+            raise
+
+    def addMany(self, records):
+        for record in records:
+            checkSorted(record, self.sortedFields)
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            before = self.currentVersion(db)
+            row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table,)).fetchone()
+            lastID = row[0] if row else 0
+            IDs = []
+            added = []
+            for record in records:
+                if db.execute("SELECT 1 FROM {} WHERE name = ?".format(self.table), (record["name"],)).fetchone():
+                    IDs.append(-2)
+                    continue
+                lastID = lastID + 1
+                record["ID"] = lastID
+                db.execute("INSERT INTO {} VALUES ({})".format(self.table, ", ".join("?" * len(self.columns))),
+                           [record[column] for column in self.columns])
+                IDs.append(lastID)
+                added.append(record)
+            self.aggregate(db, before, added=added)
+            db.execute("COMMIT")
+            return IDs
+        except BaseException:
+            self.rollback(db)
+            raise
+
+    def replace(self, ID, record, expected=None):
+        checkSorted(record, self.sortedFields)
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            old = self.toRecord(db.execute("SELECT * FROM {} WHERE ID = ?".format(self.table), (ID,)).fetchone())
+            if old is None:
+                db.execute("ROLLBACK")
+                return -5
+            if expected is not None and old != expected:
+                db.execute("ROLLBACK")
+                return -9
+            row = db.execute("SELECT ID FROM {} WHERE name = ?".format(self.table), (record["name"],)).fetchone()
+            if row is not None and row[0] != ID:
+                db.execute("ROLLBACK")
+                return -2
+            record["ID"] = ID
+            before = self.currentVersion(db)
+            db.execute("UPDATE {} SET {} WHERE ID = ?".format(self.table, ", ".join(c + " = ?" for c in self.columns)),
+                       [record[column] for column in self.columns] + [ID])
+            self.aggregate(db, before, [old], [record])
+            db.execute("COMMIT")
+            return ID
+        except BaseException:
+            self.rollback(db)
+            raise
+
+    def delete(self, ID):
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            record = self.toRecord(db.execute("SELECT * FROM {} WHERE ID = ?".format(self.table), (ID,)).fetchone())
+            if record is not None:
+                before = self.currentVersion(db)
+                db.execute("DELETE FROM {} WHERE ID = ?".format(self.table), (ID,))
+                self.aggregate(db, before, removed=[record])
+            db.execute("COMMIT")
+            return record
+        except BaseException:
+            self.rollback(db)
+            raise
+
+    # currentVersion returns the version of the table (see etag) seen by the transaction of db
+    def currentVersion(self, db):
+        return db.execute("SELECT version FROM versions WHERE name = ?", (self.table,)).fetchone()[0]
+
+    # aggregate updates the aggregates with the records removed and added by the write transaction of db, before it
+    # commits.   before is the version of the table at the start of the transaction: if the aggregates are not of that
+    # version (the table was changed by another process), they are left to be loaded again by stats.
+    def aggregate(self, db, before, removed=(), added=()):
+        if self.aggregates is None:
+            return
+        with self.aggregatesLock:
+            if self.aggregatesVersion != before:
+                return
+            for record in removed:
+                self.aggregates.remove(record)
+            for record in added:
+                self.aggregates.add(record)
+            self.aggregatesVersion = self.currentVersion(db)
+
+    # rollback rolls back the write transaction of db after an error.   The aggregates may have been updated with its
+    # changes, so they are loaded again.
+    def rollback(self, db):
+        db.execute("ROLLBACK")
+        with self.aggregatesLock:
+            self.aggregatesVersion = None
+
+    def get(self, ID):
+        return self.toRecord(self.connection().execute("SELECT * FROM {} WHERE ID = ?".format(self.table),
+                                                       (ID,)).fetchone())
+
+    def findIDbyName(self, name):
+        row = self.connection().execute("SELECT ID FROM {} WHERE name = ?".format(self.table), (name,)).fetchone()
+        return row[0] if row else None
+
+    def findIDsReferencing(self, ID):
+        if not self.refs:
+            return set()
+        query = " UNION ".join("SELECT ID FROM {} WHERE {} = ?".format(self.table, ref) for ref in self.refs)
+        return {row[0] for row in self.connection().execute(query, (ID,) * len(self.refs))}
+
+    def referencedIDs(self):
+        if not self.refs:
+            return set()
+        query = " UNION ".join("SELECT {1} FROM {0} WHERE {1} IS NOT NULL".format(self.table, ref) for ref in self.refs)
+        return {row[0] for row in self.connection().execute(query)}
+
+    def all(self):
+        rows = self.connection().execute("SELECT * FROM {} ORDER BY ID".format(self.table))
+        return {row[0]: self.toRecord(row) for row in rows}
+
+    def page(self, after=0, limit=None):
+        rows = self.connection().execute("SELECT * FROM {} WHERE ID > ? ORDER BY ID LIMIT ?".format(self.table),
+                                         (after, -1 if limit is None else limit))
+        return [self.toRecord(row) for row in rows]
+
+    def etag(self):
+        row = self.connection().execute("SELECT epoch, version FROM versions WHERE name = ?", (self.table,)).fetchone()
+        return "{}-{}".format(*row)
+
+    # the ETag is read before the record, so a record changed after it was read is not cached under the new ETag
+    def encoded(self, ID):
+        etag = self.etag()
+        self.encodedCache.validate(etag)
+        data = self.encodedCache.get(ID)
+        if data is None:
+            record = self.get(ID)
+            if record is None:
+                return None
+            data = encode(record)
+            self.encodedCache.put(ID, data, etag)
+        return data
+
+    def encodedPage(self, after=0, limit=None):
+        etag = self.etag()
+        self.encodedCache.validate(etag)
+        pairs = []
+        for record in self.page(after, limit):
+            data = self.encodedCache.get(record["ID"], False)
+            if data is None:
+                data = encode(record)
+                self.encodedCache.put(record["ID"], data, etag, evict=False)
+            pairs.append((record["ID"], data))
+        return pairs
+
+    def query(self, filters, order_by=None, descending=False, limit=None, after=None):
+        conditions = []
+        params = []
+        for field, (low, high) in filters.items():
+            if field not in self.sortedFields:
+                raise KeyError(field)
+            conditions.append("{} IS NOT NULL".format(field))
+            if low is not None:
+                conditions.append("{} >= ?".format(field))
+                params.append(low)
+            if high is not None:
+                conditions.append("{} <= ?".format(field))
+                params.append(high)
+        if order_by is not None and order_by not in self.sortedFields:
+            raise KeyError(order_by)
+        if order_by is not None and order_by not in filters:
+            # as in MemoryTable, whose sorted indexes leave them out, the records without a value are not returned
+            conditions.append("{} IS NOT NULL".format(order_by))
+        if after is not None:
+            if order_by is not None:
+                conditions.append("({}, ID) {} (?, ?)".format(order_by, "<" if descending else ">"))
+                params.extend(after)
+            else:
+                conditions.append("ID {} ?".format("<" if descending else ">"))
+                params.append(after)
+        order = " DESC" if descending else ""
+        sql = "SELECT * FROM {} {} ORDER BY {} LIMIT ?".format(
+            self.table, "WHERE " + " AND ".join(conditions) if conditions else "",
+            "{0}{1}, ID{1}".format(order_by, order) if order_by is not None else "ID" + order)
+        rows = self.connection().execute(sql, params + [-1 if limit is None else limit])
+        return [self.toRecord(row) for row in rows]
+
+    # stats loads the aggregates from the table if it changed since they were last updated, which only happens once the
+    # table was changed by another process
+    def stats(self):
+        if self.aggregates is None:
+            return None
+        with self.aggregatesLock:
+            db = self.connection()
+            db.execute("BEGIN")  # the version and the records are read from the same snapshot
+            try:
+                version = self.currentVersion(db)
+                if version != self.aggregatesVersion:
+                    columns = self.aggregates.columns
+                    rows = db.execute("SELECT {} FROM {}".format(", ".join(columns), self.table)).fetchall()
+                    self.aggregates.load(len(rows), {column: [row[j] for row in rows]
+                                                     for j, column in enumerate(columns)})
+                    self.aggregatesVersion = version
+            finally:
+                db.execute("COMMIT")
+        return self.aggregates
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+
+
+# inRange returns True if value is within low and high (inclusive), where low or high None means unbounded
+def inRange(value, low, high):
+    return value is not None and (low is None or value >= low) and (high is None or value <= high)
+
+
+# the fields, other than ID and name, of the records of each table
+COURSE_FIELDS = ["cal", "size", "sodium", "sugar"]
+MENU_FIELDS = ["appetizer", "main", "dessert", "cal", "sodium", "sugar"]
+# the fields of a menu that refer to courses
+MENU_REFS = ["appetizer", "main", "dessert"]
+# the fields of courses and menus that can be queried by range
+COURSE_SORTED = ["cal", "size", "sodium", "sugar"]
+MENU_SORTED = ["cal", "sodium", "sugar"]
+# the fields of courses and menus aggregated for GET /stats (see table_stats.py)
+STATS_FIELDS = ["cal", "sodium", "sugar"]
+
+
+# makeTables returns the tables for courses (dishes) and menus (meals) of the backend chosen by the environment
+# variable STORE_BACKEND: "memory" (the default) or "sqlite".   The SQLite database file is STORE_PATH.
+# If JOURNAL_DIR is set, the memory tables are made durable by a Journal kept in that directory, and are recovered from
+# it.   JOURNAL_SNAPSHOT_EVERY is the number of operations between snapshots, and if JOURNAL_FSYNC is "1" every
+# operation is synced to disk before it returns.
+def makeTables():
+    backend = os.environ.get("STORE_BACKEND", "memory")
+    cacheSize = int(os.environ.get("RESPONSE_CACHE_SIZE", "10000"))  # encoded records cached per table
+    if backend == "memory":
+        directory = os.environ.get("JOURNAL_DIR")
+        if not directory:
+            return (MemoryTable(COURSE_FIELDS, sortedFields=COURSE_SORTED, cache_size=cacheSize,
+                                statsFields=STATS_FIELDS),
+                    MemoryTable(MENU_FIELDS, MENU_REFS, MENU_SORTED, cache_size=cacheSize, statsFields=STATS_FIELDS))
+        journal = Journal(directory, snapshot_every=int(os.environ.get("JOURNAL_SNAPSHOT_EVERY", "100000")),
+                          fsync=os.environ.get("JOURNAL_FSYNC") == "1")
+        courseTable = MemoryTable(COURSE_FIELDS, sortedFields=COURSE_SORTED, name="courses", journal=journal,
+                                  cache_size=cacheSize)
+        menuTable = MemoryTable(MENU_FIELDS, MENU_REFS, MENU_SORTED, name="menus", journal=journal,
+                                cache_size=cacheSize)
+        journal.recover({"courses": courseTable, "menus": menuTable})
+        courseTable.setStats(STATS_FIELDS)
+        menuTable.setStats(STATS_FIELDS)
+        return courseTable, menuTable
+    elif backend == "sqlite":
+        path = os.environ.get("STORE_PATH", "meals.db")
+        return (SQLiteTable(path, "courses", COURSE_FIELDS, sortedFields=COURSE_SORTED, cache_size=cacheSize,
+                            statsFields=STATS_FIELDS),
+                SQLiteTable(path, "menus", MENU_FIELDS, MENU_REFS, MENU_SORTED, cache_size=cacheSize,
+                            statsFields=STATS_FIELDS))
+    else:
+        raise ValueError("unknown STORE_BACKEND " + backend)
@@ -0,0 +1,211 @@
+# Aggregates of the records of a table (see storage.py), kept up to date as records are added and removed, so that the
+# statistics of the whole catalog (GET /stats) are read without visiting the records:
+# (1) the number of records, and for each aggregated field (e.g. cal, sodium and sugar) the number of records with a
+#     value, the sum of the values and a QuantileSketch of them (for percentiles).
+# (2) for each reference field (e.g. the appetizer, main and dessert of a meal), the number of records referring to
+#     each ID, ranked (RankedCounts), e.g. the dishes used by the most meals.
+#
+# Percentile sketches such as t-digest or KLL cannot remove a value once it was added, but a record can be deleted at
+# any time.   QuantileSketch counts the values in buckets whose bounds grow geometrically (as DDSketch does): removing a
+# value decrements the count of its bucket, and any percentile it returns is within accuracy (1%) of a value of the
+# right rank.   The number of buckets only depends on the range of the values (e.g. about 700 for values between 0.01
+# and 10000), not on their number.
+import heapq
+import math
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+# PERCENTILES are the percentiles returned by TableStats.summary
+PERCENTILES = (25, 50, 75, 90, 95, 99)
+
+# values whose magnitude is below TINY are counted as 0, so tiny values do not add buckets
+TINY = 1e-9
+
+
+# isNumber tells whether value is aggregated (None, e.g. the nutrition of a pending dish, is not)
+def isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class QuantileSketch:
+    def __init__(self, accuracy=0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.logGamma = math.log(self.gamma)
+        self.positive = Counter()  # maps the key of each bucket of positive values to the number of values in it
+        self.negative = Counter()  # the same for the negative values, by the key of their magnitude
+        self.zeros = 0
+        self.count = 0
+
+    # key returns the key of the bucket of the magnitude of value: the bucket (gamma^(key-1), gamma^key]
+    def key(self, value):
+        return math.ceil(math.log(abs(value)) / self.logGamma)
+
+    # add adds value n times, or removes it -n times if n is negative
+    def add(self, value, n=1):
+        if abs(value) < TINY:
+            self.zeros = self.zeros + n
+        else:
+            buckets = self.positive if value > 0 else self.negative
+            key = self.key(value)
+            buckets[key] = buckets[key] + n
+            if buckets[key] == 0:
+                del buckets[key]
+        self.count = self.count + n
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    # addMany adds all the values, faster than adding them one by one
+    def addMany(self, values):
+        for value in values:
+            if abs(value) < TINY:
+                self.zeros = self.zeros + 1
+            elif value > 0:
+                self.positive[self.key(value)] += 1
+            else:
+                self.negative[self.key(value)] += 1
+            self.count = self.count + 1
+
+    # value returns the value that stands for the bucket with the given key: the value within accuracy of the whole
+    # bucket
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    # quantiles returns the values of the given ranks q (0 <= q <= 1), e.g. 0.5 for the median, or None for each if
+    # there are no values.   The value of rank q is the nearest-rank one: the ceil(q * count)-th smallest (the smallest
+    # for q = 0).   The buckets are walked once for all of them, in order of value.
+    def quantiles(self, qs):
+        if self.count <= 0:
+            return [None] * len(qs)
+        buckets = [(-self.value(key), n) for key, n in sorted(self.negative.items(), reverse=True)]
+        if self.zeros:
+            buckets.append((0.0, self.zeros))
+        buckets.extend((self.value(key), n) for key, n in sorted(self.positive.items()))
+        order = sorted(range(len(qs)), key=lambda i: qs[i])
+        results = [None] * len(qs)
+        seen = 0
+        buckets = iter(buckets)
+        for i in order:
+            # rounded first, so that e.g. 0.95 * 20 is rank 19 and not 20
+            rank = max(1, math.ceil(round(qs[i] * self.count, 9)))
+            while seen < rank:
+                value, n = next(buckets)
+                seen = seen + n
+            results[i] = value
+        return results
+
+
+# RankedCounts counts how many times each key is used, and returns the most used keys without sorting all of them:
+# the keys are grouped by their count, and the distinct counts are kept sorted.
+class RankedCounts:
+    def __init__(self):
+        self.counts = {}  # maps each key used to its count
+        self.keysByCount = {}  # maps each count to the set of keys with that count
+        self.distinct = []  # the counts of keysByCount, in increasing order
+
+    def change(self, key, delta):
+        old = self.counts.get(key, 0)
+        new = old + delta
+        if old:
+            keys = self.keysByCount[old]
+            keys.discard(key)
+            if not keys:
+                del self.keysByCount[old]
+                del self.distinct[bisect_left(self.distinct, old)]
+        if new > 0:
+            self.counts[key] = new
+            if new not in self.keysByCount:
+                self.keysByCount[new] = set()
+                insort(self.distinct, new)
+            self.keysByCount[new].add(key)
+        else:
+            self.counts.pop(key, None)
+
+    # top returns the list of the (at most) n most used (key, count) pairs, most used first (and smallest key first
+    # for the same count)
+    def top(self, n):
+        pairs = []
+        for count in reversed(self.distinct):
+            if len(pairs) >= n:
+                break
+            pairs.extend((key, count) for key in heapq.nsmallest(n - len(pairs), self.keysByCount[count]))
+        return pairs
+
+
+# TableStats holds the aggregates of the records of a table.   fields are the aggregated fields, and refs the reference
+# fields whose values are counted.   A record referring to the same ID in several of its refs counts once for that ID.
+# It is thread-safe.
+class TableStats:
+    def __init__(self, fields, refs=()):
+        self.fields = tuple(fields)
+        self.refs = tuple(refs)
+        self.columns = self.fields + tuple(ref for ref in self.refs if ref not in self.fields)  # the fields read
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.sums = {field: 0.0 for field in self.fields}
+        self.sketches = {field: QuantileSketch() for field in self.fields}
+        self.usage = RankedCounts()
+        self.version = 0  # incremented on every change
+        self.cached = None  # (version, top, summary) of the last summary returned
+
+    def add(self, record):
+        self.update(record, 1)
+
+    def remove(self, record):
+        self.update(record, -1)
+
+    # update adds (sign 1) or removes (sign -1) record
+    def update(self, record, sign):
+        with self.lock:
+            self.count = self.count + sign
+            for field in self.fields:
+                value = record.get(field)
+                if isNumber(value):
+                    sketch = self.sketches[field]
+                    sketch.add(value, sign)
+                    # the sum is reset when no value is left, so the rounding errors of removals do not add up
+                    self.sums[field] = self.sums[field] + sign * value if sketch.count else 0.0
+            for target in set(record.get(ref) for ref in self.refs):
+                if target is not None:
+                    self.usage.change(target, sign)
+            self.version = self.version + 1
+
+    # load replaces the aggregates with those of count records, given the values of each of the columns of all the
+    # records (a dictionary mapping each field of columns to the list of its values, in the same order)
+    def load(self, count, values):
+        with self.lock:
+            version = self.version
+            self.clear()
+            self.count = count
+            for field in self.fields:
+                numbers = [value for value in values[field] if isNumber(value)]
+                self.sketches[field].addMany(numbers)
+                self.sums[field] = math.fsum(numbers)
+            refs = [values[ref] for ref in self.refs]
+            for targets in zip(*refs):
+                for target in set(targets):
+                    if target is not None:
+                        self.usage.change(target, 1)
+            self.version = version + 1
+
+    # summary returns {"count": number of records, "fields": {field: {"count", "mean", "p25", ...}}, "top": [(ID,
+    # count), ...]} where top holds the top IDs most referred to.   It is computed again only after a change.
+    def summary(self, top=0):
+        with self.lock:
+            if self.cached is not None and self.cached[:2] == (self.version, top):
+                return self.cached[2]
+            fields = {}
+            for field in self.fields:
+                sketch = self.sketches[field]
+                values = sketch.quantiles([p / 100.0 for p in PERCENTILES])
+                stats = {"count": sketch.count, "mean": self.sums[field] / sketch.count if sketch.count else None}
+                for p, value in zip(PERCENTILES, values):
+                    stats["p%d" % p] = None if value is None else round(value, 2)
+                fields[field] = stats
+            summary = {"count": self.count, "fields": fields, "top": self.usage.top(top)}
+            self.cached = (self.version, top, summary)
+            return summary
@@ -0,0 +1,19 @@
+# Fixtures of the tests of meals.py, which are run with:  python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meals  # noqa: E402
+
+
+# client is the test client of the server, initialized with empty tables, once in memory and once in a SQLite file (see
+# storage.makeTables)
+@pytest.fixture(params=["memory", "sqlite"])
+def client(request, tmp_path, monkeypatch):
+    monkeypatch.setenv("STORE_BACKEND", request.param)
+    monkeypatch.setenv("STORE_PATH", str(tmp_path / "meals.db"))
+    monkeypatch.delenv("JOURNAL_DIR", raising=False)
+    meals.initialize()
+    return meals.app.test_client()
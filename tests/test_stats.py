@@ -0,0 +1,41 @@
+# Tests of GET /stats (see meals.Stats)
+import meals
+from table_stats import PERCENTILES
+
+
+def dish(name, cal, sodium, sugar):
+    return {"name": name, "ID": None, "cal": cal, "size": None if cal is None else 100.0, "sodium": sodium,
+            "sugar": sugar}
+
+
+# a dish whose nutrition is pending has no value, and is neither the min nor the max of a field
+def test_min_and_max_skip_pending_dishes(client):
+    meals.courses.insertCourses([dish("pending", None, None, None), dish("soup", 120.5, 400, 2.5),
+                                 dish("cake", 450.0, 200, 30.0), dish("failed", None, None, None)])
+    stats = client.get("/stats").get_json()["dishes"]
+    assert stats["count"] == 4
+    assert stats["cal"]["count"] == 2
+    assert (stats["cal"]["min"], stats["cal"]["max"]) == (120.5, 450.0)
+    assert (stats["sodium"]["min"], stats["sodium"]["max"]) == (200, 400)
+    assert (stats["sugar"]["min"], stats["sugar"]["max"]) == (2.5, 30.0)
+
+
+def test_no_values(client):
+    meals.courses.insertCourses([dish("pending", None, None, None)])
+    stats = client.get("/stats").get_json()["dishes"]
+    assert stats["count"] == 1
+    assert stats["cal"] == {"count": 0, "mean": None, "min": None, "max": None, "p25": None, "p50": None,
+                            "p75": None, "p90": None, "p95": None, "p99": None}
+
+
+# the percentiles are nearest-rank ones, within 1% of a stored value, and never outside the min and max
+def test_percentiles(client):
+    meals.courses.insertCourses([dish("soup", 855.5, 100, 33.0), dish("cake", 1192.0, 100, 40.0),
+                                 dish("salad", 1192.0, 100, 50.0)])
+    stats = client.get("/stats").get_json()["dishes"]
+    assert abs(stats["cal"]["p25"] - 855.5) <= 855.5 * 0.01
+    for p in ("p50", "p75", "p90", "p95", "p99"):
+        assert 1192.0 * 0.99 <= stats["cal"][p] <= 1192.0
+    assert all(stats["sodium"]["p%d" % p] == 100 for p in PERCENTILES)
+    assert 33.0 <= stats["sugar"]["p25"] <= 33.0 * 1.01
+    assert 50.0 * 0.99 <= stats["sugar"]["p99"] <= 50.0
@@ -0,0 +1,32 @@
+# Tests of POST /meals/suggest (see meals.MealSuggestions)
+import pytest
+
+import meals
+
+
+def addDishes():
+    meals.courses.insertCourses([{"name": "dish" + str(i), "ID": None, "cal": 100.0 + i, "size": 100.0,
+                                  "sodium": 10 * i, "sugar": 1.0 + i} for i in range(6)])
+
+
+def test_suggest(client):
+    addDishes()
+    response = client.post("/meals/suggest", json={"minimize": "cal", "k": 2})
+    assert response.status_code == 200
+    suggestions = response.get_json()
+    assert len(suggestions) == 2
+    assert suggestions[0]["cal"] == 303.0
+
+
+# k must be between 1 and MAX_SUGGESTIONS, so that one request cannot make the optimizer enumerate every triple
+@pytest.mark.parametrize("k", [0, -1, meals.MAX_SUGGESTIONS + 1, 10 ** 9])
+def test_k_out_of_range(client, k):
+    addDishes()
+    response = client.post("/meals/suggest", json={"minimize": "cal", "k": k})
+    assert (response.status_code, response.get_json()) == (400, -1)
+
+
+def test_k_at_the_bounds(client):
+    addDishes()
+    for k in (1, meals.MAX_SUGGESTIONS):
+        assert client.post("/meals/suggest", json={"minimize": "cal", "k": k}).status_code == 200